@@ -0,0 +1,48 @@
+'''
+Lists, filters and sorts checkpoints from their metadata sidecars (see src/utils/checkpoint_metadata.py), without
+opening any of them.
+
+    python checkpoints.py models/servobot_checkpoints --sort score
+    python checkpoints.py models/sweeps --robot servobot --obs-size 65
+    python checkpoints.py models/arachne_checkpoints --backfill --robot arachne   # sidecars for older checkpoints
+'''
+
+import os
+import argparse
+from collections import Counter
+
+from src.utils.config import ROBOTS
+from src.utils.checkpoint_metadata import find_checkpoints, backfill_metadata
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='List checkpoints from their metadata')
+    parser.add_argument('directory', type=str, help='Folder to search (recursively)')
+    parser.add_argument('--robot', type=str, default=None, choices=list(ROBOTS.keys()),
+                        help='Only list checkpoints of this robot (with --backfill: the robot to record)')
+    parser.add_argument('--obs-size', type=int, default=None,
+                        help='Only list checkpoints with this observation size')
+    parser.add_argument('--sort', type=str, default='timesteps', choices=['timesteps', 'score', 'saved'],
+                        help='Sort order, best/latest last (default: timesteps)')
+    parser.add_argument('--backfill', action='store_true',
+                        help="First write sidecars for checkpoints that don't have one (opens those zips, once)")
+    args = parser.parse_args()
+
+    if args.backfill:
+        print(f"Wrote {backfill_metadata(args.directory, robot=args.robot)} sidecars")
+
+    checkpoints = find_checkpoints(args.directory)
+    if args.robot:
+        checkpoints = [c for c in checkpoints if c['robot'] == args.robot]
+    if args.obs_size is not None:
+        checkpoints = [c for c in checkpoints if c['observation_shape'] == [args.obs_size]]
+    sort_key = {'timesteps': lambda c: c['timesteps'], 'saved': lambda c: c['saved'],
+                'score': lambda c: float('-inf') if c['eval_score'] is None else c['eval_score']}[args.sort]
+    checkpoints.sort(key=sort_key)
+
+    print(f"{'checkpoint':<60} {'robot':<17} {'obs':>5} {'timesteps':>10} {'score':>9}  config")
+    for c in checkpoints:
+        score = '' if c['eval_score'] is None else f"{c['eval_score']:.2f}"
+        print(f"{os.path.relpath(c['path'], args.directory):<60} {c['robot']:<17} {c['observation_shape'][0]:>5} "
+              f"{c['timesteps']:>10} {score:>9}  {c['env_config_hash'] or '-'}")
+    configs = Counter(c['env_config_hash'] for c in checkpoints)
+    print(f"\n{len(checkpoints)} checkpoints from {len(configs)} env config(s)")
@@ -1,141 +1,107 @@
 """
-Emergency Diagnostic Script - Check if rewards are correctly scaled
-Run this to verify your reward function is working properly
-"""
-
-import numpy as np
-import sys
-import os
-
-from src.envs.env import BaseEnv
-from src.utils.utils import select_robot
-
-print("="*70)
-print("EMERGENCY REWARD SCALE DIAGNOSTIC")
-print("="*70)
-print()
-
-# Create environment
-robot_choice = 'robots/arachne/arachne.urdf'
-env = BaseEnv(urdf_filename=robot_choice, render_mode=None)
-
-print(f"Testing reward function for {robot_choice}...")
-print()
-
-# Reset environment
-obs, info = env.reset()
-
-# Take 10 random actions and record rewards
-rewards = []
-episode_reward = 0
-step_count = 0
-
-print("Taking 10 random actions and measuring rewards:")
-print("-" * 70)
-
-for i in range(10):
-    action = env.action_space.sample()
-    obs, reward, terminated, truncated, info = env.step(action)
-    
-    rewards.append(reward)
-    episode_reward += reward
-    step_count += 1
-    
-    print(f"Step {i+1}: reward = {reward:.2f}")
-    
-    if terminated or truncated:
-        print(f"  (Episode ended)")
-        break
-
-print("-" * 70)
-print()
+Reward Scale Diagnostic - Monte Carlo check of what the reward terms actually look like
+Runs lots of headless episodes (random actions and/or trained checkpoints) in parallel and reports per-term
+reward distributions, how much of the total each term makes up, and the episode return distribution.
 
-# Calculate statistics
-avg_reward = np.mean(rewards)
-max_reward = np.max(rewards)
-min_reward = np.min(rewards)
+    python diagnose_reward_scale.py --robot servobot --episodes 2000
+    python diagnose_reward_scale.py --robot servobot --model models/servobot_checkpoints/saved/jorkbot9000.zip
 
-print("RESULTS:")
-print(f"  Average reward per step: {avg_reward:.2f}")
-print(f"  Max reward seen: {max_reward:.2f}")
-print(f"  Min reward seen: {min_reward:.2f}")
-print(f"  Episode reward so far: {episode_reward:.2f}")
-print()
-
-# Expected values
-expected_max = 21.52
-expected_typical = 10.0
-
-print("EXPECTED VALUES (with correct reward scale):")
-print(f"  Theoretical max per step: ~{expected_max:.2f}")
-print(f"  Typical per step (early training): ~{expected_typical:.2f}")
-print()
-
-print("="*70)
-print("DIAGNOSIS:")
-print("="*70)
+Results are cached (see src/utils/reward_diagnostics.py), so rerunning with nothing changed is instant.
+"""
 
-if max_reward > 50:
-    print("🚨 CRITICAL: Rewards are WAY TOO HIGH!")
-    print(f"   Max reward {max_reward:.2f} >> expected {expected_max:.2f}")
-    print()
-    print("   This means rewards are still being accumulated incorrectly!")
-    print("   Possible causes:")
-    print("     1. Reward calculated in physics loop (10x accumulation)")
-    print("     2. Survival reward still scaled by steps_taken")
-    print("     3. Some other accumulation bug")
-    print()
-    print("   ACTION: Fix the reward calculation in src/envs/env.py")
-    
-elif max_reward > 30:
-    print("⚠️  WARNING: Rewards seem higher than expected")
-    print(f"   Max reward {max_reward:.2f} > expected {expected_max:.2f}")
-    print()
-    print("   This might cause training issues.")
-    print("   Check reward components are balanced correctly.")
-    
-elif max_reward < 5:
-    print("⚠️  WARNING: Rewards seem very low")
-    print(f"   Max reward {max_reward:.2f} << expected {expected_max:.2f}")
-    print()
-    print("   Robot might not be getting enough signal to learn.")
-    print("   Check that velocity/orientation rewards are working.")
-    
-else:
-    print("✅ Reward scale looks reasonable!")
-    print(f"   Max reward {max_reward:.2f} is in expected range")
+import os
+import argparse
+
+from src.utils.config import ROBOTS
+from src.utils.reward_diagnostics import collect_reward_terms, summarize, plot_summary
+
+
+def sparkline(counts):
+    ''' Tiny text histogram '''
+    blocks = " ▁▂▃▄▅▆▇█"
+    peak = max(counts.max(), 1)
+    return "".join(blocks[int(round(8 * count / peak))] for count in counts)
+
+
+def print_summary(label, summary, weights):
+    print("="*100)
+    print(f"{label}: {summary['episodes']} episodes, {summary['steps']} steps "
+          f"(mean length {summary['returns']['length']:.1f} steps)")
+    print("="*100)
+    print(f"{'term':>13} | {'mean':>9} {'std':>8} {'p5':>9} {'p50':>9} {'p95':>9} | {'share':>6} | histogram (min .. max)")
+    for name, stats in summary['terms'].items():
+        print(f"{name:>13} | {stats['mean']:9.3f} {stats['std']:8.3f} {stats['p5']:9.3f} {stats['p50']:9.3f} "
+              f"{stats['p95']:9.3f} | {stats['share']:6.1%} | {sparkline(stats['histogram'][0])} "
+              f"({stats['min']:.2f} .. {stats['max']:.2f})")
+    returns = summary['returns']
+    print(f"{'episode return':>13} | {returns['mean']:9.1f} {returns['std']:8.1f} {returns['p5']:9.1f} "
+          f"{returns['p50']:9.1f} {returns['p95']:9.1f} |        | {sparkline(returns['histogram'][0])}")
     print()
-    print("   If training is still failing, the issue is likely:")
-    print("     - Learning rate too high")
-    print("     - Value function architecture")
-    print("     - Task is too difficult")
-
-print("="*70)
-print()
-
-# Estimate what episode reward should be
-estimated_ep_reward = avg_reward * 120  # Typical episode length
-print(f"ESTIMATED EPISODE REWARD (120 steps): ~{estimated_ep_reward:.0f}")
-print()
 
-if estimated_ep_reward > 10000:
-    print("🚨 Episode rewards will be ~{:.0f}".format(estimated_ep_reward))
-    print("   This is TOO HIGH for value function to learn!")
-    print("   Explained variance will stay at 0")
-    print("   KL divergence will spike uncontrollably")
+    print("DIAGNOSIS:")
+    # Best possible step: full velocity tracking + survival, no penalties
+    best_step = weights.get('FORWARD_VEL_WEIGHT', 0.0) + weights.get('ANGULAR_VEL_WEIGHT', 0.0) + weights.get('SURVIVAL_WEIGHT', 0.0)
+    print(f"  Best possible reward per step (from the weights): {best_step:.2f}, measured max: {summary['terms']['total']['max']:.2f}")
+    dominant = max((name for name in summary['terms'] if name != 'total'), key=lambda name: summary['terms'][name]['share'])
+    if summary['terms'][dominant]['share'] > 0.8:
+        print(f"  ⚠️  '{dominant}' makes up {summary['terms'][dominant]['share']:.0%} of the reward, the other terms barely matter")
+    silent = [name for name, stats in summary['terms'].items() if name != 'total' and stats['share'] < 0.001]
+    if silent:
+        print(f"  ℹ️  Terms that (almost) never contribute: {', '.join(silent)}")
+    if returns['p95'] > 10000:
+        print(f"  🚨 Episode returns reach ~{returns['p95']:.0f}, TOO HIGH for the value function to learn "
+              f"(explained variance will stay at 0, KL will spike)")
+    elif returns['p95'] > 5000:
+        print(f"  ⚠️  Episode returns reach ~{returns['p95']:.0f}, this might be too high. Monitor explained variance closely.")
+    else:
+        print(f"  ✅ Episode returns (p95 ~{returns['p95']:.0f}) are a reasonable scale for PPO to learn.")
     print()
-    print("   YOU MUST FIX THE REWARD SCALE BEFORE TRAINING")
-elif estimated_ep_reward > 5000:
-    print("⚠️  Episode rewards will be ~{:.0f}".format(estimated_ep_reward))
-    print("   This might be too high.")
-    print("   Monitor explained variance closely.")
-else:
-    print("✅ Episode rewards should be ~{:.0f}".format(estimated_ep_reward))
-    print("   This is a reasonable scale for PPO to learn.")
 
-env.close()
 
-print()
-print("="*70)
-print("Diagnostic complete!")
-print("="*70)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Monte Carlo reward scale diagnostics')
+    parser.add_argument('--robot', type=str, default='arachne', choices=list(ROBOTS.keys()),
+                        help='Robot to diagnose (default: arachne)')
+    parser.add_argument('--episodes', type=int, default=1000,
+                        help='Episodes per policy (default: 1000)')
+    parser.add_argument('--model', type=str, nargs='*', default=[],
+                        help='Checkpoint(s) to diagnose as well as the random policy')
+    parser.add_argument('--no-random', action='store_true',
+                        help="Skip the random policy (only diagnose --model checkpoints)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per CPU core)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='First episode seed (default: 0)')
+    parser.add_argument('--cache-dir', type=str, default='models/reward_diagnostics',
+                        help="Where results are cached (default: models/reward_diagnostics)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write cached results")
+    parser.add_argument('--plot', type=str, default='reward_diagnostics.png',
+                        help='Where to save the histograms (default: reward_diagnostics.png)')
+    args = parser.parse_args()
+
+    policies = ([] if args.no_random else ['random']) + args.model
+    if not policies:
+        parser.error("nothing to diagnose: pass --model or drop --no-random")
+
+    from src.utils.utils import load_all_params
+    weights = load_all_params(args.robot)
+
+    summaries = {}
+    for policy in policies:
+        label = policy if policy == 'random' else os.path.basename(policy)
+        try:
+            results = collect_reward_terms(args.robot, policy, episodes=args.episodes, seed=args.seed, workers=args.workers,
+                                           cache_dir=None if args.no_cache else args.cache_dir)
+        except ValueError as e:
+            print(f"Skipping {label}: {e}\n")
+            continue
+        if results['cached']:
+            print(f"(using cached results for {label})")
+        summaries[label] = summarize(results)
+        print_summary(label, summaries[label], weights)
+
+    if not summaries:
+        exit(1)
+    plot_summary(summaries, args.plot)
+    print(f"Histograms saved to {args.plot}")
@@ -0,0 +1,35 @@
+'''
+Population-based training: a population of PPO learners trained in parallel, where the worst members regularly
+continue from the best members' models with perturbed learning rates, entropy coefficients and reward weights.
+
+    python pbt.py sweeps/servobot_pbt.json --workers 8
+
+See src/utils/pbt.py for the file format. Results go into models/pbt/<file name>/ by default, and rerunning the same
+command resumes an interrupted run.
+'''
+
+import os
+import argparse
+
+from src.utils.pbt import load_pbt, run_pbt
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Population-based training of PPO hyperparameters and reward weights')
+    parser.add_argument('pbt_file', type=str,
+                        help='JSON file with the robot, population, budgets and search space (format in src/utils/pbt.py)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of members trained in parallel (default: one per CPU core)')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Folder for the database and models (default: models/pbt/<pbt file name>/)')
+    args = parser.parse_args()
+
+    spec = load_pbt(args.pbt_file)
+    out_dir = args.out or os.path.join('models', 'pbt', os.path.splitext(os.path.basename(args.pbt_file))[0])
+    leaderboard = run_pbt(spec, out_dir, workers=args.workers)
+
+    print(f"\n{'='*50}")
+    print("Final population:")
+    print(f"{'='*50}")
+    for member, score, params, model_path in leaderboard:
+        print(f"Member {member:2d}  score {score:10.2f}  {params}")
+    print(f"\nBest model: {leaderboard[0][3]} (its lineage is in {os.path.join(out_dir, 'best.json')})")
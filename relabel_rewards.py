@@ -0,0 +1,32 @@
+'''
+Shows what new reward weights would do to already recorded rollouts, without re-simulating anything.
+
+    python train.py --robot servobot --record-trajectories trajectories/servobot
+    python relabel_rewards.py trajectories/servobot --set FORWARD_VEL_WEIGHT=5 FALLEN_PENALTY=50
+
+Prints per-term reward distributions and shares of the total for the recorded and the new weights, and how the
+episode returns shift (see src/utils/relabel.py).
+'''
+
+import argparse
+
+from src.utils.trajectories import load_trajectories
+from src.utils.relabel import relabel_report, print_relabel_report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recompute rewards of recorded trajectories with new weights')
+    parser.add_argument('trajectories', type=str, nargs='+',
+                        help='Trajectory folder(s) or .npz file(s) recorded with --record-trajectories')
+    parser.add_argument('--set', type=str, nargs='*', default=[], metavar='NAME=VALUE',
+                        help='Weights to change, e.g. FORWARD_VEL_WEIGHT=5 (the rest keep their recorded values)')
+    args = parser.parse_args()
+
+    weights = {}
+    for assignment in args.set:
+        name, _, value = assignment.partition('=')
+        weights[name] = float(value)
+
+    paths = args.trajectories[0] if len(args.trajectories) == 1 else args.trajectories
+    data, header = load_trajectories(paths)
+    print(f"Robot: {header['robot_name']}, changed weights: {weights or 'none'}")
+    print_relabel_report(relabel_report(data, header, weights))
@@ -14,6 +14,7 @@ import os
 import time
 import math
 import json
+import logging
 import numpy as np
 import pybullet as p
 import pybullet_data
@@ -29,7 +30,21 @@ from ..utils import utils
 
 from ..utils import config
 
-from ..utils.kinematics import IK
+from ..utils.kinematics import IK, IKTable, JOINT_NAMES
+from ..utils.urdf_kinematics import LegKinematics
+from ..utils.terrain import Terrain
+from ..utils.randomization import DomainRandomizer
+from ..utils.contacts import FootContacts
+from ..utils.height_scan import HeightScan
+from ..utils.camera import Camera, FollowCamera
+from ..utils.realtime import RealTimePacer
+from ..utils.live_view import StatePublisher
+from ..utils.reward import reward_kernel, REWARD_WEIGHTS
+from ..utils.log import get_logger, EventLog
+from ..utils.observations import resolve_components, ObservationPlan
+from ..utils.frame_history import FrameHistory, stacked_segments
+
+logger = get_logger(__name__)
 
 
 '''
@@ -84,14 +99,27 @@ class BaseEnv(gym.Env):
     A custom environment that wraps the PyBullet simulation for
     reinforcement learning.
     """
-    metadata = {'render_modes': ['human'], 'render_fps': 240}
+    # One rendered frame per env step: action_skip (10) physics steps of 1/240 s
+    metadata = {'render_modes': ['human', 'rgb_array'], 'render_fps': 24}
 
     # Change: init now accepts a target box (center and size).
     def __init__(self, 
                  render_mode=None, 
                  urdf_filename="simple_quadruped.urdf", 
                  start_position=[0, 0, 1],
-                 target_speed = 1,):
+                 target_speed = 1,
+                 foot_obs=False,
+                 action_mode='joint',
+                 terrain=None,
+                 domain_randomization=False,
+                 contact_obs=False,
+                 height_scan=False,
+                 camera_obs=False,
+                 observation=None,
+                 frame_stack=1,
+                 stack_actions=False,
+                 live_view=None,
+                 reward_history_file=True,):
         super(BaseEnv, self).__init__()
         '''
         This class implements the custom Gym environment for our robot RL training!
@@ -116,7 +144,13 @@ class BaseEnv(gym.Env):
 
         self.rolling_avg_speed = np.array([0.0, 0.0, 0.0])
 
-        params = utils.load_all_params(robot_name=os.path.splitext(os.path.basename(urdf_filename))[0])
+        # Wall-clock time spent in different parts of reset/step: name -> [total seconds, number of calls]
+        self.timings = {}
+        # Events that can happen every step (jumps, config updates) are counted and logged at most every 10 s
+        self.log = EventLog(logger)
+
+        self.robot_name = os.path.splitext(os.path.basename(urdf_filename))[0]
+        params = utils.load_all_params(robot_name=self.robot_name)
         for param, value in params.items():
                 setattr(self, param, value)
         # load parameters from config.py
@@ -129,6 +163,12 @@ class BaseEnv(gym.Env):
         p.changeDynamics(bodyUniqueId=self.plane_id, 
                  linkIndex=-1,      # -1 for the base
                  lateralFriction=0.8)
+        # Optional procedural terrain on top of the plane, regenerated in place on every reset.
+        # terrain is a list of terrain types (see utils/terrain.py) or a dict of Terrain keyword arguments.
+        self.terrain = None
+        if terrain:
+            terrain_kwargs = dict(terrain) if isinstance(terrain, dict) else {'types': list(terrain)}
+            self.terrain = Terrain(**terrain_kwargs)
 
         start_orientation = p.getQuaternionFromEuler([0, 0, 0])
         self.start_position = self.START_POSITION if self.START_POSITION !=0 else start_position
@@ -140,18 +180,67 @@ class BaseEnv(gym.Env):
         self.action_factor = self.joint_limit
         if self.ACTION_LIMIT >0:
             self.action_factor *= self.ACTION_LIMIT
+        # Observation components, in order: the robot's config.py 'observation' list (or the observation argument),
+        # plus the optional sensors turned on below (see observations.py)
+        self.observation_components = resolve_components(
+            observation if observation is not None else config.ROBOTS[self.robot_name].get('observation'),
+            foot_obs=foot_obs, contact_obs=contact_obs, height_scan=height_scan, camera_obs=camera_obs)
+        # Optionally observe the last frame_stack frames, each with the action before it if stack_actions (frame_history.py)
+        if frame_stack < 1:
+            raise ValueError(f"frame_stack must be at least 1, got {frame_stack}")
+        self.frame_stack = frame_stack
+        self.stack_actions = stack_actions
+        # Optionally add foot positions (computed with forward kinematics) to the observation
+        self.foot_obs = 'foot_positions' in self.observation_components
+        # 'joint' actions are joint angle offsets from home, 'foot' actions are foot position offsets from home (servobot only)
+        if action_mode not in ('joint', 'foot'):
+            raise ValueError(f"Unknown action mode '{action_mode}', expected 'joint' or 'foot'")
+        self.action_mode = action_mode
+        self.home_height = 0.18
+        # Generic leg kinematics straight from the URDF (parsed once per process and cached)
+        self.leg_kinematics = LegKinematics.from_urdf(self.urdf_filename, body_link=config.ROBOTS[self.robot_name].get('body_link'))
+        # Foot contact flags/forces from one contact query per step (optionally added to the observation)
+        self.contact_obs = 'foot_contacts' in self.observation_components
+        ground_ids = [self.plane_id] + ([self.terrain.body_id] if self.terrain is not None else [])
+        self.contacts = FootContacts(self.robot_id, ground_ids, config.ROBOTS[self.robot_name]['foot_link_pattern'])
+        # Optional grid of ground heights around the robot (grid size/resolution/update rate from config.py)
+        self.height_scan = HeightScan(self.robot_id, **config.ROBOTS[self.robot_name].get('height_scan', {})) if 'height_scan' in self.observation_components else None
+        # Optional onboard camera (depth or grayscale, flattened into the observation), for robots with a 'camera' config
+        self.camera = None
+        if 'camera' in self.observation_components:
+            if 'camera' not in config.ROBOTS[self.robot_name]:
+                raise ValueError(f"No 'camera' entry in config.py for '{self.robot_name}'")
+            self.camera = Camera(self.robot_id, **config.ROBOTS[self.robot_name]['camera'])
         self.initialize_joints()
 
-        # Define some stable 'home' position array for each joint (straight down, angle of 0)
-        self.home_position = [0 for _ in self.joint_indices]
+        # Define some stable 'home' position array for each joint (a standing pose found with IK)
         if 'servobot' in urdf_filename:
             ik = IK()
-            idle_cfg = ik.get_idle_cfg(height=0.18)
+            idle_cfg = ik.get_idle_cfg(height=self.home_height)
             self.home_position = [0]*len(self.joint_indices)
             for i in self.joint_indices:
                 self.home_position[i] = idle_cfg[self.get_joint_name[i]]
+        else:
+            joint_names = [self.get_joint_name[joint_index] for joint_index in self.joint_indices]
+            self.home_position = self.leg_kinematics.home_position(joint_names, **config.ROBOTS[self.robot_name].get('home_stance', {}))
         self.previous_action = np.zeros(self.action_space.shape)
 
+        # Per-joint motor force limits and action latency (in physics steps). Nominal unless domain randomization
+        # is on, in which case they're resampled (with friction, masses and gravity) every reset.
+        self.joint_forces = np.full(len(self.joint_indices), float(self.action_force_limit))
+        self.latency_steps = 0
+        self.previous_joint_targets = np.array(self.home_position, dtype=float)
+        self.randomizer = None
+        if domain_randomization:
+            self.randomizer = DomainRandomizer(self.robot_id, ground_ids, self.joint_indices, self.time_step,
+                                               self.action_force_limit,
+                                               distributions=config.ROBOTS[self.robot_name].get('domain_randomization'))
+
+        # All randomness goes through self.np_random (seeded by reset(seed=...)), never the global np.random state.
+        # Per-episode commands are drawn for a batch of episodes at a time and used up one episode per reset.
+        self.command_batch_size = 256
+        self.presample_episode_commands()
+
         # Generate a random target velocity to start (in the x-y plane, with a 0 component in the z direction)
         self.target_speed = target_speed
         self.target_velocity = self.generate_random_target_velocity(target_speed)
@@ -163,10 +252,27 @@ class BaseEnv(gym.Env):
         self.initial_momentum_vector = self.generate_random_initial_momentum(strength=0.0)
 
         self.render_mode = render_mode
-        self.reward_history = pd.DataFrame({'step_taken':[],'lin_vel':[], 'ang_vel':[], 'height':[], 'pose':[], 'action_rate':[], 'lin_vel_z':[], 'rp':[],'survival':[], 'fallen':[], 'total':[]})
-        time_now = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-        self.reward_history_filename = f"history/reward_history_{time_now}.csv"
-        self.reward_history.to_csv(self.reward_history_filename, index=False)
+        # The GUI runs in real time, paced on wall-clock deadlines (see realtime.py)
+        self.pacer = RealTimePacer(self.time_step) if render_mode == 'human' else None
+        # Offscreen camera following the robot for render() in 'rgb_array' mode (e.g. to record videos headless)
+        self.follow_camera = FollowCamera(self.robot_id) if render_mode == 'rgb_array' else None
+        # Optionally publish the robot state every step under this shared memory name, so `visualize.py --attach`
+        # can watch a headless run (see live_view.py)
+        self.live_view = None
+        if live_view:
+            self.live_view = StatePublisher(live_view, os.path.abspath(self.urdf_filename), len(self.joint_indices))
+        self.reward_history = pd.DataFrame({'step_taken':[],'lin_vel':[], 'ang_vel':[], 'height':[], 'pose':[], 'action_rate':[], 'lin_vel_z':[], 'rp':[],'survival':[], 'fallen':[], 'body_contact':[], 'total':[]})
+        # Every episode's reward terms also go to a CSV file (plot_reward.py), named per process so envs started in the
+        # same second don't share one. Pool workers (sweeps, PBT, diagnostics) turn it off, they'd leave one per task.
+        self.reward_history_filename = None
+        if reward_history_file:
+            time_now = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+            self.reward_history_filename = f"history/reward_history_{time_now}_{os.getpid()}.csv"
+            self.reward_history.to_csv(self.reward_history_filename, index=False)
+
+        # Every reset starts from this state, so nothing from earlier episodes (e.g. the solver's cached contacts)
+        # carries over and an episode only depends on its seed and actions (resume.py relies on this)
+        self.initial_state = p.saveState()
 
     def initialize_joints(self):
         self.joint_indices = []
@@ -183,19 +289,58 @@ class BaseEnv(gym.Env):
             # restrict action force limit based on joint max force if available
             if len(joint_info) >= 11:
                 self.action_force_limit = min(self.action_force_limit, joint_info[10])
-        self.action_space = spaces.Box(low=-1, high=1, shape=(num_joints,), dtype=np.float32)
-
-        # Define the size of our observation space based on several components:
-        # 1. Joint positions and velocities (2 values per joint)
-        # 2. Base position (3), 
-        # 3. Orientation (4 - quaternion), 
-        # 4. Linear velocity (3), 
-        # 5. Angular velocity (3),
-        # 6. Cosine and Sine of joint angles (2 values per joint)
-        # 7. Control Goal Velocity (3 values: x,y,z components)
-        # 8. Control Goal Turn (1 value, in positive or negative radians/sec)
-        obs_space_shape = (num_joints * 4) + 13 + 3 + 1
-        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(obs_space_shape,), dtype=np.float32)
+        self.action_space = spaces.Box(low=-1, high=1, shape=(len(self.joint_indices),), dtype=np.float32)
+
+        # Foot positions come from the joint angles we already read, so we just need to know
+        # where each joint lives in our joint state list (the URDF kinematics and IK have their own joint orders)
+        num_foot_values = 0
+        joint_slot = {self.get_joint_name[joint_index]: i for i, joint_index in enumerate(self.joint_indices)}
+        if self.action_mode == 'foot' and 'servobot' not in self.urdf_filename:
+            raise ValueError(f"Foot actions are only supported for servobot, not '{self.urdf_filename}'")
+        if self.action_mode == 'foot':
+            self.ik_joint_order = [JOINT_NAMES.index(self.get_joint_name[joint_index]) for joint_index in self.joint_indices]
+        if self.foot_obs:
+            # Every robot (servobot too) uses the generic URDF kinematics, so feet are in the body frame. The servobot
+            # FK class works in per-leg mirrored IK frames, where every idle foot is at [0, 0, -h].
+            self.fk_joint_order = [joint_slot[name] for name in self.leg_kinematics.flat_joint_names]
+            num_foot_values = 3 * self.leg_kinematics.num_legs
+        num_contact_values = 2 * self.contacts.num_feet if self.contact_obs else 0
+        num_scan_values = self.height_scan.num_rays if self.height_scan is not None else 0
+        num_pixels = self.camera.width * self.camera.height if self.camera is not None else 0
+        if self.action_mode == 'foot':
+            # Foot targets are turned into joint targets with the (memory-mapped, shared between workers) IK lookup table
+            self.ik_table = IKTable.load_or_build(config.ROBOTS[self.robot_name]['ik_table_path'])
+            self.home_foot_positions = np.array([0.0, 0.0, -self.home_height] * 4)
+            # Meters of foot travel at action = -1 and +1 (x, y, z per foot). The leg is nearly straight at home, so a
+            # foot can only go ~1 cm further down, the whole box has to stay inside the reachable workspace (the table
+            # blends unreachable cells into nonsense otherwise)
+            self.foot_action_low = np.array([-0.05, -0.05, -0.01] * 4)
+            self.foot_action_high = np.array([0.05, 0.05, 0.05] * 4)
+            self.foot_joint_targets = np.empty(len(JOINT_NAMES))
+            self.ik_joint_leg = np.array(self.ik_joint_order) // 3  # leg of each of our joints
+
+        # Compile the observation layout into slices of one preallocated buffer (see observations.py for the components).
+        # Joint values come from the revolute joints only (the ones we read and drive).
+        num_joint_values = len(self.joint_indices)
+        sizes = {'joint_positions': num_joint_values, 'joint_velocities': num_joint_values, 'joint_cos': num_joint_values,
+                 'joint_sin': num_joint_values, 'base_position': 3, 'base_height': 1, 'base_orientation': 4,
+                 'projected_gravity': 3, 'base_linear_velocity': 3, 'base_angular_velocity': 3, 'target_velocity': 3,
+                 'target_turn': 1, 'foot_positions': num_foot_values, 'foot_contacts': num_contact_values,
+                 'height_scan': num_scan_values, 'camera': num_pixels}
+        self.observation_plan = ObservationPlan(self.observation_components, sizes)
+        self.frame_history = None
+        self.observation_segments = self.observation_plan.segments
+        if self.frame_stack > 1 or self.stack_actions:
+            action_size = self.action_space.shape[0] if self.stack_actions else 0
+            self.frame_history = FrameHistory(self.observation_plan.size, self.frame_stack, action_size)
+            self.observation_segments = stacked_segments(self.observation_segments, self.frame_stack, action_size)
+        # Named (segment, size) pairs in observation order and name -> slice, so tools can tell what each input is
+        self.observation_offsets = {}
+        offset = 0
+        for name, size in self.observation_segments:
+            self.observation_offsets[name] = slice(offset, offset + size)
+            offset += size
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(offset,), dtype=np.float32)
 
     def _get_obs(self):
         '''
@@ -204,15 +349,9 @@ class BaseEnv(gym.Env):
         '''
         # Angles and velocities of all the joints
         joint_states = p.getJointStates(self.robot_id, self.joint_indices)
-        joint_positions = [state[0] for state in joint_states]
+        joint_positions = np.array([state[0] for state in joint_states])
         joint_velocities = [state[1] for state in joint_states]
 
-        ## TESTING: ##
-        # let's try adding in the cosine and sine values of these joint angles 
-        # (This can help with angle wrapping issues)
-        joint_cos = [math.cos(pos) for pos in joint_positions]
-        joint_sin = [math.sin(pos) for pos in joint_positions]
-
         # Robot base (central body) 
         base_pos, base_orient = p.getBasePositionAndOrientation(self.robot_id)
         base_vel, base_angular_vel = p.getBaseVelocity(self.robot_id)
@@ -223,34 +362,107 @@ class BaseEnv(gym.Env):
         # Get the goal turn vector
         target_turn = self.target_turn
 
-        # Compose the full observation vector and return it
-        obs = np.concatenate([
-            joint_positions, joint_velocities, joint_cos, joint_sin, base_pos, base_orient,
-            base_vel, base_angular_vel, target_vel, [target_turn]
-        ])
-        return obs.astype(np.float32)
+        plan = self.observation_plan
+        values = {
+            'joint_positions': joint_positions, 'joint_velocities': joint_velocities,
+            # cosine and sine of the joint angles (this can help with angle wrapping issues)
+            'joint_cos': np.cos(joint_positions), 'joint_sin': np.sin(joint_positions),
+            'base_position': base_pos, 'base_height': base_pos[2], 'base_orientation': base_orient,
+            'base_linear_velocity': base_vel, 'base_angular_velocity': base_angular_vel,
+            'target_velocity': target_vel, 'target_turn': target_turn,
+        }
+        if 'projected_gravity' in plan:
+            # world down in the base frame: minus the bottom row of the base's rotation matrix
+            rotation = p.getMatrixFromQuaternion(base_orient)
+            values['projected_gravity'] = (-rotation[6], -rotation[7], -rotation[8])
+        # Foot positions from forward kinematics (no extra PyBullet queries needed)
+        if self.foot_obs:
+            values['foot_positions'] = self.leg_kinematics.forward(joint_positions[self.fk_joint_order])[0]
+        if self.contact_obs:
+            values['foot_contacts'] = self.contacts.observation()
+        if self.height_scan is not None:
+            start = time.perf_counter()
+            values['height_scan'] = self.height_scan.observation()
+            self.record_time('height_scan', start)
+        if self.camera is not None:
+            start = time.perf_counter()
+            values['camera'] = self.camera.observation(self.steps_taken * self.time_step).ravel()
+            self.record_time('camera', start)
+        if self.live_view is not None:
+            start = time.perf_counter()
+            self.live_view.publish(base_pos, base_orient, base_vel, base_angular_vel, target_vel, target_turn, joint_positions)
+            self.record_time('live_view', start)
+
+        # Write every component into its slice of the observation buffer. The buffer is reused every step, so the
+        # caller gets a copy (wrappers and callers keep observations around, e.g. SB3's last observation).
+        frame = plan.fill(values)
+        if self.frame_history is None:
+            return frame.copy()
+        # With frame stacking the frame goes into the newest history row (step() moves on to a new row first)
+        self.frame_history.write(frame, self.previous_action)
+        return self.frame_history.view().copy()
+
+    def presample_episode_commands(self):
+        ''' Draws the random commands for the next command_batch_size episodes in one go, from self.np_random '''
+        rng = self.np_random
+        n = self.command_batch_size
+        self.episode_commands = {
+            'velocity_angle': rng.uniform(0, 2 * np.pi, n),
+            'speed_offset': rng.uniform(-.25, .25, n),
+            'turn': rng.uniform(-np.pi/2, np.pi/2, n),
+            'momentum_angle': rng.uniform(0, 2 * np.pi, n),
+            'momentum_fraction': rng.uniform(0, 1, n),
+        }
+        self.episode_command_index = 0
+
+    def next_episode_commands(self):
+        ''' Moves on to the next episode's pre-sampled commands, drawing a new batch when we run out '''
+        self.episode_command_index += 1
+        if self.episode_command_index >= self.command_batch_size:
+            self.presample_episode_commands()
 
     def generate_random_target_velocity(self, target_speed):
         ''' Generates a random target velocity vector in the x-y plane with a 0 component in the z direction 
         and a maginitude between min_speed and max_speed '''
-        angle = np.random.uniform(0, 2 * np.pi)
+        angle = self.episode_commands['velocity_angle'][self.episode_command_index]
         # Have some variation in the target speed to make the policy more robust
-        speed = np.random.uniform(target_speed - .25, target_speed + .25)
+        speed = target_speed + self.episode_commands['speed_offset'][self.episode_command_index]
         return np.array([speed * np.cos(angle), speed * np.sin(angle), 0])
 
     def generate_random_turn_vector(self):
         ''' Generates a random turn command (yaw angle in radians/sec between -pi/2 and pi/2) '''
-        theta = np.random.uniform(-np.pi/2, np.pi/2)
+        theta = self.episode_commands['turn'][self.episode_command_index]
         return theta
     
     def generate_random_initial_momentum(self, strength):
         ''' Generates a random initial momentum vector in the x-y plane with a magnitude up to 'strength' '''
-        angle = np.random.uniform(0, 2 * np.pi)
-        momentum = np.random.uniform(0, strength)
+        angle = self.episode_commands['momentum_angle'][self.episode_command_index]
+        momentum = strength * self.episode_commands['momentum_fraction'][self.episode_command_index]
         return np.array([momentum * np.cos(angle), momentum * np.sin(angle), 0])
 
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
+        self.log.flush_due()  # counts of event bursts that have stopped
+        p.restoreState(self.initial_state)
+        # A new seed restarts the command stream, so the same seed always gives the same episodes
+        if seed is not None:
+            self.presample_episode_commands()
+        else:
+            self.next_episode_commands()
+
+        # Swap in this episode's terrain before placing the robot on it
+        if self.terrain is not None:
+            start = time.perf_counter()
+            self.terrain.regenerate(self.np_random)
+            self.record_time('terrain', start)
+
+        # New dynamics for this episode
+        if self.randomizer is not None:
+            start = time.perf_counter()
+            self.randomizer.randomize(self.np_random)
+            self.joint_forces = self.randomizer.joint_forces
+            self.latency_steps = min(self.randomizer.latency_steps, self.action_skip)
+            self.record_time('randomization', start)
         
         start_position = self.start_position
         start_orientation = p.getQuaternionFromEuler([0, 0, 0])
@@ -264,6 +476,19 @@ class BaseEnv(gym.Env):
             )
 
         self.steps_taken = 0
+        # Don't carry reward state over from the last episode
+        self.rolling_avg_speed = np.array([0.0, 0.0, 0.0])
+        self.previous_action = np.zeros(self.action_space.shape)
+        self.previous_joint_targets[:] = self.home_position
+        if self.frame_history is not None:
+            self.frame_history.clear()  # the first observation fills the whole history
+        self.contacts.reset()
+        if self.pacer is not None:
+            self.pacer.reset()
+        if self.height_scan is not None:
+            self.height_scan.reset()
+        if self.camera is not None:
+            self.camera.reset()
 
 
         # New target velocity for this episode
@@ -281,9 +506,9 @@ class BaseEnv(gym.Env):
         
         observation = self._get_obs()
         info = self._get_info()
-        if len(self.reward_history) >0:
+        if len(self.reward_history) >0 and self.reward_history_filename is not None:
             self.reward_history.to_csv(self.reward_history_filename, index=False,mode='a', header=False)
-        self.reward_history = pd.DataFrame({'step_taken':[],'lin_vel':[], 'ang_vel':[], 'height':[], 'pose':[], 'action_rate':[], 'lin_vel_z':[], 'rp':[],'survival':[], 'fallen':[], 'total':[]})
+        self.reward_history = pd.DataFrame({'step_taken':[],'lin_vel':[], 'ang_vel':[], 'height':[], 'pose':[], 'action_rate':[], 'lin_vel_z':[], 'rp':[],'survival':[], 'fallen':[], 'body_contact':[], 'total':[]})
         return observation, info
     
     def calculate_step_reward_new(self, action, steps_taken=0):
@@ -302,64 +527,36 @@ class BaseEnv(gym.Env):
         # We also want to define a 'home' position for each joint (probably in the __init__ method) 
         # and punish actions that move too far away from it. This will keep the robot more stable.
 
-        # Get position, orientation, velocity
+        # Gather the state the reward depends on, and let the reward kernel (utils/reward.py) do the math.
+        # The same kernel works on batches of states, e.g. for offline relabeling of recorded rollouts.
         current_base_pos, current_base_orient = p.getBasePositionAndOrientation(self.robot_id)
         base_vel, base_angular_vel = p.getBaseVelocity(self.robot_id)
-        self.rolling_avg_speed = 0.9*self.rolling_avg_speed + 0.1*np.array(base_vel)
-        target_vel = self.target_velocity
-
-        # velocity commands
-        target_angular_vel = self.target_turn * np.array([0,0,1])  # Yaw only
-        target_z = self.start_position[2]
-
-        is_fallen = current_base_pos[2] < 0.025
-
-        # UPDATE 10/16/25: Reward logic now divided by taget velocity magnitude * .1 
-        # in order to make the 'bell' shape of the reward function steeper. 
-        # Previously the robot could still achieve <95% of the movement rewards without 
-        # moving at all in most target velocity ranges, which is not what we want.
-
-        ## Reward Components: ##
-        # 1. Linear Velocity Tracking Reward
-        r_lin_vel = self.FORWARD_VEL_WEIGHT * np.exp(-2*np.linalg.norm(np.array(self.rolling_avg_speed) - np.array(target_vel))**2)
-        ### DEBUG: ### 
-        #print("="*20)
-        #print("VELOCITY DEBUGGING")
-        #print("CURRENT VELOCITY:", base_vel)
-        #print("TARGET VELOCITY: ", target_vel)
-        #print("DIFFERENCE: ", np.array(base_vel) - np.array(target_vel))
-        #print("NORM: ", -np.linalg.norm(np.array(base_vel) - np.array(target_vel)))
-        #print("NORM^2:", -np.linalg.norm(np.array(base_vel) - np.array(target_vel))**2)
-        #print("REWARD: ",r_lin_vel)
-        #print("="*20)
-        # 2. Angular Velocity Tracking Reward
-        r_ang_vel = self.ANGULAR_VEL_WEIGHT * np.exp(-0.01*(np.linalg.norm(np.array(base_angular_vel) - np.array(target_angular_vel))**2))
-        # 3. Height Penalty
-        r_height = -20*(current_base_pos[2] - target_z)**2
-        # 4. Pose Similarity Penalty
         joint_states = p.getJointStates(self.robot_id, self.joint_indices)
-        joint_positions = np.array([state[0] for state in joint_states])
-        r_pose = -0.075*(np.linalg.norm(joint_positions - np.array(self.home_position))**2)
-        # 5. Action Rate Penalty
-        r_action_rate = -0.015*np.linalg.norm(action-self.previous_action)**2
-        # 6. Vertical Velocity Penalty
-        r_lin_vel_z = -0.2*base_vel[2]**2
-        # 7. Roll and Pitch Penalty
-        rot_matrix = p.getMatrixFromQuaternion(current_base_orient)
-        z_direction = np.array([rot_matrix[6], rot_matrix[7], rot_matrix[8]])
-        if not (0.99<np.linalg.norm(z_direction) < 1.01):
-            raise ValueError("Z direction vector is not normalized!")
-        r_rp = -0.4*(1 - z_direction[2])  # Not the same as the penalty described in the blog, but approximately the same when the robot is almost upright.
-        # 8. Survival Reward
-        r_survival = (self.SURVIVAL_WEIGHT * 1) if not is_fallen else 0.0
-        # 9. Fallen Penalty
-        r_fallen = -self.FALLEN_PENALTY if is_fallen else 0.0
-
-        ## Calculate total reward:
-        total_reward = (r_lin_vel+r_ang_vel+ r_height + r_pose + r_action_rate + r_lin_vel_z + r_rp + r_survival - r_fallen   )
-        new_history = pd.DataFrame({'step_taken':[steps_taken],'lin_vel':[r_lin_vel], 'ang_vel':[r_ang_vel], 'height':[r_height], 'pose':[r_pose], 'action_rate':[r_action_rate], 'lin_vel_z':[r_lin_vel_z], 'rp':[r_rp], 'survival':[r_survival], 'fallen':[r_fallen], 'total':[total_reward]})
+        state = {
+            'base_position': [current_base_pos],
+            'base_orientation': [current_base_orient],
+            'base_velocity': [base_vel],
+            'base_angular_velocity': [base_angular_vel],
+            'joint_positions': [[joint_state[0] for joint_state in joint_states]],
+            'action': [action],
+            'previous_action': [self.previous_action],
+            'target_velocity': [self.target_velocity],
+            'target_turn': [self.target_turn],
+            'body_contact': [self.contacts.body_contact],
+        }
+        terms, rolling_avg_speed = reward_kernel(state, [self.rolling_avg_speed], self.reward_weights,
+                                                 self.home_position, self.start_position[2])
+        self.rolling_avg_speed = rolling_avg_speed[0]
+        terms = {name: float(value[0]) for name, value in terms.items()}
+
+        new_history = pd.DataFrame({'step_taken':[steps_taken], **{name: [value] for name, value in terms.items()}})
         self.reward_history = pd.concat([self.reward_history,new_history], ignore_index=True)
-        return total_reward
+        return terms['total']
+
+    @property
+    def reward_weights(self):
+        ''' The current values of the weights the reward kernel uses (they can change, e.g. with update_config) '''
+        return {name: getattr(self, name) for name in REWARD_WEIGHTS}
     
     def calculate_step_reward(self, action, steps_taken=0):
         ''' 
@@ -447,14 +644,14 @@ class BaseEnv(gym.Env):
             shake_penalty - fallen_penalty - jump_penalty - high_alt_pen - tilt_penalty
         )
         
-        if steps_taken % 240 == 0 and self.render_mode == 'human':
-            print("================= Step Reward Breakdown ===============")
-            print(f"Target Velocity: {target_vel}, Current Velocity: {base_vel}")
-            print(f"Target Yaw: {target_yaw:.2f}, Current Yaw: {current_yaw:.2f}, Yaw Error: {yaw_error:.2f}")
-            print(f"Base Position: {current_base_pos}, Uprightness: {uprightness:.2f}")
-            print(f"Is Fallen: {is_fallen}")
-
-            print(f"Step Reward Breakdown: Vel Track: {velocity_tracking_reward:.2f}, Fwd Bonus: {forward_bonus:.2f}, "
+        if steps_taken % 240 == 0 and self.render_mode == 'human' and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("================= Step Reward Breakdown ===============")
+            logger.debug(f"Target Velocity: {target_vel}, Current Velocity: {base_vel}")
+            logger.debug(f"Target Yaw: {target_yaw:.2f}, Current Yaw: {current_yaw:.2f}, Yaw Error: {yaw_error:.2f}")
+            logger.debug(f"Base Position: {current_base_pos}, Uprightness: {uprightness:.2f}")
+            logger.debug(f"Is Fallen: {is_fallen}")
+
+            logger.debug(f"Step Reward Breakdown: Vel Track: {velocity_tracking_reward:.2f}, Fwd Bonus: {forward_bonus:.2f}, "
                   f"Upright: {upright_reward:.2f}, Survival: {survival_reward:.2f}, Orient: {orientation_reward:.2f}, "
                   f"Home Penalty: {-home_penalty:.2f}, Shake Penalty: {-shake_penalty:.2f}, Fallen Penalty: {-fallen_penalty:.2f}, "
                   f"Tilt Penalty: {-tilt_penalty:.2f}, Jump Penalty: {-jump_penalty:.2f}, High Alt Penalty: {-high_alt_pen:.2f} "
@@ -467,34 +664,70 @@ class BaseEnv(gym.Env):
         '''
         Update environment parameters based on a new configuration dictionary.
         '''
+        # Curricula call this over and over with the same values, so only actual changes get logged (rate limited)
         for key, value in new_config.items():
             if hasattr(self, key):
+                if getattr(self, key) != value:
+                    self.log.event(f"update_{key}", f"Updated {key} to {value}")
                 setattr(self, key, value)
-                print(f"Updated {key} to {value}")
             else:
-                print(f"Warning: {key} is not a valid parameter of the environment.")
+                self.log.event(f"invalid_{key}", f"Warning: {key} is not a valid parameter of the environment.",
+                               level=logging.WARNING)
     
+    def foot_action_to_joint_targets(self, action):
+        '''
+        Converts a foot-space action (offsets from the home stance for each foot, in JOINT_NAMES leg order)
+        into joint targets in our joint order, using the IK lookup table. Action 0 is the home stance, -1 and +1
+        the ends of the foot action box. A leg whose target is still out of reach keeps its previous targets.
+        '''
+        action = np.clip(np.asarray(action, dtype=float), -1.0, 1.0)
+        offsets = np.where(action >= 0, action * self.foot_action_high, -action * self.foot_action_low)
+        self.ik_table.lookup(self.home_foot_positions + offsets, out=self.foot_joint_targets)
+        joint_targets = self.foot_joint_targets[self.ik_joint_order]
+        valid = self.ik_table.last_valid
+        if not valid.all():
+            unreachable = ~valid[self.ik_joint_leg]
+            joint_targets[unreachable] = self.previous_joint_targets[unreachable]
+            self.log.event('foot_unreachable', f"Foot targets out of reach for legs {np.flatnonzero(~valid).tolist()}, "
+                           f"keeping their previous joint targets", level=logging.WARNING)
+        return joint_targets
+
     def step(self, action):
             """
             Take a step in the simulation with a revised reward function and a strict no-jump rule.
             """
             total_reward = 0.0
 
+            # The policy's action is the same for every physics step, so work out the joint targets once
+            if self.action_mode == 'foot':
+                joint_targets = self.foot_action_to_joint_targets(action)
+            else:
+                joint_targets = self.action_factor*np.asarray(action)+self.home_position
+
+            start = time.perf_counter()
             # Repeat the action for some number of steps equal to our action_skip value (to simulate lower control frequency)
-            for _ in range(self.action_skip):
+            for substep in range(self.action_skip):
+                # With control latency the motors keep tracking the last action's targets for the first few physics steps
+                targets = self.previous_joint_targets if substep < self.latency_steps else joint_targets
                 # Iterate over each joint and attempt to move it to the calculated target position given by the policy
                 for i, joint_index in enumerate(self.joint_indices):
                     p.setJointMotorControl2(
                         self.robot_id, joint_index, p.POSITION_CONTROL,
-                        targetPosition= self.action_factor*action[i]+self.home_position[i], force=self.action_force_limit
+                        targetPosition=targets[i], force=self.joint_forces[i]
                     )
                 p.stepSimulation()
                 self.steps_taken += 1
                 
                 if self.steps_taken >= self.steps_per_episode:
                     break
-                if self.render_mode == 'human':
-                    time.sleep(self.time_step)
+                if self.pacer is not None:
+                    self.pacer.tick()
+            self.previous_joint_targets[:] = joint_targets  # copy, joint_targets may be a reused buffer
+            self.record_time('physics', start)
+
+            start = time.perf_counter()
+            self.contacts.update()
+            self.record_time('contacts', start)
             
             # Calculate reward ONCE per action (not per physics step!)
             # This keeps reward scale reasonable for value function learning
@@ -513,7 +746,7 @@ class BaseEnv(gym.Env):
 
             # 2. Check for jumping
             if final_pos[2] > 1.3:
-                print("🚫 Jump Detected! Episode terminated with penalty. 🚫")
+                self.log.event('jump', "🚫 Jump Detected! Base above 1.3 m. 🚫", level=logging.WARNING)
                 terminated = False
 
             # 3. Check for falling (using the correct orientation variable)
@@ -529,6 +762,8 @@ class BaseEnv(gym.Env):
             # --- ▲▲▲ END OF CORRECTION ▲▲▲ ---
             self.previous_action = action
             info = self._get_info()
+            if self.frame_history is not None:
+                self.frame_history.advance()
 
             return self._get_obs(), total_reward, terminated, truncated, info
 
@@ -549,13 +784,35 @@ class BaseEnv(gym.Env):
         info['base_velocity'] = base_vel
         info['base_angular_velocity'] = base_angular_vel
         info['uprightness'] = uprightness
+        info['foot_contacts'] = self.contacts.in_contact.copy()
+        info['foot_forces'] = self.contacts.normal_forces.copy()
+        info['body_contact'] = self.contacts.body_contact
+        info.update(self.contacts.gait_metrics())
 
         return info
     
+    def record_time(self, name, start):
+        ''' Adds the time since start (a time.perf_counter() value) to the timing stats for name '''
+        elapsed = time.perf_counter() - start
+        total = self.timings.setdefault(name, [0.0, 0])
+        total[0] += elapsed
+        total[1] += 1
+
+    def timing_report(self):
+        ''' Returns the mean milliseconds per call for everything timed so far, e.g. {'physics': 1.2, 'randomization': 0.05} '''
+        return {name: 1000 * total / calls for name, (total, calls) in self.timings.items()}
+
     def render(self):
-        pass
+        ''' Returns an RGB frame of the robot in 'rgb_array' mode (the GUI does its own rendering in 'human' mode) '''
+        if self.follow_camera is not None:
+            return self.follow_camera.render()
+        return None
 
     def close(self):
+        self.log.flush()
+        if self.live_view is not None:
+            self.live_view.close()
+            self.live_view = None
         p.disconnect()
 
 if __name__ == "__main__":
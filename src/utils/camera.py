@@ -0,0 +1,203 @@
+'''
+Low resolution onboard camera for BaseEnv (depth or grayscale images).
+
+The camera is mounted at a fixed offset from one of the robot's links (set per robot in config.py's 'camera' entry)
+and rendered with PyBullet's TinyRenderer, so it works in DIRECT mode. The projection matrix is computed once at
+init, only the view matrix follows the robot. Frames are taken at their own rate (in simulated time), independent
+of the control rate, and written into the same image buffer every time.
+
+The robot is rendered like everything else, so the policy can see its own legs. With hide_robot it's hidden while a
+frame is rendered instead (its visual shapes get alpha 0 and their colors are put back afterwards), which makes the
+robot flicker in the GUI and in live views. That's opt-in for speed: TinyRenderer transforms every visible mesh every
+frame whatever the resolution, and the arachne meshes are big enough that this is the difference between ~6 and
+~1500 images per second.
+'''
+
+import collections
+import numpy as np
+import pybullet as p
+
+
+CAMERA_DEFAULTS = {
+    'link': None,               # link name the camera is mounted on (None = base link)
+    'position': (0.0, 0.0, 0.0),  # camera position in that link's URDF frame
+    'forward': (1.0, 0.0, 0.0),   # viewing direction in the link frame
+    'up': (0.0, 0.0, 1.0),        # image up direction in the link frame
+    'width': 64,
+    'height': 48,
+    'fov': 70.0,                # vertical field of view in degrees
+    'near': 0.02,
+    'far': 4.0,                 # depth is clipped here (and depth images are scaled by it)
+    'mode': 'depth',            # 'depth' (distance / far, in [0, 1]) or 'gray' (brightness in [0, 1])
+    'fps': 10.0,                # frames per simulated second
+    'hide_robot': False,        # don't render the robot's own body (much faster, but it flickers, see above)
+}
+
+CAMERA_MODES = ['depth', 'gray']
+
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255
+
+
+class Camera:
+    '''
+    A camera attached to a robot in the current PyBullet simulation.
+    '''
+
+    def __init__(self, robot_id, **params):
+        '''
+        :param robot_id: PyBullet body id of the robot
+        :param params: overrides for CAMERA_DEFAULTS
+        '''
+        unknown = set(params) - set(CAMERA_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown camera parameters: {sorted(unknown)}")
+        self.params = {**CAMERA_DEFAULTS, **params}
+        if self.params['mode'] not in CAMERA_MODES:
+            raise ValueError(f"Unknown camera mode '{self.params['mode']}', expected one of {CAMERA_MODES}")
+        self.robot_id = robot_id
+        self.width, self.height = int(self.params['width']), int(self.params['height'])
+        self.frame_interval = 1.0 / self.params['fps']
+
+        # Which link the camera rides on. getBasePositionAndOrientation gives the base's center of mass frame,
+        # so keep the transform from there back to the base's URDF frame (what the mount offset is given in).
+        link_names = [p.getJointInfo(robot_id, i)[12].decode('utf-8') for i in range(p.getNumJoints(robot_id))]
+        if self.params['link'] is None:
+            self.link_index = -1
+            inertial_pos, inertial_orn = p.getDynamicsInfo(robot_id, -1)[3:5]
+            self.com_to_link = p.invertTransform(inertial_pos, inertial_orn)
+        elif self.params['link'] in link_names:
+            self.link_index = link_names.index(self.params['link'])
+        else:
+            raise ValueError(f"No link named '{self.params['link']}' for the camera (links: {link_names})")
+        self.position = tuple(self.params['position'])
+        self.forward = tuple(self.params['forward'])
+        self.up = tuple(self.params['up'])
+
+        self.projection_matrix = p.computeProjectionMatrixFOV(
+            fov=self.params['fov'], aspect=self.width / self.height,
+            nearVal=self.params['near'], farVal=self.params['far'])
+
+        # Original colors of every visual shape (link, index within the link, rgba), to restore after hiding
+        self.visual_shapes = []
+        shapes_per_link = collections.Counter()
+        for shape in p.getVisualShapeData(robot_id):
+            link = shape[1]
+            self.visual_shapes.append((link, shapes_per_link[link], shape[7]))
+            shapes_per_link[link] += 1
+        self.visual_links = sorted(shapes_per_link)
+
+        self.image = np.zeros((self.height, self.width), dtype=np.float32)
+        self.next_frame_time = 0.0
+        self.frames = 0
+
+    def reset(self):
+        ''' Makes the next observation() take a fresh frame (call on env reset). '''
+        self.next_frame_time = 0.0
+
+    def view_matrix(self):
+        ''' View matrix for the camera's current pose on the robot. '''
+        if self.link_index == -1:
+            com_pos, com_orn = p.getBasePositionAndOrientation(self.robot_id)
+            link_pos, link_orn = p.multiplyTransforms(com_pos, com_orn, *self.com_to_link)
+        else:
+            link_pos, link_orn = p.getLinkState(self.robot_id, self.link_index)[4:6]
+        eye, _ = p.multiplyTransforms(link_pos, link_orn, self.position, (0, 0, 0, 1))
+        rotation = np.array(p.getMatrixFromQuaternion(link_orn)).reshape(3, 3)
+        target = np.add(eye, rotation @ self.forward)
+        return p.computeViewMatrix(eye, target, rotation @ self.up)
+
+    def capture(self):
+        ''' Renders a frame right now into self.image (height, width) and returns it. '''
+        if self.params['hide_robot']:
+            for link in self.visual_links:
+                p.changeVisualShape(self.robot_id, link, rgbaColor=[0, 0, 0, 0])
+        _, _, rgb, depth, _ = p.getCameraImage(
+            self.width, self.height, self.view_matrix(), self.projection_matrix,
+            renderer=p.ER_TINY_RENDERER, flags=p.ER_NO_SEGMENTATION_MASK)
+        if self.params['hide_robot']:
+            for link, shape_index, rgba in self.visual_shapes:
+                p.changeVisualShape(self.robot_id, link, shapeIndex=shape_index, rgbaColor=rgba)
+
+        if self.params['mode'] == 'depth':
+            # depth buffer -> distance / far, i.e. near / (far - (far - near) * depth), all in place
+            near, far = self.params['near'], self.params['far']
+            np.multiply(np.reshape(depth, (self.height, self.width)), near - far, out=self.image)
+            self.image += far
+            np.divide(near, self.image, out=self.image)
+        else:
+            rgb = np.reshape(rgb, (self.height, self.width, 4))
+            np.matmul(rgb[..., :3], _GRAY_WEIGHTS, out=self.image)
+        self.frames += 1
+        return self.image
+
+    def observation(self, sim_time):
+        '''
+        The latest frame, taking a new one if one is due at sim_time (seconds of simulated time).
+        '''
+        if sim_time >= self.next_frame_time:
+            self.capture()
+            # stay on the frame grid, but don't try to catch up on missed frames
+            self.next_frame_time = max(self.next_frame_time + self.frame_interval, sim_time)
+        return self.image
+
+
+class FollowCamera:
+    '''
+    Third person camera that follows the robot around, for BaseEnv's rgb_array rendering (TinyRenderer, so no
+    display needed).
+    '''
+
+    def __init__(self, robot_id, width=320, height=240, distance=None, yaw=50.0, pitch=-30.0, fov=60.0):
+        '''
+        :param robot_id: PyBullet body id of the robot
+        :param width: image width in pixels
+        :param height: image height in pixels
+        :param distance: camera distance from the base (None = a few robot sizes, from its bounding box)
+        :param yaw: camera yaw around the robot in degrees
+        :param pitch: camera pitch in degrees (negative looks down)
+        :param fov: vertical field of view in degrees
+        '''
+        self.robot_id = robot_id
+        self.width, self.height = int(width), int(height)
+        if distance is None:
+            boxes = np.array([p.getAABB(robot_id, link) for link in range(-1, p.getNumJoints(robot_id))])
+            size = np.linalg.norm(boxes[:, 1].max(axis=0) - boxes[:, 0].min(axis=0))
+            distance = 2.5 * size
+        self.distance, self.yaw, self.pitch = distance, yaw, pitch
+        self.projection_matrix = p.computeProjectionMatrixFOV(
+            fov=fov, aspect=self.width / self.height, nearVal=0.01, farVal=20 * distance)
+
+    def render(self):
+        ''' Returns an (height, width, 3) uint8 RGB frame centred on the robot's base. '''
+        target, _ = p.getBasePositionAndOrientation(self.robot_id)
+        view_matrix = p.computeViewMatrixFromYawPitchRoll(target, self.distance, self.yaw, self.pitch, 0, 2)
+        _, _, rgb, _, _ = p.getCameraImage(
+            self.width, self.height, view_matrix, self.projection_matrix,
+            renderer=p.ER_TINY_RENDERER, flags=p.ER_NO_SEGMENTATION_MASK)
+        return np.reshape(rgb, (self.height, self.width, 4))[..., :3]
+
+
+if __name__ == "__main__":
+    import time
+    import pybullet_data
+    from .config import ROBOTS
+
+    # Images per second at a few resolutions with arachne's camera (run from the repo root)
+    p.connect(p.DIRECT)
+    p.setAdditionalSearchPath(pybullet_data.getDataPath())
+    p.loadURDF("plane.urdf")
+    robot = p.loadURDF(ROBOTS['arachne']['urdf_file'], [0, 0, 0.15])
+    camera_params = ROBOTS['arachne']['camera']
+    for hide_robot in (True, False):
+        for width, height in [(32, 24), (64, 48), (128, 96), (256, 192)]:
+            for mode in CAMERA_MODES:
+                camera = Camera(robot, **{**camera_params, 'width': width, 'height': height, 'mode': mode,
+                                          'hide_robot': hide_robot})
+                frames = 200 if hide_robot else 5
+                start = time.perf_counter()
+                for _ in range(frames):
+                    camera.capture()
+                rate = frames / (time.perf_counter() - start)
+                print(f"{width}x{height} {mode:5s} hide_robot={hide_robot}: {rate:.0f} images/s")
+            if not hide_robot:
+                break
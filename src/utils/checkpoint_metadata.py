@@ -0,0 +1,251 @@
+'''
+Checkpoint metadata: a small JSON sidecar next to every saved model, and an index per checkpoint directory.
+
+    servobot_model_100000_steps.zip
+    servobot_model_100000_steps.meta.json    {"robot": "servobot", "observation_shape": [65], "action_shape": [12],
+                                              "env_config_hash": "3f2a...", "timesteps": 100000, "eval_score": null, ...}
+    checkpoint_index.json                    every sidecar in the directory, by checkpoint file name
+
+train.py checkpoints, sweep trials and PBT members all get sidecars. The env config is everything about the env a
+policy depends on (robot, observation options, action mode, terrain, reward weights), and its hash tells whether two
+checkpoints were trained on the same setup. Tools read the index to list, filter and sort checkpoints, or
+check_compatible() to reject one for the wrong observation shape, without opening any zips. Several processes
+(sweep workers) can write into one directory, so the index is only a cache: load_index() adds any sidecars it's
+missing and drops checkpoints that are gone. Older checkpoints can get sidecars with backfill_metadata(), which
+does open the zips, once.
+'''
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from stable_baselines3.common.callbacks import CheckpointCallback
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+META_SUFFIX = '.meta.json'
+INDEX_FILE = 'checkpoint_index.json'
+
+
+class IncompatibleCheckpointError(ValueError):
+    ''' A checkpoint's metadata says it doesn't fit the env. '''
+
+
+def metadata_path(checkpoint_path):
+    ''' Sidecar file of a checkpoint: model.zip -> model.meta.json '''
+    return os.path.splitext(checkpoint_path)[0] + META_SUFFIX
+
+
+def env_config(env):
+    ''' Everything about a BaseEnv that a policy trained on it depends on. '''
+    base_env = env.unwrapped
+    return {
+        'robot': base_env.robot_name,
+        'observation_shape': list(base_env.observation_space.shape),
+        'action_shape': list(base_env.action_space.shape),
+        'action_mode': base_env.action_mode,
+        'observation': list(base_env.observation_components),
+        'frame_stack': base_env.frame_stack,
+        'stack_actions': bool(base_env.stack_actions),
+        'foot_obs': bool(base_env.foot_obs),
+        'contact_obs': bool(base_env.contact_obs),
+        'height_scan': base_env.height_scan is not None,
+        'camera_obs': base_env.camera is not None,
+        'terrain': base_env.terrain.types if base_env.terrain is not None else None,
+        'domain_randomization': base_env.randomizer is not None,
+        'weights': {name: float(value) for name, value in vars(base_env).items() if name.isupper() and np.isscalar(value)},
+    }
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def write_metadata(checkpoint_path, env, timesteps, eval_score=None, **extra):
+    '''
+    Writes a checkpoint's sidecar and adds it to its directory's index.
+
+    :param checkpoint_path: the saved model
+    :param env: the BaseEnv (possibly wrapped) it was trained on
+    :param timesteps: training timesteps so far
+    :param eval_score: evaluation score, if the checkpoint was evaluated
+    :param extra: anything else worth keeping (e.g. train_return, params)
+    :return: the metadata
+    '''
+    config = env_config(env)
+    metadata = {
+        'file': os.path.basename(checkpoint_path),
+        'robot': config['robot'],
+        'observation_shape': config['observation_shape'],
+        'action_shape': config['action_shape'],
+        'observation_segments': [[name, size] for name, size in env.unwrapped.observation_segments],
+        'env_config_hash': config_hash(config),
+        'timesteps': int(timesteps),
+        'eval_score': None if eval_score is None else float(eval_score),
+        'saved': time.strftime('%Y-%m-%d %H:%M:%S'),
+        **extra,
+        'env_config': config,
+    }
+    _write_json(metadata_path(checkpoint_path), metadata)
+    update_index(os.path.dirname(checkpoint_path) or '.')
+    return metadata
+
+
+def read_metadata(checkpoint_path):
+    ''' A checkpoint's sidecar, None if it doesn't have one. '''
+    path = metadata_path(checkpoint_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    # write then rename, so readers never see half a file (the temp name is per process, for parallel writers)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_path, path)
+
+
+def _sidecars(directory):
+    ''' checkpoint file name -> sidecar path, for every sidecar whose checkpoint still exists '''
+    files = set(os.listdir(directory))
+    return {name[:-len(META_SUFFIX)] + '.zip': os.path.join(directory, name) for name in files
+            if name.endswith(META_SUFFIX) and name[:-len(META_SUFFIX)] + '.zip' in files}
+
+
+def update_index(directory):
+    ''' Rebuilds a directory's index from its sidecars. '''
+    index = {}
+    for checkpoint, path in sorted(_sidecars(directory).items()):
+        with open(path) as f:
+            index[checkpoint] = json.load(f)
+    _write_json(os.path.join(directory, INDEX_FILE), index)
+    return index
+
+
+def load_index(directory):
+    '''
+    Metadata of every checkpoint with a sidecar in a directory (not recursive).
+
+    :return: dict of checkpoint file name -> metadata
+    '''
+    index = {}
+    index_path = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    sidecars = _sidecars(directory)
+    if set(index) != set(sidecars):
+        index = update_index(directory)
+    return index
+
+
+def find_checkpoints(directory):
+    '''
+    Metadata of every checkpoint with a sidecar under a directory (recursive), each with its 'path' added.
+    '''
+    found = []
+    for root, _, files in os.walk(directory):
+        if any(name.endswith(META_SUFFIX) for name in files):
+            for checkpoint, metadata in load_index(root).items():
+                found.append({**metadata, 'path': os.path.join(root, checkpoint)})
+    return found
+
+
+def check_compatible(checkpoint_path, env):
+    '''
+    Checks a checkpoint against an env from its sidecar, without loading it.
+
+    :return: the metadata (None for checkpoints without a sidecar, which can only be checked by loading them)
+    :raises IncompatibleCheckpointError: if the observation or action shape doesn't match the env's
+    '''
+    metadata = read_metadata(checkpoint_path)
+    if metadata is None:
+        return None
+    base_env = env.unwrapped
+    for name, space in (('observation', base_env.observation_space), ('action', base_env.action_space)):
+        if tuple(metadata[f'{name}_shape']) != space.shape:
+            raise IncompatibleCheckpointError(f"{os.path.basename(checkpoint_path)} was trained on {metadata['robot']} with "
+                                              f"{name} shape {tuple(metadata[f'{name}_shape'])}, this env's is {space.shape}")
+    return metadata
+
+
+def is_metadata_file(name):
+    ''' Whether a file in a checkpoint directory is a sidecar or index rather than a checkpoint '''
+    return name.endswith(META_SUFFIX) or name == INDEX_FILE
+
+
+def describe_checkpoint(checkpoint_path):
+    ''' One line summary from a checkpoint's sidecar, for listings ('' without one) '''
+    metadata = read_metadata(checkpoint_path)
+    if metadata is None:
+        return ''
+    score = '' if metadata['eval_score'] is None else f", score {metadata['eval_score']:.1f}"
+    return f"({metadata['robot']}, {metadata['timesteps']} steps, obs {tuple(metadata['observation_shape'])}{score})"
+
+
+def backfill_metadata(directory, robot=None):
+    '''
+    Gives checkpoints under a directory that don't have a sidecar one, from what's stored in the zip (its spaces and
+    timestep count). There's no env config in there, so their env_config_hash is None.
+
+    :param robot: robot name to record (default: 'unknown')
+    :return: number of sidecars written
+    '''
+    from stable_baselines3.common.save_util import load_from_zip_file
+
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not name.endswith('.zip') or os.path.exists(metadata_path(path)):
+                continue
+            try:
+                data, _, _ = load_from_zip_file(path, load_data=True, device='cpu')
+            except Exception as e:
+                logger.warning(f"Skipping {path}: {e}")
+                continue
+            _write_json(metadata_path(path), {
+                'file': name,
+                'robot': robot or 'unknown',
+                'observation_shape': list(data['observation_space'].shape),
+                'action_shape': list(data['action_space'].shape),
+                'env_config_hash': None,
+                'timesteps': int(data.get('num_timesteps', 0)),
+                'eval_score': None,
+                'saved': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(path))),
+                'backfilled': True,
+            })
+            written += 1
+        if any(name.endswith(META_SUFFIX) for name in os.listdir(root)):
+            update_index(root)
+    return written
+
+
+class MetadataCheckpointCallback(CheckpointCallback):
+    '''
+    CheckpointCallback that writes a sidecar next to every checkpoint it saves.
+    '''
+
+    def __init__(self, env, *args, **kwargs):
+        '''
+        :param env: the BaseEnv being trained on (for its config)
+        '''
+        super().__init__(*args, **kwargs)
+        self.env = env
+
+    def _on_step(self):
+        saving = self.n_calls % self.save_freq == 0
+        result = super()._on_step()
+        if saving:
+            # mean training return over the last episodes (there's no separate evaluation during training)
+            returns = [info['r'] for info in self.model.ep_info_buffer]
+            write_metadata(self._checkpoint_path(extension='zip'), self.env, self.num_timesteps,
+                           train_return=float(np.mean(returns)) if returns else None)
+        return result
@@ -0,0 +1,125 @@
+'''
+Hot-reloading of checkpoints for visualize.py.
+
+CheckpointWatcher polls a checkpoint directory (recursively, so save_path picks up current/ too) on a background
+thread, loads every new .zip there and keeps the most recent ones cached. The control loop just reads
+watcher.active every step: swapping policies is a single attribute assignment, so the loop never waits on a load
+and never sees a half-loaded model. By default the newest checkpoint is activated as soon as it's loaded;
+select() cycles through the cached ones instead (and stops following new checkpoints until follow() is called).
+'''
+
+import os
+import time
+import threading
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class CheckpointWatcher:
+    '''
+    Loads new checkpoints from a directory in the background and keeps a small cache of policies to switch between.
+    '''
+
+    def __init__(self, directory, load_fn, poll_interval=2.0, max_cached=8, settle_time=1.0):
+        '''
+        :param directory: directory to watch (searched recursively for .zip files)
+        :param load_fn: function of a checkpoint path returning the policy (exceptions skip that checkpoint)
+        :param poll_interval: seconds between directory scans
+        :param max_cached: number of policies kept in memory (the newest ones, plus whichever is active)
+        :param settle_time: files modified less than this many seconds ago are left for the next scan (still being written)
+        '''
+        self.directory = directory
+        self.load_fn = load_fn
+        self.poll_interval = poll_interval
+        self.max_cached = max_cached
+        self.settle_time = settle_time
+        self.lock = threading.Lock()
+        self.policies = []     # (mtime, path, policy), oldest first
+        self.active = None     # (path, policy) the control loop should use
+        self.follow_latest = True
+        self.seen = {}         # path -> (mtime, size) of every file already tried, loaded or not
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        ''' Starts polling on a background thread. '''
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.poll()
+            self.stop_event.wait(self.poll_interval)
+
+    def poll(self):
+        ''' Scans the directory once and loads anything new. Returns the number of checkpoints loaded. '''
+        candidates = []
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith('.zip'):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if self.seen.get(path) != (stat.st_mtime, stat.st_size):
+                        candidates.append((stat.st_mtime, stat.st_size, path))
+        # only the newest ones would survive in the cache anyway
+        candidates = sorted(candidates)[-self.max_cached:]
+
+        loaded = 0
+        now = time.time()
+        for mtime, size, path in candidates:
+            if now - mtime < self.settle_time:
+                continue
+            self.seen[path] = (mtime, size)
+            try:
+                policy = self.load_fn(path)
+            except Exception as e:
+                logger.warning(f"Skipping checkpoint {path}: {e}")
+                continue
+            self._add(mtime, path, policy)
+            loaded += 1
+        return loaded
+
+    def _add(self, mtime, path, policy):
+        with self.lock:
+            self.policies = [entry for entry in self.policies if entry[1] != path]
+            self.policies.append((mtime, path, policy))
+            self.policies.sort(key=lambda entry: entry[0])
+            if self.active is None or (self.follow_latest and self.policies[-1][1] == path):
+                self.active = (path, policy)
+                logger.info(f"Now running {path}")
+            # drop the oldest policies, but never the one in use
+            while len(self.policies) > self.max_cached:
+                oldest = next(i for i, entry in enumerate(self.policies) if entry[1] != self.active[0])
+                del self.policies[oldest]
+
+    def select(self, offset):
+        ''' Switches to the cached checkpoint offset places newer (positive) or older (negative) than the active one. '''
+        with self.lock:
+            if not self.policies:
+                return
+            paths = [entry[1] for entry in self.policies]
+            index = paths.index(self.active[0]) if self.active[0] in paths else len(paths) - 1
+            _, path, policy = self.policies[(index + offset) % len(self.policies)]
+            self.active = (path, policy)
+            self.follow_latest = False
+        logger.info(f"Now running {path} (not following new checkpoints, press Enter to go back to the latest)")
+
+    def follow(self):
+        ''' Switches to the newest checkpoint and keeps following new ones as they're saved. '''
+        with self.lock:
+            self.follow_latest = True
+            if self.policies:
+                _, path, policy = self.policies[-1]
+                self.active = (path, policy)
+                logger.info(f"Now running {path} (following new checkpoints)")
@@ -21,7 +21,9 @@ ROBOTS = {
         # New: discourage jumping/high vertical motion.
         'JUMP_PENALTY_WEIGHT': 0.1,     # Penalize excessive vertical velocity
         'HIGH_ALTITUDE_PENALTY_WEIGHT': 0.1,  # Penalize staying too high above ground """
-        'ACTION_LIMIT': 0.2 # Proportional limit on joint angles. Should be between 0 and 1 # 0 is default and means no restriction. Otherwise smaller limit means more restriction.
+        'ACTION_LIMIT': 0.2, # Proportional limit on joint angles. Should be between 0 and 1 # 0 is default and means no restriction. Otherwise smaller limit means more restriction.
+        'foot_link_pattern': r'^thigh_',  # Regex for the foot link names (for contact sensing)
+        'home_stance': {'height': 1.0, 'spread': 0.0},  # Single joint legs: stand on straight legs
     },
     'servobot': {
         'urdf_file': "robots/full_servobot/servobot.urdf",
@@ -42,6 +44,22 @@ ROBOTS = {
         'ORIENTATION_REWARD_WEIGHT': 2.0,  # INCREASED - now properly scaled with exp function
         'ACTION_LIMIT': 0.2, # Proportional limit on joint angles. Should be between 0 and 1 # 0 is default and means no restriction. Otherwise smaller limit means more restriction.
         'INITIAL_MOMENTUM': 0.3,  # REDUCED - less chaotic starts help learning
+        # Observation components, in order (see observations.py). Without an entry it's the original full layout, which
+        # the checkpoints so far were trained on. A smaller one without the unbounded world x/y, for example:
+        # 'observation': ['joint_positions', 'joint_velocities', 'base_height', 'projected_gravity',
+        #                 'base_linear_velocity', 'base_angular_velocity', 'target_velocity', 'target_turn'],
+        'foot_link_pattern': r'^botlegasm',  # Regex for the foot link names (for contact sensing)
+        'body_link': 'mainbody',  # The URDF is rooted at a hip, so tell the URDF kinematics where the body is
+        'ik_table_path': 'models/ik_tables/servobot_ik.npy',  # Cached IK lookup table for 'foot' action mode (built on first use)
+        'height_scan': {'size': (0.6, 0.4), 'resolution': 0.05, 'update_every': 2},  # Small robot: finer, tighter grid
+        # Per-episode dynamics when training with domain randomization (see randomization.py for the format)
+        'domain_randomization': {
+            'friction': ('uniform', 0.5, 1.1),
+            'mass_scale': ('uniform', 0.85, 1.15),
+            'motor_strength': ('uniform', 0.8, 1.2),  # hobby servos vary a lot
+            'gravity_tilt': ('uniform', 0.0, 0.05),
+            'latency': ('uniform', 0.0, 0.02),  # seconds
+        },
     },
     'arachne': {
         'urdf_file': "robots/arachne/arachne.urdf",
@@ -63,6 +81,19 @@ ROBOTS = {
         'ORIENTATION_REWARD_WEIGHT': 1,  # Reward for facing the direction of movement
         'ACTION_LIMIT': 0.5, # Proportional limit on joint angles. Should be between 0 and 1 # 0 is default and means no restriction. Otherwise smaller limit means more restriction.
         'INITIAL_MOMENTUM': 1.0,  # Scale of random initial momentum at start of episode (0.0 to 1.0
-        'START_POSITION': [0, 0, 0.1]
+        'START_POSITION': [0, 0, 0.1],
+        'foot_link_pattern': r'^rightfemur',  # Regex for the foot link names (for contact sensing)
+        # Pi camera in the face (the mask mesh on the -y side of the base link), see camera.py for the options
+        'camera': {'position': [-0.038, -0.185, 0.055], 'forward': [0, -1, 0], 'up': [0, 0, 1],
+                   'width': 64, 'height': 48, 'mode': 'depth', 'fps': 10},
+        'home_stance': {'height': 0.5, 'spread': 0.5},  # Standing pose, as fractions of leg reach (see urdf_kinematics.py)
+        # Per-episode dynamics when training with domain randomization (see randomization.py for the format)
+        'domain_randomization': {
+            'friction': ('uniform', 0.5, 1.1),
+            'mass_scale': ('uniform', 0.9, 1.1),
+            'motor_strength': ('uniform', 0.85, 1.15),
+            'gravity_tilt': ('uniform', 0.0, 0.05),
+            'latency': ('uniform', 0.0, 0.02),  # seconds
+        },
     },
 }
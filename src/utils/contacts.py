@@ -0,0 +1,108 @@
+'''
+Foot contact sensing for BaseEnv.
+
+The foot links are found once at init from a per-robot name pattern in config.py ('foot_link_pattern', a regex
+matched against the URDF link names). After that, every update() is a single getContactPoints query against the
+ground, reduced with NumPy into per-foot contact flags and normal forces (plus whether anything other than a foot
+is touching the ground). Contact counts are also accumulated over the episode for gait metrics like duty factor.
+'''
+
+import re
+import numpy as np
+import pybullet as p
+
+
+class FootContacts:
+    '''
+    Per-foot ground contact for one robot in the current PyBullet simulation.
+    '''
+
+    def __init__(self, robot_id, ground_ids, foot_link_pattern):
+        '''
+        :param robot_id: PyBullet body id of the robot
+        :param ground_ids: body ids that count as ground (plane, terrain)
+        :param foot_link_pattern: regex for the foot link names, e.g. '^botlegasm'
+        '''
+        self.robot_id = robot_id
+        self.ground_ids = list(ground_ids)
+        num_links = p.getNumJoints(robot_id)
+        link_names = [p.getJointInfo(robot_id, i)[12].decode('utf-8') for i in range(num_links)]
+        self.foot_links = [i for i, name in enumerate(link_names) if re.search(foot_link_pattern, name)]
+        if not self.foot_links:
+            raise ValueError(f"No links match the foot pattern '{foot_link_pattern}' (links: {link_names})")
+        self.foot_names = [link_names[i] for i in self.foot_links]
+        self.num_feet = len(self.foot_links)
+
+        # link index -> foot slot (or -1), shifted by one so the base (link -1) has a slot too
+        self.foot_slot = np.full(num_links + 1, -1)
+        self.foot_slot[np.array(self.foot_links) + 1] = np.arange(self.num_feet)
+
+        # Robot weight, so forces can be given to the policy as fractions of it
+        total_mass = sum(p.getDynamicsInfo(robot_id, link)[0] for link in range(-1, num_links))
+        self.weight = total_mass * 9.81
+
+        self.in_contact = np.zeros(self.num_feet, dtype=bool)
+        self.normal_forces = np.zeros(self.num_feet)
+        self.body_contact = False
+        self.reset()
+
+    def reset(self):
+        ''' Clears the per-episode gait statistics (call on env reset). '''
+        self.contact_steps = np.zeros(self.num_feet, dtype=int)
+        self.touchdowns = np.zeros(self.num_feet, dtype=int)
+        self.steps = 0
+        self.in_contact[:] = False
+        self.normal_forces[:] = 0.0
+        self.body_contact = False
+
+    def update(self):
+        '''
+        Reads the current contacts (one getContactPoints call) and updates the per-foot flags, normal forces,
+        body contact and episode statistics.
+
+        :return: (in_contact (num_feet,) bool, normal_forces (num_feet,) in newtons)
+        '''
+        if len(self.ground_ids) == 1:
+            points = p.getContactPoints(bodyA=self.robot_id, bodyB=self.ground_ids[0])
+        else:
+            # No self collision in our envs, so every contact of the robot is with some other body
+            points = p.getContactPoints(bodyA=self.robot_id)
+
+        was_in_contact = self.in_contact.copy()
+        if points:
+            if len(self.ground_ids) > 1:
+                points = [point for point in points if point[2] in self.ground_ids]
+            links = np.fromiter((point[3] for point in points), dtype=int, count=len(points))
+            forces = np.fromiter((point[9] for point in points), dtype=float, count=len(points))
+            slots = self.foot_slot[links + 1]
+            is_foot = slots >= 0
+            foot_slots = slots[is_foot]
+            self.in_contact[:] = np.bincount(foot_slots, minlength=self.num_feet) > 0
+            self.normal_forces[:] = np.bincount(foot_slots, weights=forces[is_foot], minlength=self.num_feet)
+            self.body_contact = not is_foot.all()
+        else:
+            self.in_contact[:] = False
+            self.normal_forces[:] = 0.0
+            self.body_contact = False
+
+        self.steps += 1
+        self.contact_steps += self.in_contact
+        self.touchdowns += self.in_contact & ~was_in_contact
+        return self.in_contact, self.normal_forces
+
+    @property
+    def duty_factor(self):
+        ''' Fraction of this episode's updates each foot spent on the ground. '''
+        return self.contact_steps / max(self.steps, 1)
+
+    def observation(self):
+        ''' Contact flags followed by normal forces as fractions of the robot's weight (2 values per foot). '''
+        return np.concatenate([self.in_contact, self.normal_forces / self.weight])
+
+    def gait_metrics(self):
+        ''' Episode gait statistics so far, for info dicts and logging. '''
+        return {
+            'duty_factor': self.duty_factor.copy(),
+            'touchdowns': self.touchdowns.copy(),
+            'contact_steps': self.steps,
+        }
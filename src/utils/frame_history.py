@@ -0,0 +1,137 @@
+'''
+Frame-stacked observation history without copying frames around.
+
+With BaseEnv(frame_stack=K) the policy sees the last K observation frames (and, with stack_actions, the action
+before each of them), oldest first, so an MLP gets some temporal context without a recurrent network:
+
+    [frame t-K+1, action t-K] ... [frame t-1, action t-2] [frame t, action t-1]
+
+The rows live in a preallocated circular buffer with a write index. Every row is written twice, at index i and
+i + K of a 2K row buffer, so the last K rows in order are always the contiguous block [i + 1, i + K + 1). Reading
+the history is a view of that block, with no np.concatenate or np.roll per step, and the env returns one copy of it.
+
+A step advances the write index and the env writes its frame into the new row. reset() clears the history, and the
+first frame written after that fills every row (the episode's first frame with no previous actions), so nothing
+leaks from one episode into the next, including when a vector env resets an env automatically.
+'''
+
+import numpy as np
+
+
+class FrameHistory:
+    '''
+    The last K rows of (frame, previous action), in a double-written circular buffer.
+    '''
+
+    def __init__(self, frame_size, length, action_size=0, dtype=np.float32):
+        '''
+        :param frame_size: values per observation frame
+        :param length: K, the number of frames kept
+        :param action_size: values per action (0 to not keep actions)
+        '''
+        self.frame_size = frame_size
+        self.length = length
+        self.row_size = frame_size + action_size
+        self.rows = np.zeros((2 * length, self.row_size), dtype=dtype)
+        # Views for every write index, made once: (row, its frame part, its action part, its second copy) and the
+        # history ending at it
+        self.row_views = [(self.rows[i], self.rows[i, :frame_size], self.rows[i, frame_size:], self.rows[i + length])
+                          for i in range(length)]
+        self.blocks = [self.rows[i + 1:i + 1 + length].reshape(-1) for i in range(length)]
+        self.keep_actions = action_size > 0
+        self.index = 0
+        self.empty = True
+
+    @property
+    def size(self):
+        ''' Values in the stacked observation '''
+        return self.length * self.row_size
+
+    def clear(self):
+        ''' Forgets every row, the next write() fills the whole history '''
+        self.index = 0
+        self.empty = True
+
+    def advance(self):
+        ''' Moves on to a new row (the oldest one is dropped) '''
+        self.index = (self.index + 1) % self.length
+
+    def write(self, frame, action=None):
+        '''
+        Writes the newest row (writing again before the next advance() overwrites it).
+
+        :param frame: the observation frame
+        :param action: the action taken before it (if actions are kept)
+        '''
+        row, row_frame, row_action, row_copy = self.row_views[self.index]
+        row_frame[:] = frame
+        if self.keep_actions:
+            row_action[:] = action
+        if self.empty:
+            self.rows[:] = row
+            self.empty = False
+        else:
+            row_copy[:] = row
+
+    def view(self):
+        ''' The history, oldest row first, as a flat view into the buffer (valid until the next write) '''
+        return self.blocks[self.index]
+
+
+def stacked_segments(segments, length, action_size=0):
+    '''
+    Named segments of a stacked observation: 'name[t-2]', 'name[t-1]', 'name' and 'previous_action[t-1]'... for each
+    row, so the current frame keeps its plain names (weight surgery can carry an unstacked checkpoint over).
+
+    :param segments: (name, size) of one frame
+    '''
+    stacked = []
+    for lag in range(length - 1, -1, -1):
+        suffix = f"[t-{lag}]" if lag else ''
+        stacked += [(name + suffix, size) for name, size in segments]
+        if action_size:
+            stacked.append((f"previous_action{suffix}", action_size))
+    return stacked
+
+
+if __name__ == "__main__":
+    # Per-step cost of keeping and returning a K-frame history, compared with stacking a deque of frames every step
+    import time
+    from collections import deque
+
+    frame_size, action_size, n = 65, 12, 20000
+    frame, action = np.random.rand(frame_size).astype(np.float32), np.random.rand(action_size).astype(np.float32)
+    for length in (1, 2, 4, 8):
+        history = FrameHistory(frame_size, length, action_size)
+        start = time.perf_counter()
+        for _ in range(n):
+            history.advance()
+            history.write(frame, action)
+            history.view().copy()
+        ring_time = time.perf_counter() - start
+
+        frames = deque([np.concatenate([frame, action])] * length, maxlen=length)
+        start = time.perf_counter()
+        for _ in range(n):
+            frames.append(np.concatenate([frame, action]))
+            np.concatenate(frames)
+        deque_time = time.perf_counter() - start
+        print(f"K={length}: ring buffer {1e6 * ring_time / n:.2f} us per step, deque + concatenate {1e6 * deque_time / n:.2f} us per step")
+
+    # Whole env steps, where the physics dominates (one env at a time, PyBullet's default client is per process)
+    from .config import ROBOTS
+    from ..envs.env import BaseEnv, get_min_z
+
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    for length in (1, 8, 1, 8):  # twice each, run to run noise is bigger than the difference
+        env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], frame_stack=length,
+                      stack_actions=length > 1, reward_history_file=False)
+        env.reset(seed=0)
+        action = np.zeros(env.action_space.shape, dtype=np.float32)
+        start = time.perf_counter()
+        for _ in range(2000):
+            if any(env.step(action)[2:4]):
+                env.reset()
+        print(f"BaseEnv.step with K={length} (observation size {env.observation_space.shape[0]}): "
+              f"{1e6 * (time.perf_counter() - start) / 2000:.0f} us per step")
+        env.close()
@@ -0,0 +1,97 @@
+'''
+Ray-cast height scan around the robot for BaseEnv.
+
+A grid of vertical rays is laid out around the base in its yaw frame (so "ahead" is always the same part of the
+scan). The grid offsets are computed once; each update only rotates them with NumPy into preallocated ray buffers
+and makes a single rayTestBatch call. Rays only see static bodies (plane.urdf and terrain), never the robot.
+They start a little above the base, so steps and bumps right under the body show up instead of reading as holes.
+PyBullet still ray tests the robot's collision meshes before filtering the hits out, so on robots with many mesh
+shapes (arachne) the scan costs a few ms (about 30x more than rays starting below the body, which miss that
+terrain). Use update_every there if it matters.
+
+Each value is how far the ground at that grid point is below the base, so flat ground under a level robot reads
+as the base height everywhere. Updates can be done every k-th call to keep the cost bounded.
+'''
+
+import numpy as np
+import pybullet as p
+
+
+HEIGHT_SCAN_DEFAULTS = {
+    'size': (1.0, 0.6),      # (forward, sideways) extent of the grid in meters, centred on the base
+    'resolution': 0.1,       # spacing between rays in meters
+    'update_every': 1,       # recompute the scan every k-th observation (reusing the last scan in between)
+    'ray_start': 0.05,       # rays start this far above the base (negative = below it)...
+    'ray_length': 2.0,       # ...and go down this far (misses read as ray_length - ray_start)
+}
+
+# Bullet puts static bodies (mass 0, like the plane and the terrain) in collision filter group 2 and dynamic ones in 1
+_STATIC_FILTER = 2
+
+
+class HeightScan:
+    '''
+    Grid of ground heights around one robot, in the base yaw frame.
+    '''
+
+    def __init__(self, robot_id, **params):
+        '''
+        :param robot_id: PyBullet body id of the robot
+        :param params: overrides for HEIGHT_SCAN_DEFAULTS
+        '''
+        unknown = set(params) - set(HEIGHT_SCAN_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown height scan parameters: {sorted(unknown)}")
+        self.params = {**HEIGHT_SCAN_DEFAULTS, **params}
+        self.robot_id = robot_id
+        self.update_every = max(int(self.params['update_every']), 1)
+
+        # Grid offsets in the base yaw frame, x forward and y left, laid out x-major
+        resolution = self.params['resolution']
+        counts = [int(round(extent / resolution)) + 1 for extent in self.params['size']]
+        xs = (np.arange(counts[0]) - (counts[0] - 1) / 2) * resolution
+        ys = (np.arange(counts[1]) - (counts[1] - 1) / 2) * resolution
+        self.grid_shape = tuple(counts)
+        self.offsets = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1).reshape(-1, 2)
+        self.num_rays = len(self.offsets)
+
+        # Reused buffers for the ray ends, rotated offsets and the scan itself
+        self.ray_from = np.empty((self.num_rays, 3))
+        self.ray_to = np.empty((self.num_rays, 3))
+        self._rotated = np.empty((self.num_rays, 2))
+        self._rotation = np.empty((2, 2))
+        self.heights = np.zeros(self.num_rays)
+        self.calls = 0
+
+    def reset(self):
+        ''' Forces a fresh scan on the next observation() (call on env reset). '''
+        self.calls = 0
+
+    def update(self):
+        ''' Casts the whole grid in one rayTestBatch call and returns the heights (num_rays,) '''
+        (x, y, z), (qx, qy, qz, qw) = p.getBasePositionAndOrientation(self.robot_id)
+        yaw = np.arctan2(2 * (qw * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))
+        c, s = np.cos(yaw), np.sin(yaw)
+        self._rotation[0, 0], self._rotation[0, 1] = c, s
+        self._rotation[1, 0], self._rotation[1, 1] = -s, c
+        np.matmul(self.offsets, self._rotation, out=self._rotated)
+
+        self.ray_from[:, 0] = self._rotated[:, 0] + x
+        self.ray_from[:, 1] = self._rotated[:, 1] + y
+        self.ray_from[:, 2] = z + self.params['ray_start']
+        self.ray_to[:, :2] = self.ray_from[:, :2]
+        self.ray_to[:, 2] = self.ray_from[:, 2] - self.params['ray_length']
+
+        results = p.rayTestBatch(self.ray_from, self.ray_to, collisionFilterMask=_STATIC_FILTER)
+        # misses come back with hit fraction 1, i.e. the end of the ray
+        fractions = np.fromiter((result[2] for result in results), dtype=float, count=self.num_rays)
+        np.multiply(fractions, self.params['ray_length'], out=self.heights)
+        self.heights -= self.params['ray_start']
+        return self.heights
+
+    def observation(self):
+        ''' The scan, recomputed on every update_every-th call and reused in between. '''
+        if self.calls % self.update_every == 0:
+            self.update()
+        self.calls += 1
+        return self.heights
@@ -1,3 +1,6 @@
+import os
+import json
+import itertools
 import numpy as np
 import typing
 
@@ -9,6 +12,13 @@ PosArray = typing.Annotated[np.typing.NDArray[_DType], typing.Literal[12]]
 # Type for a numpy array of length 12, representing configuration of ServoBot
 CfgArray = typing.Annotated[np.typing.NDArray[_DType], typing.Literal[12]]
 
+# Batched versions of the above, shape (N, 12)
+PosBatch = typing.Annotated[np.typing.NDArray[_DType], typing.Literal["N", 12]]
+CfgBatch = typing.Annotated[np.typing.NDArray[_DType], typing.Literal["N", 12]]
+
+# Boolean mask of shape (N, 4), True where a leg's target was reachable
+ValidMask = typing.Annotated[np.typing.NDArray[np.bool_], typing.Literal["N", 4]]
+
 JOINT_NAMES = [
     "FL_Hip",
     "FL_TopLeg",
@@ -67,31 +77,64 @@ class IK:
         """
         output_cfg = []
 
-        positions += self.input_off
+        positions = positions + self.input_off
 
         for i in range(4):
             x, y, z = positions[3 * i:3 * i + 3]
             x2_z2 = x ** 2 + z ** 2
             dist_xy = np.sqrt(x2_z2)
             th1 = np.asin(x / dist_xy) - np.asin(self.off3 / dist_xy)
-            th3 = np.acos(
-                (
-                        (y - self.off1) ** 2
-                        + (np.sqrt(x2_z2 - self.off3 ** 2) - self.off2) ** 2
-                        - self.a
-                )
-                / self.b
-            )
-            a = self.b * np.cos(th3) + self.a
-            b = np.sqrt(
-                (self.thigh + self.calf * np.cos(th3)) ** 2
-                * (a + y * self.c - y ** 2 - self.d)
-            )
-            th2 = np.acos((np.sin(th3) * self.calf * (y - self.off1) + b) / a)
+            reach = np.sqrt(x2_z2 - self.off3 ** 2) - self.off2
+            th3 = np.acos(((y - self.off1) ** 2 + reach ** 2 - self.a) / self.b)
+            # atan2 instead of acos so targets that need the thigh swung backwards (th2 < 0) are still solved
+            k1 = self.thigh + self.calf * np.cos(th3)
+            k2 = self.calf * np.sin(th3)
+            th2 = np.atan2(k2 * reach - k1 * (y - self.off1), k1 * reach + k2 * (y - self.off1))
             output_cfg.extend([th1, th2, th3])
 
         return np.array(output_cfg) * self.output_mult
 
+    def solve_batch(self, positions: PosBatch, tol: float = 1e-9) -> tuple[CfgBatch, ValidMask]:
+        """
+        Vectorized version of solve() for many foot position targets at once. The input is never modified.
+
+        Unreachable leg targets don't produce NaNs: the trig arguments are clipped so the leg gets the closest
+        (fully stretched / folded) configuration, and the leg is flagged False in the returned mask.
+
+        :param positions: numpy array of shape (N, 12) (a single (12,) array is treated as N=1)
+        :param tol: slack allowed on the asin/acos arguments before a target counts as unreachable
+        :return: tuple of joint configs of shape (N, 12) and validity mask of shape (N, 4)
+        """
+        pos = np.asarray(positions, dtype=np.float64).reshape(-1, 4, 3) + self.input_off.reshape(4, 3)
+        x, y, z = pos[..., 0], pos[..., 1], pos[..., 2]
+
+        x2_z2 = x ** 2 + z ** 2
+        dist_xy = np.sqrt(x2_z2)
+        reach_sq = x2_z2 - self.off3 ** 2
+        valid = reach_sq >= 0.0
+
+        # hip angle (guard against a foot placed exactly on the hip axis)
+        safe_dist = np.where(dist_xy > 0.0, dist_xy, 1.0)
+        s1 = x / safe_dist
+        s2 = self.off3 / safe_dist
+        valid &= (np.abs(s1) <= 1.0 + tol) & (s2 <= 1.0 + tol)
+        th1 = np.asin(np.clip(s1, -1.0, 1.0)) - np.asin(np.clip(s2, -1.0, 1.0))
+
+        # knee angle from the law of cosines in the leg plane
+        dy = y - self.off1
+        reach = np.sqrt(np.maximum(reach_sq, 0.0)) - self.off2
+        c3 = (dy ** 2 + reach ** 2 - self.a) / self.b
+        valid &= np.abs(c3) <= 1.0 + tol
+        th3 = np.acos(np.clip(c3, -1.0, 1.0))
+
+        # thigh angle, rotating the (thigh + calf) chain onto the target
+        k1 = self.thigh + self.calf * np.cos(th3)
+        k2 = self.calf * np.sin(th3)
+        th2 = np.atan2(k2 * reach - k1 * dy, k1 * reach + k2 * dy)
+
+        cfg = np.stack([th1, th2, th3], axis=-1).reshape(-1, 12) * self.output_mult
+        return cfg, valid
+
     def get_idle_cfg(self, height=0.13) -> dict[str, float]:
         """
         Returns a configuration array for
@@ -103,6 +146,378 @@ class IK:
         return {JOINT_NAMES[i]: c for (i, c) in enumerate(config.tolist())}
 
 
+class FK:
+    """
+    Class for analytically solving forward kinematics for ServoBot. This is the inverse of IK, so foot positions
+    are expressed in the same per-leg frame that IK.solve takes as input (foot straight below the hip at
+    [0, 0, -height] when idle).
+    """
+
+    def __init__(self, off1=0.04064, off2=0.0254, off3=0.01524, thigh=0.109855, calf=0.0762, hip_offsets=None):
+        """
+        Constructor for FK class. Link parameters default to (and should match) the ones used by IK.
+
+        :param off1: offset 1 length in meters
+        :param off2: offset 2 length in meters
+        :param off3: offset 3 length in meters
+        :param thigh: thigh length in meters
+        :param calf: calf length in meters
+        :param hip_offsets: optional array of shape (4, 3) added to each leg's foot position, e.g. to move from the
+            per-leg IK frame to a body frame. Defaults to zeros.
+        """
+        self.off1 = off1
+        self.off2 = off2
+        self.off3 = off3
+
+        self.thigh = thigh
+        self.calf = calf
+
+        self.hip_offsets = np.zeros((4, 3)) if hip_offsets is None else np.asarray(hip_offsets, dtype=np.float64)
+        self.output_off = np.array([self.off3, 0, 0] * 4).reshape(4, 3)
+        # same sign flips as IK.output_mult (which is its own inverse)
+        self.input_mult = np.array([1, 1, 1, 1, -1, -1, -1, 1, 1, -1, -1, -1])
+
+    @classmethod
+    def from_ik(cls, ik: IK, hip_offsets=None) -> "FK":
+        """
+        Builds an FK solver with the same link parameters as an existing IK solver.
+        """
+        return cls(ik.off1, ik.off2, ik.off3, ik.thigh, ik.calf, hip_offsets=hip_offsets)
+
+    def solve(self, config: CfgArray) -> PosArray:
+        """
+        Function to solve for leg positions given a joint configuration.
+
+        :param config: numpy array of shape (12,)
+        :return: numpy array of shape (12,)
+        """
+        return self.solve_batch(config)[0]
+
+    def solve_batch(self, configs: CfgBatch) -> PosBatch:
+        """
+        Vectorized forward kinematics for many configurations at once.
+
+        :param configs: numpy array of shape (N, 12) (a single (12,) array is treated as N=1)
+        :return: foot positions, numpy array of shape (N, 12)
+        """
+        cfg = (np.asarray(configs, dtype=np.float64).reshape(-1, 12) * self.input_mult).reshape(-1, 4, 3)
+        th1, th2, th3 = cfg[..., 0], cfg[..., 1], cfg[..., 2]
+
+        # two link planar chain (thigh + calf) in the leg plane
+        k1 = self.thigh + self.calf * np.cos(th3)
+        k2 = self.calf * np.sin(th3)
+        reach = k1 * np.cos(th2) + k2 * np.sin(th2) + self.off2
+        dy = k2 * np.cos(th2) - k1 * np.sin(th2)
+
+        # rotate the leg plane about the hip axis
+        sin1, cos1 = np.sin(th1), np.cos(th1)
+        x = reach * sin1 + self.off3 * cos1
+        z = self.off3 * sin1 - reach * cos1
+
+        pos = np.stack([x, dy, z], axis=-1) - self.output_off + self.hip_offsets
+        return pos.reshape(-1, 12)
+
+
+class IKTable:
+    """
+    Precomputed single leg IK solutions on a dense grid over the leg's workspace, for when calling the analytic
+    solver is too slow (real-time control loops on weak CPUs, IK-space actions in BaseEnv, ...).
+    All four legs share the same geometry, so one table holds the un-mirrored angles and the per-leg sign flips
+    from IK.output_mult are applied on the way out.
+
+    The table can be saved as a .npy file and memory-mapped, so every process that loads it shares the same pages.
+    Lookups use trilinear interpolation between the 8 surrounding grid points.
+    """
+
+    def __init__(self, table, lower, upper, output_mult):
+        """
+        Constructor for IKTable. Normally you want IKTable.build() or IKTable.load() instead.
+
+        :param table: array of shape (nx, ny, nz, 4) holding hip, thigh and knee angles plus a 0/1 reachable flag
+        :param lower: lower corner of the grid (x, y, z) in meters, in IK's per-leg frame
+        :param upper: upper corner of the grid (x, y, z) in meters
+        :param output_mult: IK.output_mult, the per-joint sign flips for each leg
+        """
+        self.table = table
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.output_mult = np.asarray(output_mult, dtype=np.float64).reshape(4, 3)
+
+        shape = np.array(table.shape[:3])
+        self.inv_spacing = (shape - 1) / (self.upper - self.lower)
+        self.max_grid = (shape - 1).astype(np.float64)
+        self.max_cell = (shape - 2).astype(np.float64)
+
+        # flat view of the table and the flat offsets of the 8 corners of a grid cell (x-major, like the table)
+        self.flat_table = table.reshape(-1, 4)
+        self.strides = np.array([shape[1] * shape[2], shape[2], 1], dtype=np.intp)
+        self.corner_offsets = np.array(
+            [dx * self.strides[0] + dy * self.strides[1] + dz * self.strides[2]
+             for dx, dy, dz in itertools.product((0, 1), repeat=3)], dtype=np.intp)
+
+        # work buffers for lookup(), so a lookup never allocates new arrays
+        self._grid = np.empty((4, 3))
+        self._clipped = np.empty((4, 3))
+        self._floor = np.empty((4, 3))
+        self._frac = np.empty((4, 3))
+        self._index = np.empty((4, 3), dtype=np.intp)
+        self._base = np.empty(4, dtype=np.intp)
+        self._corner_index = np.empty((4, 8), dtype=np.intp)
+        self._corners = np.empty((4, 8, 4), dtype=table.dtype)
+        self._lerp_x = np.empty((4, 2, 2, 4))
+        self._lerp_y = np.empty((4, 2, 4))
+        self._lerp_z = np.empty((4, 4))
+        self._outside = np.empty((4, 3), dtype=np.bool_)
+        self._any_outside = np.empty(4, dtype=np.bool_)
+        self._valid = np.empty(4, dtype=np.bool_)
+        self._out = np.empty(12)
+
+        # views into the work buffers, made once so lookup() only has to call ufuncs
+        corners = self._corners.reshape(4, 2, 2, 2, 4)
+        self._corners_x0, self._corners_x1 = corners[:, 0], corners[:, 1]
+        self._lerp_x0, self._lerp_x1 = self._lerp_x[:, 0], self._lerp_x[:, 1]
+        self._lerp_y0, self._lerp_y1 = self._lerp_y[:, 0], self._lerp_y[:, 1]
+        self._frac_x = self._frac[:, 0, None, None, None]
+        self._frac_y = self._frac[:, 1, None, None]
+        self._frac_z = self._frac[:, 2, None]
+        self._base_column = self._base[:, None]
+        self._angles = self._lerp_z[:, :3]
+        self._reachable = self._lerp_z[:, 3]
+
+    @staticmethod
+    def workspace_bounds(ik: IK) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (lower, upper) corners of a box holding every reachable foot position below the hip.
+        """
+        reach = np.hypot(ik.off2 + ik.thigh + ik.calf, ik.off3)
+        leg = ik.thigh + ik.calf
+        lower = np.array([-reach - ik.off3, -leg, -reach])
+        upper = np.array([reach - ik.off3, leg, 0.0])
+        return lower, upper
+
+    @classmethod
+    def build(cls, ik: IK = None, resolution=64, lower=None, upper=None, path=None) -> "IKTable":
+        """
+        Solves IK on every grid point and builds a table from the results.
+
+        :param ik: IK solver to tabulate (default IK())
+        :param resolution: grid points per axis (an int, or one per axis)
+        :param lower: lower corner of the grid, defaults to IKTable.workspace_bounds()
+        :param upper: upper corner of the grid, defaults to IKTable.workspace_bounds()
+        :param path: if given, the table is written to this .npy file (plus a .json sidecar) and memory-mapped
+        :return: IKTable
+        """
+        ik = IK() if ik is None else ik
+        default_lower, default_upper = cls.workspace_bounds(ik)
+        lower = default_lower if lower is None else np.asarray(lower, dtype=np.float64)
+        upper = default_upper if upper is None else np.asarray(upper, dtype=np.float64)
+        shape = tuple(int(n) for n in np.broadcast_to(resolution, (3,)))
+
+        axes = [np.linspace(lower[i], upper[i], shape[i]) for i in range(3)]
+        points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        # pack the grid points 4 to a row so every leg slot of the batched solver does useful work,
+        # then undo the per-leg sign flips to get back to plain (un-mirrored) leg angles
+        num_points = len(points)
+        padded = np.zeros((-(-num_points // 4) * 4, 3))
+        padded[:num_points] = points
+        cfgs, valid = ik.solve_batch(padded.reshape(-1, 12))
+        angles = (cfgs * ik.output_mult).reshape(-1, 3)[:num_points]
+        valid = valid.reshape(-1)[:num_points]
+
+        if path is None:
+            table = np.empty(shape + (4,), dtype=np.float32)
+            table[..., :3] = angles.reshape(shape + (3,))
+            table[..., 3] = valid.reshape(shape)
+            return cls(table, lower, upper, ik.output_mult)
+
+        # Workers building the same table at once must never memory-map half a file, so both files are written under
+        # per-process temp names and renamed into place. The old sidecar goes first, so a reader in between rebuilds
+        # instead of pairing the new table with old metadata.
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path, temp_json_path = f"{path}.{os.getpid()}.tmp", f"{path}.json.{os.getpid()}.tmp"
+        try:
+            table = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=shape + (4,))
+            table[..., :3] = angles.reshape(shape + (3,))
+            table[..., 3] = valid.reshape(shape)
+            table.flush()
+            del table
+            with open(temp_json_path, 'w') as f:
+                json.dump(cls._metadata(ik, lower, upper, shape), f, indent=2)
+            try:
+                os.remove(path + '.json')
+            except FileNotFoundError:
+                pass
+            os.replace(temp_path, path)
+            os.replace(temp_json_path, path + '.json')
+        finally:
+            for leftover in (temp_path, temp_json_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path) -> "IKTable":
+        """
+        Memory-maps a table previously written by IKTable.build(path=...).
+        """
+        with open(path + '.json') as f:
+            metadata = json.load(f)
+        table = np.load(path, mmap_mode='r')
+        return cls(table, metadata['lower'], metadata['upper'], metadata['output_mult'])
+
+    @classmethod
+    def load_or_build(cls, path, ik: IK = None, resolution=64) -> "IKTable":
+        """
+        Loads the table at path if it was built for the same link parameters and resolution, otherwise (re)builds it.
+        """
+        ik = IK() if ik is None else ik
+        shape = tuple(int(n) for n in np.broadcast_to(resolution, (3,)))
+        if os.path.exists(path) and os.path.exists(path + '.json'):
+            with open(path + '.json') as f:
+                metadata = json.load(f)
+            if metadata == cls._metadata(ik, metadata['lower'], metadata['upper'], shape):
+                return cls.load(path)
+        return cls.build(ik, resolution=resolution, path=path)
+
+    @staticmethod
+    def _metadata(ik: IK, lower, upper, shape) -> dict:
+        return {
+            'lower': np.asarray(lower, dtype=np.float64).tolist(),
+            'upper': np.asarray(upper, dtype=np.float64).tolist(),
+            'shape': [int(n) for n in shape],
+            'output_mult': ik.output_mult.tolist(),
+            'links': [ik.off1, ik.off2, ik.off3, ik.thigh, ik.calf],
+        }
+
+    def lookup(self, positions: PosArray, out: CfgArray = None) -> CfgArray:
+        """
+        Interpolated IK for one set of 4 foot targets. Only writes into preallocated buffers, so it is safe to call
+        from a tight real-time loop.
+
+        :param positions: numpy array of shape (12,)
+        :param out: optional numpy array of shape (12,) to write the joint angles into. If not given, an internal
+            buffer is returned, which gets overwritten by the next lookup.
+        :return: numpy array of shape (12,). Reachability of each leg is left in self.last_valid (shape (4,)).
+        """
+        out = self._out if out is None else out
+
+        # continuous grid coordinates, clamped to the table (targets outside it count as unreachable)
+        np.subtract(positions.reshape(4, 3), self.lower, out=self._grid)
+        np.multiply(self._grid, self.inv_spacing, out=self._grid)
+        np.clip(self._grid, 0.0, self.max_grid, out=self._clipped)
+        np.not_equal(self._grid, self._clipped, out=self._outside)
+        np.any(self._outside, axis=1, out=self._any_outside)
+
+        # lower corner of the grid cell and the position inside it
+        np.floor(self._clipped, out=self._floor)
+        np.minimum(self._floor, self.max_cell, out=self._floor)
+        np.subtract(self._clipped, self._floor, out=self._frac)
+        np.copyto(self._index, self._floor, casting='unsafe')
+
+        # gather the 8 corners of each leg's cell
+        np.dot(self._index, self.strides, out=self._base)
+        np.add(self._base_column, self.corner_offsets, out=self._corner_index)
+        np.take(self.flat_table, self._corner_index, axis=0, out=self._corners)
+
+        # trilinear interpolation, one axis at a time
+        np.subtract(self._corners_x1, self._corners_x0, out=self._lerp_x)
+        np.multiply(self._lerp_x, self._frac_x, out=self._lerp_x)
+        np.add(self._lerp_x, self._corners_x0, out=self._lerp_x)
+        np.subtract(self._lerp_x1, self._lerp_x0, out=self._lerp_y)
+        np.multiply(self._lerp_y, self._frac_y, out=self._lerp_y)
+        np.add(self._lerp_y, self._lerp_x0, out=self._lerp_y)
+        np.subtract(self._lerp_y1, self._lerp_y0, out=self._lerp_z)
+        np.multiply(self._lerp_z, self._frac_z, out=self._lerp_z)
+        np.add(self._lerp_z, self._lerp_y0, out=self._lerp_z)
+
+        # a leg is only valid if all 8 corners were reachable and the target was inside the table
+        np.greater_equal(self._reachable, 1.0 - 1e-6, out=self._valid)
+        np.logical_not(self._any_outside, out=self._any_outside)
+        np.logical_and(self._valid, self._any_outside, out=self._valid)
+        self.last_valid = self._valid
+
+        np.multiply(self._angles, self.output_mult, out=out.reshape(4, 3))
+        return out
+
+    def lookup_batch(self, positions: PosBatch) -> tuple[CfgBatch, ValidMask]:
+        """
+        Interpolated IK for many targets at once, same results as lookup() but vectorized (and allocating).
+
+        :param positions: numpy array of shape (N, 12)
+        :return: tuple of joint configs of shape (N, 12) and validity mask of shape (N, 4)
+        """
+        grid = (np.asarray(positions, dtype=np.float64).reshape(-1, 4, 3) - self.lower) * self.inv_spacing
+        clipped = np.clip(grid, 0.0, self.max_grid)
+        floor = np.minimum(np.floor(clipped), self.max_cell)
+        frac = clipped - floor
+
+        base = floor.astype(np.intp) @ self.strides
+        corners = self.flat_table[base[..., None] + self.corner_offsets].reshape(base.shape + (2, 2, 2, 4))
+        fx, fy, fz = frac[..., 0, None, None, None], frac[..., 1, None, None], frac[..., 2, None]
+        lerp_x = corners[..., 0, :, :, :] + fx * (corners[..., 1, :, :, :] - corners[..., 0, :, :, :])
+        lerp_y = lerp_x[..., 0, :, :] + fy * (lerp_x[..., 1, :, :] - lerp_x[..., 0, :, :])
+        lerp_z = lerp_y[..., 0, :] + fz * (lerp_y[..., 1, :] - lerp_y[..., 0, :])
+
+        valid = (lerp_z[..., 3] >= 1.0 - 1e-6) & np.all(grid == clipped, axis=-1)
+        cfgs = (lerp_z[..., :3] * self.output_mult).reshape(-1, 12)
+        return cfgs, valid
+
+    def error_report(self, ik: IK = None, samples=20000, seed=0) -> dict[str, float]:
+        """
+        Compares the table against the analytic solver (IK.solve_batch, which matches IK.solve) on random reachable
+        targets inside the table, in joint space and in foot position space (through FK).
+
+        :param ik: IK solver the table was built from (default IK())
+        :param samples: number of random targets to draw
+        :param seed: random seed
+        :return: dictionary of error statistics (radians for angles, meters for positions)
+        """
+        ik = IK() if ik is None else ik
+        fk = FK.from_ik(ik)
+        rng = np.random.default_rng(seed)
+        targets = rng.uniform(np.tile(self.lower, 4), np.tile(self.upper, 4), size=(samples, 12))
+
+        exact_cfgs, exact_valid = ik.solve_batch(targets)
+        table_cfgs, table_valid = self.lookup_batch(targets)
+        both_valid = exact_valid & table_valid
+
+        leg_angle_error = np.abs(table_cfgs - exact_cfgs).reshape(-1, 4, 3).max(axis=-1)[both_valid]
+        leg_position_error = np.linalg.norm(
+            (fk.solve_batch(table_cfgs) - targets).reshape(-1, 4, 3), axis=-1)[both_valid]
+        return {
+            'legs_checked': int(both_valid.sum()),
+            'coverage': float(both_valid.sum() / max(exact_valid.sum(), 1)),
+            'max_angle_error': float(leg_angle_error.max()),
+            'mean_angle_error': float(leg_angle_error.mean()),
+            'p99_angle_error': float(np.percentile(leg_angle_error, 99)),
+            'max_position_error': float(leg_position_error.max()),
+            'mean_position_error': float(leg_position_error.mean()),
+            'p99_position_error': float(np.percentile(leg_position_error, 99)),
+        }
+
+
 if __name__ == "__main__":
+    import time
+
     ik = IK()
     print(ik.get_idle_cfg())
+
+    # quick timing of the batched solver on a cloud of targets around the idle stance
+    rng = np.random.default_rng(0)
+    targets = np.tile([0.0, 0.0, -0.13], 4) + rng.uniform(-0.04, 0.04, size=(100000, 12))
+    start = time.perf_counter()
+    cfgs, valid = ik.solve_batch(targets)
+    print(f"solve_batch: {len(targets)} targets in {1000 * (time.perf_counter() - start):.1f} ms, "
+          f"{valid.all(axis=1).mean() * 100:.1f}% fully reachable")
+
+    # lookup table build time, accuracy and single lookup speed
+    start = time.perf_counter()
+    table = IKTable.build(ik)
+    print(f"IKTable.build: {table.table.shape} grid in {time.perf_counter() - start:.2f} s")
+    print("IKTable error report:", table.error_report(ik))
+    out = np.empty(12)
+    start = time.perf_counter()
+    for target in targets[:10000]:
+        table.lookup(target, out=out)
+    print(f"IKTable.lookup: {10000 / (time.perf_counter() - start):.0f} lookups/s")
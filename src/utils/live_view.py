@@ -0,0 +1,134 @@
+'''
+Live view of a headless training run.
+
+The training env publishes the robot's state (base pose and velocity, joint angles, commanded velocity and turn)
+into a small named shared memory block every step, and `visualize.py --attach` mirrors that state into its own
+PyBullet GUI. The training process never waits on the viewer: publishing is a few microsecond array write, and
+the viewer can come and go at any time.
+
+(PyBullet's own SHARED_MEMORY_SERVER mode would let the viewer connect to the training simulation directly, but every
+command from the training process then goes through shared memory too, which took servobot from ~4000 to ~100
+physics steps per second.)
+
+Layout of the block: a 256 byte UTF-8 URDF path, then float64s
+[sequence, num_joints, base_pos(3), base_orn(4), base_vel(3), base_ang_vel(3), target_vel(3), target_turn, joints(n)].
+The sequence number is odd while a write is in progress, so readers can retry instead of seeing half an update.
+'''
+
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+DEFAULT_LIVE_VIEW_NAME = 'robot_live_view'
+
+_PATH_BYTES = 256
+_HEADER = 2
+_STATE = 3 + 4 + 3 + 3 + 3 + 1
+
+
+def _attach(name):
+    ''' Opens an existing block without this process deleting it on exit (the publisher owns it). '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+class StatePublisher:
+    '''
+    Training side: writes the robot state into the shared memory block.
+    '''
+
+    def __init__(self, name, urdf_file, num_joints):
+        '''
+        :param name: shared memory name the viewer attaches to
+        :param urdf_file: the robot's URDF (so the viewer knows what to load)
+        :param num_joints: number of joint angles published every step
+        '''
+        size = _PATH_BYTES + 8 * (_HEADER + _STATE + num_joints)
+        try:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left over from a run that crashed, take it over
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        path = urdf_file.encode('utf-8')[:_PATH_BYTES]
+        self.memory.buf[:_PATH_BYTES] = path.ljust(_PATH_BYTES, b'\0')
+        self.values = np.ndarray((_HEADER + _STATE + num_joints,), dtype=np.float64, buffer=self.memory.buf, offset=_PATH_BYTES)
+        self.values[:] = 0.0
+        self.values[1] = num_joints
+        self.name = name
+
+    def publish(self, base_pos, base_orn, base_vel, base_ang_vel, target_vel, target_turn, joint_positions):
+        ''' Writes one snapshot of the robot state. '''
+        values = self.values
+        values[0] += 1  # odd: write in progress
+        values[2:5] = base_pos
+        values[5:9] = base_orn
+        values[9:12] = base_vel
+        values[12:15] = base_ang_vel
+        values[15:18] = target_vel
+        values[18] = target_turn
+        values[19:] = joint_positions
+        values[0] += 1  # even: done
+
+    def close(self):
+        ''' Removes the block (attached viewers keep their mapping until they let go). '''
+        del self.values
+        self.memory.close()
+        self.memory.unlink()
+
+
+class StateReader:
+    '''
+    Viewer side: reads consistent snapshots from a publisher's block.
+    '''
+
+    def __init__(self, name):
+        self.memory = _attach(name)
+        self.urdf_file = bytes(self.memory.buf[:_PATH_BYTES]).rstrip(b'\0').decode('utf-8')
+        num_joints = int(np.ndarray((_HEADER,), dtype=np.float64, buffer=self.memory.buf, offset=_PATH_BYTES)[1])
+        self.values = np.ndarray((_HEADER + _STATE + num_joints,), dtype=np.float64, buffer=self.memory.buf, offset=_PATH_BYTES)
+        self.num_joints = num_joints
+        self.snapshot = np.empty_like(self.values)
+
+    @property
+    def sequence(self):
+        return int(self.values[0])
+
+    def read(self, retries=100):
+        '''
+        Returns the latest state as a dict (None if nothing's been published yet or it's changing too fast to read).
+        '''
+        for _ in range(retries):
+            before = self.values[0]
+            if before % 2 == 1:
+                time.sleep(0)
+                continue
+            self.snapshot[:] = self.values
+            if self.values[0] == before:
+                break
+        else:
+            return None
+        if self.snapshot[0] == 0:
+            return None
+        s = self.snapshot
+        return {
+            'sequence': int(s[0]),
+            'base_position': s[2:5].copy(),
+            'base_orientation': s[5:9].copy(),
+            'base_velocity': s[9:12].copy(),
+            'base_angular_velocity': s[12:15].copy(),
+            'target_velocity': s[15:18].copy(),
+            'target_turn': float(s[18]),
+            'joint_positions': s[19:].copy(),
+        }
+
+    def close(self):
+        del self.values
+        self.memory.close()
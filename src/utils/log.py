@@ -0,0 +1,133 @@
+'''
+Logging for src/envs and src/utils.
+
+Everything logs through the standard logging module under the 'src' logger (get_logger(__name__)), printed to stdout
+as the bare message like the prints it replaces. The level comes from the ROBOT_LOG_LEVEL environment variable
+(default INFO), e.g. ROBOT_LOG_LEVEL=DEBUG to see the parameter table every env loads, or WARNING to keep sweep
+workers quiet.
+
+Things that can happen every step (a jump, a curriculum update) go through an EventLog instead, which rate limits
+them per event: the first occurrence is logged straight away, later ones are only counted, and the count is logged
+once interval seconds have passed, at the next event of any kind or flush_due() (BaseEnv calls it on every reset),
+or on flush(). So a burst that stops still gets its count reported during a long run:
+
+    self.log = EventLog(get_logger(__name__))
+    self.log.event('jump', "🚫 Jump Detected!")      # first time: logged
+    ...                                               # next 10 s: counted
+    self.log.event('jump', "🚫 Jump Detected!")      # after 10 s: "🚫 Jump Detected! (x4127 in the last 10.0s)"
+'''
+
+import os
+import sys
+import time
+import logging
+
+
+ROOT_LOGGER = 'src'
+LEVEL_VARIABLE = 'ROBOT_LOG_LEVEL'
+
+
+def get_logger(name):
+    ''' Logger for a module (pass __name__), set up with the stdout handler on first use '''
+    root = logging.getLogger(ROOT_LOGGER)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        root.addHandler(handler)
+        root.setLevel(os.environ.get(LEVEL_VARIABLE, 'INFO').upper())
+        root.propagate = False
+    return logging.getLogger(name if name.startswith(ROOT_LOGGER) else f"{ROOT_LOGGER}.{name}")
+
+
+class EventLog:
+    '''
+    Rate limited logging of repeated events, with a count of every event.
+    '''
+
+    def __init__(self, logger, interval=10.0):
+        '''
+        :param logger: logger to write to
+        :param interval: seconds between log lines for the same event
+        '''
+        self.logger = logger
+        self.interval = interval
+        self.counts = {}       # event -> total occurrences
+        self.pending = {}      # event -> [occurrences not logged yet, last message, level]
+        self.last_logged = {}  # event -> time.monotonic() of its last log line
+        self.next_due = float('inf')  # time.monotonic() when the earliest pending count can be logged
+
+    def event(self, key, message, level=logging.INFO):
+        '''
+        Counts an event, logging it if it hasn't been logged for interval seconds.
+
+        :param key: what kind of event it is (rate limiting and counting are per key)
+        :param message: the log line (pass a finished string, it's only formatted when it's logged)
+        :param level: logging level
+        '''
+        self.counts[key] = self.counts.get(key, 0) + 1
+        now = time.monotonic()
+        if now >= self.next_due:
+            self.flush_due(now)
+        last = self.last_logged.get(key)
+        if last is not None and now - last < self.interval:
+            pending = self.pending.get(key)
+            if pending is None:
+                self.pending[key] = [1, message, level]
+                self.next_due = min(self.next_due, last + self.interval)
+            else:
+                pending[0] += 1
+                pending[1] = message
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        suppressed = self.pending.pop(key, [0])[0]
+        self._log(level, message, suppressed + 1, now - last if last is not None else None)
+        self.last_logged[key] = now
+
+    def flush_due(self, now=None):
+        ''' Logs the counts of events that haven't been logged for interval seconds '''
+        now = time.monotonic() if now is None else now
+        if now < self.next_due:
+            return
+        self.next_due = float('inf')
+        for key in list(self.pending):
+            due = self.last_logged[key] + self.interval
+            if now >= due:
+                suppressed, message, level = self.pending.pop(key)
+                self._log(level, message, suppressed, now - self.last_logged[key])
+                self.last_logged[key] = now
+            else:
+                self.next_due = min(self.next_due, due)
+
+    def flush(self):
+        ''' Logs the counts of events that came up since they were last logged '''
+        now = time.monotonic()
+        for key, (suppressed, message, level) in self.pending.items():
+            self._log(level, message, suppressed, now - self.last_logged[key])
+            self.last_logged[key] = now
+        self.pending.clear()
+        self.next_due = float('inf')
+
+    def _log(self, level, message, count, elapsed):
+        if count > 1:
+            message = f"{message} (x{count} in the last {elapsed:.1f}s)"
+        self.logger.log(level, message)
+
+
+if __name__ == "__main__":
+    # Cost per call of a rate limited event vs printing it (what BaseEnv.step used to do on every jump)
+    import contextlib
+
+    log = EventLog(get_logger('benchmark'))
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        log.event('jump', "🚫 Jump Detected! Base above 1.3 m. 🚫")
+    event_time = time.perf_counter() - start
+    # line buffered, like stdout on a terminal (every line is a write)
+    with open(os.devnull, 'w', buffering=1) as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(n):
+            print("🚫 Jump Detected! Base above 1.3 m. 🚫")
+        print_time = time.perf_counter() - start
+    print(f"EventLog.event: {1e9 * event_time / n:.0f} ns per call, print: {1e9 * print_time / n:.0f} ns per call")
@@ -0,0 +1,103 @@
+'''
+Observation layouts: which named components BaseEnv puts in its observation, in which order.
+
+A robot's layout is the 'observation' list in its config.py entry (DEFAULT_OBSERVATION if it doesn't have one), or
+the observation argument of BaseEnv. The foot_obs/contact_obs/height_scan/camera_obs options add their component
+to the end if the layout doesn't have it already, so leaving out e.g. 'base_position' is all it takes to try a
+smaller observation (and so a smaller, faster policy):
+
+    'observation': ['joint_positions', 'joint_velocities', 'projected_gravity', 'base_angular_velocity',
+                    'target_velocity', 'target_turn'],
+
+At init the env compiles its layout into an ObservationPlan: every component's slice of one preallocated float32
+buffer, which _get_obs fills in place. The plan's segments (name, size) and offsets (name -> slice) say what each
+observation value is (checkpoint metadata and weight surgery use them).
+'''
+
+import numpy as np
+
+
+# Component -> what it is (its size depends on the robot)
+OBSERVATION_COMPONENTS = {
+    'joint_positions': 'joint angles (1 per joint)',
+    'joint_velocities': 'joint velocities (1 per joint)',
+    'joint_cos': 'cosine of the joint angles (1 per joint)',
+    'joint_sin': 'sine of the joint angles (1 per joint)',
+    'base_position': 'world x, y, z of the base (x and y grow without bound as the robot walks)',
+    'base_height': 'world z of the base only',
+    'base_orientation': 'base orientation quaternion (4)',
+    'projected_gravity': 'gravity direction in the base frame (3), the orientation without the yaw',
+    'base_linear_velocity': 'world linear velocity of the base (3)',
+    'base_angular_velocity': 'world angular velocity of the base (3)',
+    'target_velocity': 'commanded velocity (3)',
+    'target_turn': 'commanded turn (1)',
+    'foot_positions': 'foot positions in the body frame (3 per foot), also turned on by foot_obs',
+    'foot_contacts': 'foot contact flags and normal forces (2 per foot), also turned on by contact_obs',
+    'height_scan': 'ground heights around the robot (1 per ray), also turned on by height_scan',
+    'camera': 'onboard camera image, flattened (1 per pixel), also turned on by camera_obs',
+}
+
+# The layout every robot had before layouts were configurable (existing checkpoints expect it)
+DEFAULT_OBSERVATION = ('joint_positions', 'joint_velocities', 'joint_cos', 'joint_sin', 'base_position',
+                       'base_orientation', 'base_linear_velocity', 'base_angular_velocity', 'target_velocity',
+                       'target_turn')
+
+# Components of the optional sensors, in the order their options add them
+OPTIONAL_COMPONENTS = ('foot_positions', 'foot_contacts', 'height_scan', 'camera')
+
+
+def resolve_components(layout, foot_obs=False, contact_obs=False, height_scan=False, camera_obs=False):
+    '''
+    The full list of components of an observation.
+
+    :param layout: list of component names (None for DEFAULT_OBSERVATION)
+    :param foot_obs, contact_obs, height_scan, camera_obs: BaseEnv options, each adds its component if missing
+    :raises ValueError: for unknown or repeated components
+    '''
+    components = list(DEFAULT_OBSERVATION if layout is None else layout)
+    unknown = [name for name in components if name not in OBSERVATION_COMPONENTS]
+    if unknown:
+        raise ValueError(f"Unknown observation components {unknown}, expected some of {list(OBSERVATION_COMPONENTS)}")
+    if len(set(components)) != len(components):
+        raise ValueError(f"Observation components appear more than once in {components}")
+    for name, enabled in zip(OPTIONAL_COMPONENTS, (foot_obs, contact_obs, height_scan, camera_obs)):
+        if enabled and name not in components:
+            components.append(name)
+    return components
+
+
+class ObservationPlan:
+    '''
+    Where every component goes in the observation buffer.
+    '''
+
+    def __init__(self, components, sizes):
+        '''
+        :param components: component names, in observation order
+        :param sizes: component name -> number of values
+        '''
+        self.segments = [(name, sizes[name]) for name in components]
+        self.offsets = {}
+        start = 0
+        for name, size in self.segments:
+            self.offsets[name] = slice(start, start + size)
+            start += size
+        self.size = start
+        # (name, slice) pairs _get_obs writes, in order
+        self.plan = list(self.offsets.items())
+        self.buffer = np.zeros(self.size, dtype=np.float32)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def fill(self, values):
+        '''
+        Writes component values into the buffer.
+
+        :param values: component name -> values (anything numpy can assign from)
+        :return: the buffer (reused, copy it to keep it)
+        '''
+        buffer = self.buffer
+        for name, index in self.plan:
+            buffer[index] = values[name]
+        return buffer
@@ -0,0 +1,290 @@
+'''
+Population-based training (run it with pbt.py).
+
+A population of PPO learners trains in parallel, one per worker process (each with its own BaseEnv, PyBullet's
+default client is per process). Training goes in rounds of interval_timesteps. After every round each member is
+scored the same way sweep.py scores trials (mean return on the robot's config.py weights over fixed-seed episodes).
+The bottom exploit_fraction of the population then continues from the model of a random member of the top
+exploit_fraction (exploit), with that member's hyperparameters perturbed (explore). So the hyperparameters and
+reward weights follow a schedule found during training, instead of being fixed for the whole 2M steps.
+
+A PBT file looks like a sweep file (see sweep.py), the space gives the starting distributions and bounds:
+
+    {
+        "robot": "servobot",
+        "population": 8,
+        "total_timesteps": 2000000,
+        "interval_timesteps": 50000,      # training between exploit/explore steps
+        "exploit_fraction": 0.25,         # bottom quarter copies the top quarter
+        "perturb_factors": [0.8, 1.25],   # explore: multiply by one of these...
+        "resample_probability": 0.25,     # ...or draw a new value from the space
+        "eval_episodes": 5,
+        "seed": 0,
+        "env": {},
+        "space": {
+            "learning_rate": ["loguniform", 1e-5, 1e-3],   # lowercase: PPO settings that can change mid-training
+            "ent_coef": ["loguniform", 0.001, 0.03],
+            "FORWARD_VEL_WEIGHT": ["uniform", 5, 20]       # UPPERCASE: reward weights (reward.REWARD_WEIGHTS)
+        }
+    }
+
+Models are exchanged through files: every member saves its model at the end of a round and the next round loads
+whichever model it continues from. Rounds and scores go into an SQLite database in the output folder, so rerunning
+resumes after the last finished member.
+'''
+
+import os
+import json
+import sqlite3
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .sweep import SWEEP_PPO_DEFAULTS, sample_params, apply_env_params, evaluate_policy
+from .reward import check_reward_weights
+from .checkpoint_metadata import write_metadata, metadata_path
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+PBT_DEFAULTS = {
+    'robot': 'simple_quadruped',
+    'population': 8,
+    'total_timesteps': 2000000,
+    'interval_timesteps': 50000,
+    'exploit_fraction': 0.25,
+    'perturb_factors': [0.8, 1.25],
+    'resample_probability': 0.25,
+    'eval_episodes': 5,
+    'seed': 0,
+    'env': {},
+    'space': {},
+}
+
+# PPO settings that can be changed on a model in the middle of training (n_steps, batch_size... can't)
+PBT_PPO_PARAMS = ('learning_rate', 'ent_coef')
+
+
+def load_pbt(path):
+    ''' Reads a PBT file and fills in the defaults. '''
+    with open(path) as f:
+        spec = json.load(f)
+    unknown = set(spec) - set(PBT_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown PBT settings in {path}: {sorted(unknown)}")
+    spec = {**PBT_DEFAULTS, **spec}
+    fixed = [name for name in spec['space'] if not name.isupper() and name not in PBT_PPO_PARAMS]
+    if fixed:
+        raise ValueError(f"{fixed} can't change during training, PBT can only explore {list(PBT_PPO_PARAMS)} "
+                         f"and reward weights")
+    check_reward_weights(spec['space'], path)
+    return spec
+
+
+def perturb_params(params, space, rng, perturb_factors, resample_probability):
+    '''
+    The explore step: each parameter is either drawn again from the space or scaled by a random perturb factor
+    (moved to a neighbouring option for 'choice'), staying within the space's bounds.
+    '''
+    perturbed = {}
+    for name, value in params.items():
+        distribution = space[name]
+        if rng.random() < resample_probability:
+            perturbed[name] = sample_params({name: distribution}, rng)[name]
+        elif distribution[0] == 'choice':
+            options = distribution[1:]
+            index = options.index(value) + rng.choice([-1, 1])
+            perturbed[name] = options[int(np.clip(index, 0, len(options) - 1))]
+        else:
+            value = value * float(rng.choice(perturb_factors))
+            if distribution[0] in ('uniform', 'loguniform'):
+                value = float(np.clip(value, distribution[1], distribution[2]))
+            perturbed[name] = value
+    return perturbed
+
+
+def exploit_and_explore(scores, params, spec, rng):
+    '''
+    Decides what every member continues from in the next round.
+
+    :param scores: member -> score this round
+    :param params: member -> params this round
+    :return: member -> (parent, params): the member whose model it continues from and its params for the next round
+    '''
+    ranked = sorted(scores, key=lambda member: scores[member], reverse=True)
+    cutoff = int(len(ranked) * spec['exploit_fraction'])
+    if len(ranked) > 1:
+        cutoff = max(cutoff, 1)
+    top, bottom = ranked[:cutoff], ranked[len(ranked) - cutoff:] if cutoff else []
+    plan = {member: (member, params[member]) for member in ranked}
+    for member in bottom:
+        parent = top[rng.integers(len(top))]
+        plan[member] = (parent, perturb_params(params[parent], spec['space'], rng, spec['perturb_factors'],
+                                               spec['resample_probability']))
+    return plan
+
+
+class PopulationDB:
+    '''
+    SQLite record of every member in every round: its params, which model it started from and its score.
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS members (round INTEGER, member INTEGER, parent INTEGER, '
+                                'params TEXT, start_model TEXT, model_path TEXT, score REAL, '
+                                'PRIMARY KEY (round, member))')
+        self.connection.commit()
+
+    def add_round(self, round, members):
+        ''' :param members: member -> (parent, params, start_model, model_path) '''
+        self.connection.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, NULL)',
+                                    [(round, member, parent, json.dumps(params), start_model, model_path)
+                                     for member, (parent, params, start_model, model_path) in members.items()])
+        self.connection.commit()
+
+    def set_score(self, round, member, score):
+        self.connection.execute('UPDATE members SET score = ? WHERE round = ? AND member = ?', (score, round, member))
+        self.connection.commit()
+
+    def round(self, round):
+        ''' member -> dict with parent, params, start_model, model_path and score (None until trained) '''
+        rows = self.connection.execute('SELECT member, parent, params, start_model, model_path, score FROM members '
+                                       'WHERE round = ?', (round,))
+        return {member: {'parent': parent, 'params': json.loads(params), 'start_model': start_model,
+                         'model_path': model_path, 'score': score}
+                for member, parent, params, start_model, model_path, score in rows}
+
+    def last_round(self):
+        ''' Latest round with members (None for a new run) '''
+        return self.connection.execute('SELECT MAX(round) FROM members').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def run_member_segment(job):
+    '''
+    Trains one member for a round and scores it (runs in a worker process).
+
+    :param job: dict with member, round, robot, env, params, seed, to_timesteps, start_model (None for a new model),
+        model_path and eval_episodes
+    :return: the evaluation score
+    '''
+    import torch
+    from stable_baselines3 import PPO
+    from ..envs.env import BaseEnv, get_min_z
+    from .config import ROBOTS
+
+    torch.set_num_threads(1)  # one core per member, the pool provides the parallelism
+    urdf_file = ROBOTS[job['robot']]['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False,
+                  **job['env'])
+    try:
+        nominal, ppo_params = apply_env_params(env, job['params'])
+        if job['start_model'] is None:
+            model = PPO("MlpPolicy", env, verbose=0, seed=job['seed'], device='cpu', **{**SWEEP_PPO_DEFAULTS, **ppo_params})
+        else:
+            # the start model may be another member's, with other hyperparameters, so set this member's
+            model = PPO.load(job['start_model'], env=env, device='cpu')
+            for name, value in ppo_params.items():
+                setattr(model, name, value)
+            model._setup_lr_schedule()
+        model.learn(total_timesteps=job['to_timesteps'] - model.num_timesteps, reset_num_timesteps=False)
+        model.save(job['model_path'])
+
+        for name, value in nominal.items():
+            setattr(env, name, value)
+        score = evaluate_policy(model, env, job['eval_episodes'])
+        write_metadata(job['model_path'], env, model.num_timesteps, score, params=job['params'])
+        return score
+    finally:
+        env.close()
+
+
+def run_pbt(spec, out_dir, workers=None, run_segment=run_member_segment):
+    '''
+    Runs (or resumes) population-based training to total_timesteps.
+
+    :param spec: PBT settings (see load_pbt)
+    :param out_dir: where the database and the member models go
+    :param workers: number of worker processes (default: one per core, at most one per member)
+    :param run_segment: function of a job dict returning a score (run_member_segment, swapped out in tests)
+    :return: list of (member, score, params, model_path) of the last round, best first
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    db = PopulationDB(os.path.join(out_dir, 'pbt.db'))
+    rounds = -(-spec['total_timesteps'] // spec['interval_timesteps'])
+    workers = min(workers or os.cpu_count(), spec['population'])
+    logger.info(f"PBT: {spec['population']} members, {rounds} rounds of {spec['interval_timesteps']} timesteps, "
+                f"{workers} workers, results in {out_dir}")
+
+    def model_path(round, member):
+        return os.path.join(out_dir, f"member_{member:02d}_round_{round:03d}.zip")
+
+    try:
+        current = db.last_round()
+        if current is None:
+            current = 0
+            db.add_round(0, {member: (None, sample_params(spec['space'], np.random.default_rng([spec['seed'], member])),
+                                      None, model_path(0, member))
+                             for member in range(spec['population'])})
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                members = db.round(current)
+                to_timesteps = min((current + 1) * spec['interval_timesteps'], spec['total_timesteps'])
+                jobs = [{'member': member, 'round': current, 'robot': spec['robot'], 'env': spec['env'],
+                         'params': row['params'], 'seed': spec['seed'] + member, 'to_timesteps': to_timesteps,
+                         'start_model': row['start_model'], 'model_path': row['model_path'],
+                         'eval_episodes': spec['eval_episodes']}
+                        for member, row in members.items() if row['score'] is None]
+                for job, score in zip(jobs, pool.map(run_segment, jobs)):
+                    db.set_score(current, job['member'], score)
+                    members[job['member']]['score'] = score
+
+                scores = {member: row['score'] for member, row in members.items()}
+                best = max(scores, key=scores.get)
+                logger.info(f"Round {current} ({to_timesteps} timesteps): best member {best} score {scores[best]:.2f}, "
+                            f"median {np.median(list(scores.values())):.2f}  {members[best]['params']}")
+                # everyone's trained, so the previous round's models aren't needed any more
+                for row in (db.round(current - 1).values() if current > 0 else []):
+                    for path in (row['model_path'], metadata_path(row['model_path'])):
+                        if os.path.exists(path):
+                            os.remove(path)
+                if current + 1 >= rounds:
+                    break
+
+                rng = np.random.default_rng([spec['seed'], 1_000_000 + current])
+                plan = exploit_and_explore(scores, {member: row['params'] for member, row in members.items()}, spec, rng)
+                for member, (parent, _) in plan.items():
+                    if parent != member:
+                        logger.info(f"  member {member} ({scores[member]:.2f}) continues from member {parent} ({scores[parent]:.2f})")
+                db.add_round(current + 1, {member: (parent, params, members[parent]['model_path'],
+                                                    model_path(current + 1, member))
+                                           for member, (parent, params) in plan.items()})
+                current += 1
+
+        final = db.round(current)
+        lineage = pbt_lineage(db, current, max(final, key=lambda member: final[member]['score']))
+    finally:
+        db.close()
+
+    leaderboard = sorted(((member, row['score'], row['params'], row['model_path']) for member, row in final.items()),
+                         key=lambda row: row[1], reverse=True)
+    with open(os.path.join(out_dir, 'best.json'), 'w') as f:
+        member, score, params, path = leaderboard[0]
+        json.dump({'member': member, 'timesteps': spec['total_timesteps'], 'score': score, 'params': params,
+                   'model_path': path, 'lineage': lineage}, f, indent=4)
+    return leaderboard
+
+
+def pbt_lineage(db, round, member):
+    ''' The chain of members a final model went through, round by round: [{round, member, score, params}, ...] '''
+    lineage = []
+    while round >= 0:
+        row = db.round(round)[member]
+        lineage.append({'round': round, 'member': member, 'score': row['score'], 'params': row['params']})
+        member = row['parent'] if row['parent'] is not None else member
+        round -= 1
+    return lineage[::-1]
@@ -0,0 +1,130 @@
+'''
+Per-episode domain randomization of the robot's dynamics for BaseEnv.
+
+Every reset samples ground friction, link masses, per-joint motor strength, a small gravity tilt and a control
+latency from the distributions declared in config.py (each robot's 'domain_randomization' entry, falling back to
+RANDOMIZATION_DEFAULTS). Link indices and nominal values are read once at init, so applying an episode's sample is
+one changeDynamics call per ground body and robot link plus a setGravity call. Motor strength and latency live on
+the randomizer and are used by BaseEnv.step().
+
+A distribution is a tuple: ('uniform', low, high), ('normal', mean, std), ('loguniform', low, high) or
+('constant', value). Leaving a quantity out of the config keeps it at its nominal value.
+'''
+
+import numpy as np
+import pybullet as p
+
+
+RANDOMIZATION_DEFAULTS = {
+    'friction': ('uniform', 0.5, 1.1),         # ground lateral friction (nominal is 0.8)
+    'mass_scale': ('uniform', 0.85, 1.15),     # multiplier on each link's nominal mass
+    'motor_strength': ('uniform', 0.8, 1.2),   # multiplier on each joint's force limit
+    'gravity_tilt': ('uniform', 0.0, 0.05),    # angle (radians) of gravity from vertical, in a random direction
+    'latency': ('uniform', 0.0, 0.02),         # seconds before a new action reaches the motors
+}
+
+GRAVITY = 9.81
+
+
+def sample_distribution(distribution, rng, size=None):
+    ''' Draws from a config distribution tuple (see the module docstring) with a numpy Generator. '''
+    kind, *args = distribution
+    if kind == 'uniform':
+        return rng.uniform(args[0], args[1], size=size)
+    if kind == 'normal':
+        return rng.normal(args[0], args[1], size=size)
+    if kind == 'loguniform':
+        return np.exp(rng.uniform(np.log(args[0]), np.log(args[1]), size=size))
+    if kind == 'constant':
+        return np.full(size, float(args[0])) if size is not None else float(args[0])
+    raise ValueError(f"Unknown distribution '{kind}', expected 'uniform', 'normal', 'loguniform' or 'constant'")
+
+
+class DomainRandomizer:
+    '''
+    Samples and applies per-episode dynamics for one robot in the current PyBullet simulation.
+    '''
+
+    def __init__(self, robot_id, ground_ids, joint_indices, time_step, force_limit, distributions=None):
+        '''
+        Caches the link indices and nominal dynamics that every randomization is applied relative to.
+
+        :param robot_id: PyBullet body id of the robot
+        :param ground_ids: body ids whose friction gets randomized (plane and terrain)
+        :param joint_indices: the actuated joints, in action order
+        :param time_step: physics time step, to turn latency into a number of physics steps
+        :param force_limit: nominal motor force limit
+        :param distributions: dict of distribution tuples (see RANDOMIZATION_DEFAULTS), None for the defaults
+        '''
+        distributions = RANDOMIZATION_DEFAULTS if distributions is None else distributions
+        unknown = set(distributions) - set(RANDOMIZATION_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown domain randomization parameters: {sorted(unknown)}")
+        self.distributions = dict(distributions)
+        self.robot_id = robot_id
+        self.ground_ids = list(ground_ids)
+        self.time_step = time_step
+        self.force_limit = force_limit
+
+        # Nominal values, read once. Massless links (fixed frames) are left alone: setting mass 0 makes them static.
+        link_indices = [-1] + list(range(p.getNumJoints(robot_id)))
+        masses = np.array([p.getDynamicsInfo(robot_id, link)[0] for link in link_indices])
+        self.link_indices = [link for link, mass in zip(link_indices, masses) if mass > 0]
+        self.nominal_masses = masses[masses > 0]
+        self.nominal_friction = [p.getDynamicsInfo(ground_id, -1)[1] for ground_id in self.ground_ids]
+        self.num_joints = len(joint_indices)
+
+        # What BaseEnv.step() reads
+        self.joint_forces = np.full(self.num_joints, float(force_limit))
+        self.latency_steps = 0
+        self.current = None
+
+    def sample(self, rng):
+        '''
+        Draws one episode's dynamics (quantities not in self.distributions stay nominal).
+
+        :param rng: numpy Generator (BaseEnv passes its np_random, so randomization follows the env seed)
+        :return: dict with 'friction', 'mass_scale' (per link), 'motor_strength' (per joint), 'gravity' and 'latency_steps'
+        '''
+        dists = self.distributions
+        sample = {
+            'friction': None,
+            'mass_scale': np.ones(len(self.link_indices)),
+            'motor_strength': np.ones(self.num_joints),
+            'gravity': np.array([0.0, 0.0, -GRAVITY]),
+            'latency_steps': 0,
+        }
+        if 'friction' in dists:
+            sample['friction'] = max(float(sample_distribution(dists['friction'], rng)), 0.0)
+        if 'mass_scale' in dists:
+            sample['mass_scale'] = np.maximum(sample_distribution(dists['mass_scale'], rng, len(self.link_indices)), 0.05)
+        if 'motor_strength' in dists:
+            sample['motor_strength'] = np.maximum(sample_distribution(dists['motor_strength'], rng, self.num_joints), 0.0)
+        if 'gravity_tilt' in dists:
+            tilt = float(sample_distribution(dists['gravity_tilt'], rng))
+            heading = rng.uniform(0, 2 * np.pi)
+            sample['gravity'] = GRAVITY * np.array([np.sin(tilt) * np.cos(heading), np.sin(tilt) * np.sin(heading), -np.cos(tilt)])
+        if 'latency' in dists:
+            sample['latency_steps'] = int(round(max(float(sample_distribution(dists['latency'], rng)), 0.0) / self.time_step))
+        return sample
+
+    def apply(self, sample):
+        ''' Pushes a sample from sample() into the simulation (and into joint_forces/latency_steps for step()). '''
+        if sample['friction'] is not None:
+            for ground_id in self.ground_ids:
+                p.changeDynamics(ground_id, -1, lateralFriction=sample['friction'])
+        else:
+            for ground_id, friction in zip(self.ground_ids, self.nominal_friction):
+                p.changeDynamics(ground_id, -1, lateralFriction=friction)
+        for link, mass in zip(self.link_indices, self.nominal_masses * sample['mass_scale']):
+            p.changeDynamics(self.robot_id, link, mass=float(mass))
+        p.setGravity(*sample['gravity'])
+        self.joint_forces = self.force_limit * sample['motor_strength']
+        self.latency_steps = sample['latency_steps']
+        self.current = sample
+
+    def randomize(self, rng):
+        ''' sample() and apply() in one go. Returns the sample. '''
+        sample = self.sample(rng)
+        self.apply(sample)
+        return sample
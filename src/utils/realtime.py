@@ -0,0 +1,54 @@
+'''
+Real-time pacing for the GUI.
+
+Sleeping a fixed time_step after every physics step ignores the time spent computing that step (physics, policy,
+debug drawing), so the simulation falls behind real time on heavier robots. RealTimePacer instead sleeps until the
+wall-clock deadline of each step, so compute time comes out of the sleep. If we fall too far behind (a slow frame,
+the window being dragged, ...) the deadlines are moved forward rather than racing to catch up.
+'''
+
+import time
+
+
+class RealTimePacer:
+    '''
+    Keeps simulated time in step with wall-clock time and measures the real time factor.
+    '''
+
+    def __init__(self, time_step, speed=1.0, max_lag=0.1, window=0.5):
+        '''
+        :param time_step: simulated seconds per tick()
+        :param speed: target real time factor (2.0 = twice as fast as real time)
+        :param max_lag: seconds we may fall behind before giving up on catching up
+        :param window: seconds of wall-clock time the real time factor is averaged over
+        '''
+        self.time_step = time_step
+        self.speed = speed
+        self.max_lag = max_lag
+        self.window = window
+        self.real_time_factor = 1.0
+        self.reset()
+
+    def reset(self):
+        ''' Restarts the clock (call when the simulation jumps, e.g. on env reset). '''
+        now = time.perf_counter()
+        self.start_time = now
+        self.sim_time = 0.0
+        self.window_start = (now, 0.0)
+
+    def tick(self):
+        ''' Call once per physics step: sleeps until that step's wall-clock deadline. '''
+        self.sim_time += self.time_step
+        deadline = self.start_time + self.sim_time / self.speed
+        now = time.perf_counter()
+        if deadline > now:
+            time.sleep(deadline - now)
+            now = time.perf_counter()
+        elif now - deadline > self.max_lag:
+            # too far behind, drop the debt instead of running flat out until we catch up
+            self.start_time += now - deadline - self.max_lag
+
+        window_wall, window_sim = self.window_start
+        if now - window_wall >= self.window:
+            self.real_time_factor = (self.sim_time - window_sim) / (now - window_wall)
+            self.window_start = (now, self.sim_time)
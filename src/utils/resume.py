@@ -0,0 +1,256 @@
+'''
+Resumable training runs (train.py --run-dir).
+
+A run directory holds the run's arguments (run.json) and a snapshot of everything training depends on, refreshed
+every few rollouts:
+
+    run_dir/
+        run.json                     train.py arguments the run was started with
+        latest                       name of the newest complete snapshot
+        snapshot_<timesteps>/
+            model.zip                the PPO model: weights, optimizer state, timestep counter, last observation
+            state.pkl                RNG states, the env's current episode, reward history position, plot data
+
+Snapshots are taken at the start of a rollout (and at the end of training), right after a PPO update, when nothing
+is half-collected. The env is restored without saving any PyBullet state. ResumableEnv keeps the env's RNG and
+command state from just before the current episode's reset, plus the actions taken since. The reset and those
+actions (at most one episode) are then replayed through the deterministic simulation. Together with the torch,
+numpy and python RNG states, a resumed run continues bit for bit where the snapshot was taken, and it doesn't
+collect anything to warm up first.
+'''
+
+import os
+import copy
+import json
+import pickle
+import random
+import shutil
+import numpy as np
+import gymnasium as gym
+from stable_baselines3.common.callbacks import BaseCallback
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+RUN_FILE = 'run.json'
+LATEST_FILE = 'latest'
+
+# Metric series of the live plotting callbacks (plotting_callback.py), kept so resumed plots continue
+PLOT_SERIES = ('timesteps', 'ep_len_mean', 'ep_rew_mean', 'explained_var', 'value_loss', 'policy_loss', 'approx_kl',
+               'fps_data')
+
+
+class ResumableEnv(gym.Wrapper):
+    '''
+    Keeps what's needed to rebuild the current episode of a BaseEnv: its RNG and command state before the episode's
+    reset and the actions taken since.
+    '''
+
+    def __init__(self, env):
+        super().__init__(env)
+        self.episode = None
+
+    def reset(self, **kwargs):
+        base_env = self.env.unwrapped
+        self.episode = {
+            'reset_kwargs': kwargs,
+            'np_random': copy.deepcopy(base_env.np_random.bit_generator.state),
+            'episode_commands': {name: values.copy() for name, values in base_env.episode_commands.items()},
+            'episode_command_index': base_env.episode_command_index,
+            'actions': [],
+        }
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        self.episode['actions'].append(np.array(action, copy=True))
+        return self.env.step(action)
+
+    def replay(self, episode, outer_env):
+        '''
+        Rebuilds a saved episode by resetting from its saved RNG state and replaying its actions.
+
+        :param episode: self.episode from a snapshot
+        :param outer_env: the outermost wrapper (e.g. SB3's Monitor), so every wrapper sees the replayed steps
+        :return: the observation after the last replayed step
+        '''
+        base_env = self.env.unwrapped
+        base_env.np_random.bit_generator.state = episode['np_random']
+        base_env.episode_commands = episode['episode_commands']
+        base_env.episode_command_index = episode['episode_command_index']
+        obs, _ = outer_env.reset(**episode['reset_kwargs'])
+        for action in episode['actions']:
+            obs, _, _, _, _ = outer_env.step(action)
+        return obs
+
+
+def find_wrapper(env, wrapper_class):
+    ''' The first wrapper of wrapper_class in a chain of gymnasium wrappers (None if there isn't one) '''
+    while isinstance(env, gym.Wrapper):
+        if isinstance(env, wrapper_class):
+            return env
+        env = env.env
+    return None
+
+
+def save_run_args(run_dir, args):
+    ''' Starts a run directory with the arguments the run was started with. '''
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, RUN_FILE), 'w') as f:
+        json.dump(args, f, indent=4)
+
+
+def load_run_args(run_dir):
+    ''' The arguments a run directory was started with, None if it's not a run directory (yet) '''
+    path = os.path.join(run_dir, RUN_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def latest_snapshot(run_dir):
+    ''' Folder of the newest complete snapshot in a run directory, None if there isn't one '''
+    path = os.path.join(run_dir, LATEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return os.path.join(run_dir, f.read().strip())
+
+
+def save_snapshot(run_dir, model, plot_callback=None):
+    '''
+    Snapshots a run. The snapshot only becomes the latest once it's completely written, so a run killed halfway
+    through saving resumes from the previous one.
+
+    :param model: the PPO model, training on a ResumableEnv-wrapped BaseEnv
+    :param plot_callback: live plotting callback whose metric history to keep (optional)
+    :return: the snapshot folder
+    '''
+    import torch
+
+    resumable = find_wrapper(model.get_env().envs[0], ResumableEnv)
+    base_env = resumable.unwrapped
+    name = f"snapshot_{model.num_timesteps}"
+    folder = os.path.join(run_dir, name)
+    os.makedirs(folder, exist_ok=True)
+    model.save(os.path.join(folder, 'model.zip'))
+    state = {
+        'num_timesteps': model.num_timesteps,
+        'device': str(model.device),
+        'rng': {
+            'torch': torch.get_rng_state(),
+            'torch_cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy': np.random.get_state(),
+            'python': random.getstate(),
+        },
+        'episode': resumable.episode,
+        # the current episode's rows are only written at the next reset, and the replay adds them again
+        'reward_history': {'filename': base_env.reward_history_filename,
+                           'size': os.path.getsize(base_env.reward_history_filename)}
+                          if base_env.reward_history_filename is not None else None,
+        'plots': {series: list(getattr(plot_callback, series)) for series in PLOT_SERIES} if plot_callback else None,
+    }
+    with open(os.path.join(folder, 'state.pkl'), 'wb') as f:
+        pickle.dump(state, f)
+
+    previous = latest_snapshot(run_dir)
+    with open(os.path.join(run_dir, LATEST_FILE + '.tmp'), 'w') as f:
+        f.write(name)
+    os.replace(os.path.join(run_dir, LATEST_FILE + '.tmp'), os.path.join(run_dir, LATEST_FILE))
+    if previous is not None and os.path.abspath(previous) != os.path.abspath(folder):
+        shutil.rmtree(previous, ignore_errors=True)
+    return folder
+
+
+def _load_state(run_dir):
+    folder = latest_snapshot(run_dir)
+    if folder is None:
+        raise FileNotFoundError(f"No snapshot in {run_dir} to resume from")
+    with open(os.path.join(folder, 'state.pkl'), 'rb') as f:
+        return folder, pickle.load(f)
+
+
+def load_snapshot(run_dir, env):
+    '''
+    Restores the latest snapshot of a run onto a freshly made env.
+
+    :param env: the ResumableEnv-wrapped BaseEnv to train on, made with the run's arguments
+    :return: the PPO model, ready for model.learn(..., reset_num_timesteps=False)
+    '''
+    import torch
+    from stable_baselines3 import PPO
+
+    folder, state = _load_state(run_dir)
+    # force_reset=False keeps the observation the model was about to act on, so training doesn't reset the env
+    model = PPO.load(os.path.join(folder, 'model.zip'), env=env, device=state['device'], force_reset=False)
+
+    # Continue the same reward history file, without what was written after the snapshot
+    base_env = env.unwrapped
+    history = state['reward_history']
+    if (history is not None and base_env.reward_history_filename is not None and os.path.exists(history['filename'])
+            and history['filename'] != base_env.reward_history_filename):
+        os.remove(base_env.reward_history_filename)  # the fresh env's empty one
+        base_env.reward_history_filename = history['filename']
+        with open(history['filename'], 'r+b') as f:
+            f.truncate(history['size'])
+
+    if state['episode'] is not None:
+        outer_env = model.get_env().envs[0]
+        obs = find_wrapper(outer_env, ResumableEnv).replay(state['episode'], outer_env)
+        if not np.array_equal(obs, model._last_obs[0]):
+            logger.warning("⚠️  The replayed episode doesn't end on the snapshot's observation (has the env changed since?), "
+                  "training continues but won't be an exact continuation")
+
+    # RNG states last, nothing above may draw from them
+    rng = state['rng']
+    torch.set_rng_state(rng['torch'])
+    if rng['torch_cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng['torch_cuda'])
+    np.random.set_state(rng['numpy'])
+    random.setstate(rng['python'])
+    logger.info(f"Resumed from {folder} at {model.num_timesteps} timesteps")
+    return model
+
+
+def restore_plot_history(run_dir, plot_callback):
+    ''' Gives a live plotting callback back the metric history it had at the latest snapshot. '''
+    _, state = _load_state(run_dir)
+    if state['plots'] is not None:
+        for series, values in state['plots'].items():
+            getattr(plot_callback, series).extend(values)
+
+
+class SnapshotCallback(BaseCallback):
+    '''
+    Snapshots the run every save_freq timesteps (at the next rollout start) and when training ends.
+    '''
+
+    def __init__(self, run_dir, save_freq=20480, plot_callback=None, verbose=0):
+        super().__init__(verbose)
+        self.run_dir = run_dir
+        self.save_freq = save_freq
+        self.plot_callback = plot_callback
+        self.last_snapshot = None
+
+    def _on_training_start(self):
+        self.last_snapshot = self.model.num_timesteps
+
+    def _on_rollout_start(self):
+        if self.model.num_timesteps - self.last_snapshot >= self.save_freq:
+            self._snapshot()
+
+    def _on_step(self):
+        return True
+
+    def _on_training_end(self):
+        # only after a finished rollout and update (not when a callback stopped training halfway through one)
+        if self.model.num_timesteps != self.last_snapshot and self.model.rollout_buffer.full:
+            self._snapshot()
+
+    def _snapshot(self):
+        folder = save_snapshot(self.run_dir, self.model, self.plot_callback)
+        self.last_snapshot = self.model.num_timesteps
+        if self.verbose:
+            logger.info(f"Saved snapshot {folder}")
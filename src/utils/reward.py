@@ -0,0 +1,115 @@
+'''
+The locomotion reward (BaseEnv.calculate_step_reward_new) as a pure NumPy function over batches of states.
+
+reward_kernel takes (N, ...) arrays of the state the reward depends on, plus the weights, and returns every reward
+term for all N at once. It doesn't touch PyBullet or any env. The only state carried from step to step, the rolling
+average base velocity, is passed in and returned explicitly. BaseEnv calls it with N=1 every step and the offline
+relabeling (relabel.py) calls it on whole batches of recorded steps, so there's only one copy of the reward math.
+'''
+
+import numpy as np
+
+
+# Reward terms in the same order as BaseEnv.reward_history
+REWARD_TERMS = ('lin_vel', 'ang_vel', 'height', 'pose', 'action_rate', 'lin_vel_z', 'rp', 'survival', 'fallen',
+                'body_contact')
+
+# Env parameters the kernel reads from its weights dict (they come from config.py through load_all_params)
+REWARD_WEIGHTS = ('FORWARD_VEL_WEIGHT', 'ANGULAR_VEL_WEIGHT', 'SURVIVAL_WEIGHT', 'FALLEN_PENALTY',
+                  'BODY_CONTACT_PENALTY_WEIGHT')
+
+# State arrays reward_kernel needs, with their per-row shapes (J = number of joints, A = action size)
+REWARD_STATE = {
+    'base_position': (3,),
+    'base_orientation': (4,),         # quaternion, x y z w
+    'base_velocity': (3,),
+    'base_angular_velocity': (3,),
+    'joint_positions': ('J',),
+    'action': ('A',),
+    'previous_action': ('A',),        # zeros on the first step of an episode
+    'target_velocity': (3,),
+    'target_turn': (),
+    'body_contact': (),
+}
+
+FALLEN_HEIGHT = 0.025  # base below this counts as fallen
+
+
+def check_reward_weights(names, source):
+    ''' Raises a ValueError for UPPERCASE names the reward doesn't read (setting them would change nothing). '''
+    unused = [name for name in names if name.isupper() and name not in REWARD_WEIGHTS]
+    if unused:
+        raise ValueError(f"{unused} in {source} aren't read by the reward, UPPERCASE parameters have to be some of "
+                         f"{list(REWARD_WEIGHTS)}")
+
+
+def reward_kernel(state, rolling_avg_speed, weights, home_position, target_z):
+    '''
+    Reward terms for N states at once.
+
+    :param state: dict of the REWARD_STATE arrays, each (N, ...)
+    :param rolling_avg_speed: (N, 3) rolling average base velocity carried over from the previous step (zeros at the
+        start of an episode)
+    :param weights: dict with the REWARD_WEIGHTS values
+    :param home_position: home joint angles, (J,) or (N, J)
+    :param target_z: base height the height term pulls towards, scalar or (N,)
+    :return: (terms, rolling_avg_speed) where terms maps each of REWARD_TERMS and 'total' to an (N,) float64 array,
+        and rolling_avg_speed is the updated (N, 3) average to pass in on the next step
+    '''
+    position = np.asarray(state['base_position'], dtype=np.float64)
+    orientation = np.asarray(state['base_orientation'], dtype=np.float64)
+    velocity = np.asarray(state['base_velocity'], dtype=np.float64)
+    angular_velocity = np.asarray(state['base_angular_velocity'], dtype=np.float64)
+    action = np.asarray(state['action'], dtype=np.float64)
+
+    rolling_avg_speed = 0.9 * np.asarray(rolling_avg_speed, dtype=np.float64) + 0.1 * velocity
+    angular_error = angular_velocity.copy()
+    angular_error[:, 2] -= state['target_turn']  # yaw rate command only
+    is_fallen = position[:, 2] < FALLEN_HEIGHT
+    body_contact = np.asarray(state['body_contact'], dtype=bool)
+
+    terms = {
+        # 1. Linear velocity tracking (of the rolling average). UPDATE 10/16/25: steeper bell shape, previously the
+        # robot could still get <95% of the movement reward without moving at all for most target velocities
+        'lin_vel': weights['FORWARD_VEL_WEIGHT'] * np.exp(-2 * np.sum((rolling_avg_speed - state['target_velocity']) ** 2, axis=1)),
+        # 2. Angular velocity tracking
+        'ang_vel': weights['ANGULAR_VEL_WEIGHT'] * np.exp(-0.01 * np.sum(angular_error ** 2, axis=1)),
+        # 3. Height
+        'height': -20 * (position[:, 2] - target_z) ** 2,
+        # 4. Pose similarity
+        'pose': -0.075 * np.sum((np.asarray(state['joint_positions'], dtype=np.float64) - home_position) ** 2, axis=1),
+        # 5. Action rate
+        'action_rate': -0.015 * np.sum((action - state['previous_action']) ** 2, axis=1),
+        # 6. Vertical velocity
+        'lin_vel_z': -0.2 * velocity[:, 2] ** 2,
+        # 7. Roll and pitch: 1 - z component of the body's up vector
+        'rp': -0.4 * 2 * (orientation[:, 0] ** 2 + orientation[:, 1] ** 2),
+        # 8. Survival
+        'survival': np.where(is_fallen, 0.0, weights['SURVIVAL_WEIGHT']),
+        # 9. Fallen
+        'fallen': np.where(is_fallen, -weights['FALLEN_PENALTY'], 0.0),
+        # 10. Body contact (anything other than a foot touching the ground)
+        'body_contact': np.where(body_contact, -weights['BODY_CONTACT_PENALTY_WEIGHT'], 0.0),
+    }
+    # The fallen term is subtracted from the total (as it always has been in calculate_step_reward_new)
+    terms['total'] = sum(terms[name] for name in REWARD_TERMS if name != 'fallen') - terms['fallen']
+    return terms, rolling_avg_speed
+
+
+if __name__ == "__main__":
+    import time
+
+    # Per-call cost at a few batch sizes (N=1 is what BaseEnv pays every step)
+    rng = np.random.default_rng(0)
+    weights = {name: 1.0 for name in REWARD_WEIGHTS}
+    for n in (1, 64, 4096, 262144):
+        state = {name: rng.normal(size=(n,) + tuple(12 if d in ('J', 'A') else d for d in shape))
+                 for name, shape in REWARD_STATE.items()}
+        state['body_contact'] = state['body_contact'] > 1
+        average = np.zeros((n, 3))
+        calls = max(10, 20000 // n)
+        start = time.perf_counter()
+        for _ in range(calls):
+            terms, average = reward_kernel(state, average, weights, np.zeros(12), 0.15)
+        elapsed = (time.perf_counter() - start) / calls
+        print(f"N={n:6d}: {1e6 * elapsed:9.1f} us per call, {1e9 * elapsed / n:8.1f} ns per state")
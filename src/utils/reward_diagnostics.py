@@ -0,0 +1,173 @@
+'''
+Monte Carlo reward diagnostics (run them with diagnose_reward_scale.py).
+
+Runs many episodes of a policy in a process pool of headless BaseEnvs, one env per worker, a few episodes per task.
+The policy is either uniformly random actions or a checkpoint. Every step's reward terms come from the env's own
+reward_history, so they're exactly what training sees. summarize() turns them into per-term distributions, each
+term's share of the total and the episode return distribution.
+
+Results are cached on disk, keyed by a hash of everything that affects them: the robot's config.py entry, the env
+and reward source code, the checkpoint file, the number of episodes and the seed. Rerunning an unchanged diagnostic
+just loads them.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import ROBOTS
+from .reward import REWARD_TERMS
+from .checkpoint_metadata import check_compatible
+
+
+DIAGNOSTIC_COLUMNS = REWARD_TERMS + ('total',)
+
+# Source files the rewards depend on (a change to any of them invalidates the cache)
+_SOURCE_FILES = [os.path.join(os.path.dirname(__file__), '..', 'envs', 'env.py'),
+                 os.path.join(os.path.dirname(__file__), 'reward.py')]
+
+
+def run_episodes(task):
+    '''
+    Runs episodes in a fresh headless env (in a worker process).
+
+    :param task: dict with robot, policy ('random' or a checkpoint path) and seeds (one episode per seed)
+    :return: (terms, episode_lengths): (steps, len(DIAGNOSTIC_COLUMNS)) float32 array of every step's reward terms
+        and the length of each episode
+    '''
+    import torch
+    from stable_baselines3 import PPO
+    from ..envs.env import BaseEnv, get_min_z
+
+    torch.set_num_threads(1)
+    urdf_file = ROBOTS[task['robot']]['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False)
+    episodes = []
+    try:
+        if task['policy'] != 'random':
+            check_compatible(task['policy'], env)  # IncompatibleCheckpointError (a ValueError) without loading it
+        model = None if task['policy'] == 'random' else PPO.load(task['policy'], device='cpu')
+        if model is not None and model.observation_space.shape != env.observation_space.shape:
+            raise ValueError(f"{task['policy']} expects observations of shape {model.observation_space.shape}, "
+                             f"the env's are {env.observation_space.shape} (trained with a different env version?)")
+        for seed in task['seeds']:
+            obs, _ = env.reset(seed=seed)
+            env.action_space.seed(seed)
+            done = False
+            while not done:
+                # checkpoints act stochastically, like they do while training
+                action = env.action_space.sample() if model is None else model.predict(obs, deterministic=False)[0]
+                obs, _, terminated, truncated, _ = env.step(action)
+                done = terminated or truncated
+            # reward_history holds this episode's steps until the next reset
+            episodes.append(env.reward_history[list(DIAGNOSTIC_COLUMNS)].to_numpy(dtype=np.float32))
+    finally:
+        env.close()
+    return np.concatenate(episodes), np.array([len(episode) for episode in episodes], dtype=np.int32)
+
+
+def diagnostics_key(robot, policy, episodes, seed):
+    ''' Hash of everything the diagnostic results depend on. '''
+    digest = hashlib.sha256()
+    settings = {'robot': robot, 'config': ROBOTS[robot], 'policy': os.path.basename(policy), 'episodes': episodes, 'seed': seed}
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    for path in _SOURCE_FILES + ([] if policy == 'random' else [policy]):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def collect_reward_terms(robot, policy='random', episodes=1000, seed=0, workers=None, episodes_per_task=8,
+                         cache_dir=None):
+    '''
+    Per-step reward terms over many episodes, from the cache if this exact diagnostic has been run before.
+
+    :param robot: robot name in config.py
+    :param policy: 'random' or a checkpoint path
+    :param episodes: number of episodes (seeded seed, seed + 1, ...)
+    :param workers: number of worker processes (default: one per core)
+    :param episodes_per_task: episodes per pool task (each task builds its own env)
+    :param cache_dir: where results are cached (None = no caching)
+    :return: dict with 'terms' ((steps, len(DIAGNOSTIC_COLUMNS)) array), 'episode_lengths', 'episode_starts' and
+        'cached' (whether it came from the cache)
+    '''
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"{robot}_{diagnostics_key(robot, policy, episodes, seed)}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                terms, lengths = cached['terms'], cached['episode_lengths']
+            return _results(terms, lengths, cached=True)
+
+    seeds = list(range(seed, seed + episodes))
+    tasks = [{'robot': robot, 'policy': policy, 'seeds': seeds[i:i + episodes_per_task]}
+             for i in range(0, episodes, episodes_per_task)]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(tasks))) as pool:
+        chunks = list(pool.map(run_episodes, tasks))
+    terms = np.concatenate([chunk[0] for chunk in chunks])
+    lengths = np.concatenate([chunk[1] for chunk in chunks])
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, terms=terms, episode_lengths=lengths)
+    return _results(terms, lengths, cached=False)
+
+
+def _results(terms, lengths, cached):
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    return {'terms': terms, 'episode_lengths': lengths, 'episode_starts': starts, 'cached': cached}
+
+
+def summarize(results, bins=20):
+    '''
+    Per-term and episode return statistics.
+
+    :param results: from collect_reward_terms
+    :param bins: histogram bins
+    :return: dict with 'terms' (name -> mean, std, min, p5, p50, p95, max, share of the summed |terms| and
+        (counts, edges) histogram) and 'returns' (the same statistics for episode returns, plus 'lengths' mean)
+    '''
+    def stats(values):
+        p5, p50, p95 = np.percentile(values, [5, 50, 95])
+        counts, edges = np.histogram(values, bins=bins)
+        return {'mean': float(values.mean()), 'std': float(values.std()), 'min': float(values.min()),
+                'p5': float(p5), 'p50': float(p50), 'p95': float(p95), 'max': float(values.max()),
+                'histogram': (counts, edges)}
+
+    terms = results['terms'].astype(np.float64)
+    magnitudes = np.abs(terms[:, :len(REWARD_TERMS)]).sum(axis=0)
+    summary = {'terms': {}, 'steps': len(terms), 'episodes': len(results['episode_lengths'])}
+    for i, name in enumerate(DIAGNOSTIC_COLUMNS):
+        summary['terms'][name] = stats(terms[:, i])
+        summary['terms'][name]['share'] = float(magnitudes[i] / max(magnitudes.sum(), 1e-12)) if name != 'total' else 1.0
+    returns = np.add.reduceat(terms[:, -1], results['episode_starts'])
+    summary['returns'] = stats(returns)
+    summary['returns']['length'] = float(results['episode_lengths'].mean())
+    return summary
+
+
+def plot_summary(summaries, path):
+    '''
+    Saves per-term histograms (and the episode return histogram) for one or more policies as an image.
+
+    :param summaries: dict of policy label -> summarize() result
+    :param path: image file to write
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    panels = list(DIAGNOSTIC_COLUMNS) + ['episode return']
+    fig, axes = plt.subplots(nrows=3, ncols=4, figsize=(16, 10))
+    for ax, name in zip(axes.flatten(), panels):
+        for label, summary in summaries.items():
+            stats = summary['returns'] if name == 'episode return' else summary['terms'][name]
+            counts, edges = stats['histogram']
+            ax.stairs(counts / max(counts.sum(), 1), edges, label=label)
+        ax.set_title(name)
+    axes.flatten()[0].legend(fontsize=8)
+    plt.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
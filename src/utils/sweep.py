@@ -0,0 +1,317 @@
+'''
+Hyperparameter and reward weight sweeps with asynchronous successive halving (run them with sweep.py).
+
+A sweep is described by a JSON file:
+
+    {
+        "robot": "servobot",
+        "trials": 27,                  # number of configurations to try
+        "min_timesteps": 50000,        # training budget of the first rung...
+        "max_timesteps": 1350000,      # ...up to the last one, growing by reduction_factor per rung
+        "reduction_factor": 3,         # 1 in reduction_factor trials gets promoted to the next rung
+        "eval_episodes": 5,
+        "seed": 0,
+        "env": {"contact_obs": true},  # extra BaseEnv arguments, as in train.py (optional)
+        "space": {
+            "learning_rate": ["loguniform", 1e-5, 1e-3],  # lowercase: PPO arguments
+            "n_steps": ["choice", 1024, 2048, 4096],
+            "FORWARD_VEL_WEIGHT": ["uniform", 5, 20],      # UPPERCASE: reward weights the reward kernel reads
+            "FALLEN_PENALTY": ["choice", 10, 30, 50]
+        }
+    }
+
+UPPERCASE names have to be in reward.REWARD_WEIGHTS. Other weights in config.py (ORIENTATION_REWARD_WEIGHT,
+SHAKE_PENALTY_WEIGHT...) only feed the old calculate_step_reward, so sweeping them would change nothing and the
+sweep refuses them.
+
+Distributions are the ones from randomization.py plus ["choice", ...]. Trials run in a process pool, one BaseEnv per
+worker (PyBullet's default client is per process). Scheduling is asynchronous successive halving (ASHA): whenever a
+worker is free it continues the best trial that's in the top 1/reduction_factor of its rung and hasn't been promoted
+yet, and otherwise starts a new trial, so workers never sit idle waiting for a whole rung to finish. Every segment
+continues from the previous rung's saved model.
+
+Trials are scored on the robot's own reward weights from config.py (mean return over eval_episodes fixed-seed
+episodes), not on the weights they trained with, or changing a weight would change the score scale too.
+Everything goes into an SQLite database in the output folder, so rerunning the same sweep picks up where it stopped
+(segments that were cut off are redone from the last finished rung).
+'''
+
+import os
+import json
+import sqlite3
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .randomization import sample_distribution
+from .reward import check_reward_weights
+from .checkpoint_metadata import write_metadata
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+SWEEP_DEFAULTS = {
+    'robot': 'simple_quadruped',
+    'trials': 27,
+    'min_timesteps': 50000,
+    'max_timesteps': 1350000,
+    'reduction_factor': 3,
+    'eval_episodes': 5,
+    'seed': 0,
+    'env': {},
+    'space': {},
+}
+
+# Same PPO settings as a fresh model in train.py, anything in the search space overrides them
+SWEEP_PPO_DEFAULTS = {
+    'n_steps': 2048,
+    'learning_rate': 0.0001,
+    'batch_size': 64,
+    'target_kl': 0.015,
+    'ent_coef': 0.01,
+}
+
+
+def load_sweep(path):
+    ''' Reads a sweep file and fills in the defaults. '''
+    with open(path) as f:
+        spec = json.load(f)
+    unknown = set(spec) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep settings in {path}: {sorted(unknown)}")
+    spec = {**SWEEP_DEFAULTS, **spec}
+    check_reward_weights(spec['space'], path)
+    return spec
+
+
+def sample_params(space, rng):
+    ''' Draws one configuration from the search space (plain Python values, so they go into JSON as-is). '''
+    params = {}
+    for name, distribution in space.items():
+        if distribution[0] == 'choice':
+            params[name] = distribution[1 + rng.integers(len(distribution) - 1)]
+        else:
+            params[name] = float(sample_distribution(distribution, rng))
+    return params
+
+
+def rung_budgets(min_timesteps, max_timesteps, reduction_factor):
+    ''' Total training timesteps at the end of each rung, e.g. [50000, 150000, 450000, 1350000] '''
+    budgets = [int(min_timesteps)]
+    while budgets[-1] * reduction_factor <= max_timesteps:
+        budgets.append(int(budgets[-1] * reduction_factor))
+    return budgets
+
+
+class ResultsDB:
+    '''
+    SQLite record of a sweep's trials and the score of every finished segment (one per trial per rung).
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS trials (trial INTEGER PRIMARY KEY, params TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (trial INTEGER, rung INTEGER, timesteps INTEGER, '
+                                'score REAL, model_path TEXT, PRIMARY KEY (trial, rung))')
+        self.connection.commit()
+
+    def add_trial(self, trial, params):
+        self.connection.execute('INSERT INTO trials VALUES (?, ?)', (trial, json.dumps(params)))
+        self.connection.commit()
+
+    def add_result(self, trial, rung, timesteps, score, model_path):
+        self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                (trial, rung, timesteps, score, model_path))
+        self.connection.commit()
+
+    def trials(self):
+        ''' trial -> params '''
+        return {trial: json.loads(params) for trial, params in self.connection.execute('SELECT * FROM trials')}
+
+    def results(self):
+        ''' (trial, rung) -> (score, model_path) '''
+        rows = self.connection.execute('SELECT trial, rung, score, model_path FROM results')
+        return {(trial, rung): (score, model_path) for trial, rung, score, model_path in rows}
+
+    def close(self):
+        self.connection.close()
+
+
+class AsyncSuccessiveHalving:
+    '''
+    Decides what a free worker should run next, from the results so far and the segments currently running.
+    '''
+
+    def __init__(self, db, spec):
+        self.db = db
+        self.spec = spec
+        self.budgets = rung_budgets(spec['min_timesteps'], spec['max_timesteps'], spec['reduction_factor'])
+
+    def next_job(self, running):
+        '''
+        :param running: trial ids with a segment in progress
+        :return: (trial, rung) to run next, or None if nothing can start until a running segment finishes
+        '''
+        trials = self.db.trials()
+        results = self.db.results()
+        eta = self.spec['reduction_factor']
+
+        # Promote the best trial that's in the top 1/eta of its rung, highest rung first
+        for rung in range(len(self.budgets) - 2, -1, -1):
+            finished = sorted(((score, trial) for (trial, r), (score, _) in results.items() if r == rung), reverse=True)
+            for score, trial in finished[:len(finished) // eta]:
+                if (trial, rung + 1) not in results and trial not in running:
+                    return trial, rung + 1
+
+        # Redo first rungs cut off by an interrupted run, then start new trials
+        for trial in sorted(trials):
+            if (trial, 0) not in results and trial not in running:
+                return trial, 0
+        if len(trials) < self.spec['trials']:
+            trial = len(trials)
+            rng = np.random.default_rng([self.spec['seed'], trial])
+            self.db.add_trial(trial, sample_params(self.spec['space'], rng))
+            return trial, 0
+        return None
+
+
+def apply_env_params(env, params):
+    '''
+    Sets a trial's UPPERCASE parameters (reward weights) on the env and separates out the PPO ones.
+
+    :return: (nominal, ppo_params): the env's original values of what was set (to put back for evaluation) and the
+        lowercase parameters
+    '''
+    check_reward_weights(params, 'the trial parameters')
+    nominal, ppo_params = {}, {}
+    for name, value in params.items():
+        if name.isupper():
+            nominal[name] = getattr(env, name)
+            setattr(env, name, value)
+        else:
+            ppo_params[name] = value
+    return nominal, ppo_params
+
+
+def evaluate_policy(model, env, episodes, seed=10_000):
+    ''' Mean return of the deterministic policy over fixed-seed episodes (the same commands for every trial). '''
+    returns = []
+    for episode in range(episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        done, total = False, 0.0
+        while not done:
+            action, _ = model.predict(obs, deterministic=True)
+            obs, reward, terminated, truncated, _ = env.step(action)
+            total += reward
+            done = terminated or truncated
+        returns.append(total)
+    return float(np.mean(returns))
+
+
+def run_trial_segment(job):
+    '''
+    Trains one trial up to the end of a rung and scores it (runs in a worker process).
+
+    :param job: dict with trial, rung, robot, env, params, seed, from_timesteps, to_timesteps, start_model (None for a
+        new model), model_path and eval_episodes
+    :return: the evaluation score
+    '''
+    import torch
+    from stable_baselines3 import PPO
+    from ..envs.env import BaseEnv, get_min_z
+    from .config import ROBOTS
+
+    torch.set_num_threads(1)  # one core per trial, the pool provides the parallelism
+    urdf_file = ROBOTS[job['robot']]['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False,
+                  **job['env'])
+    try:
+        nominal, ppo_params = apply_env_params(env, job['params'])
+        if job['start_model'] is None:
+            model = PPO("MlpPolicy", env, verbose=0, seed=job['seed'], device='cpu', **{**SWEEP_PPO_DEFAULTS, **ppo_params})
+        else:
+            model = PPO.load(job['start_model'], env=env, device='cpu')
+        # PPO rounds every learn() up to whole rollouts, so train up to the rung's budget from where the model actually
+        # is, or the overshoot would add up over the rungs and trials would get different amounts of training
+        model.learn(total_timesteps=job['to_timesteps'] - model.num_timesteps, reset_num_timesteps=False)
+        model.save(job['model_path'])
+
+        for name, value in nominal.items():
+            setattr(env, name, value)
+        score = evaluate_policy(model, env, job['eval_episodes'])
+        write_metadata(job['model_path'], env, model.num_timesteps, score, params=job['params'])
+        return score
+    finally:
+        env.close()
+
+
+def run_sweep(spec, out_dir, workers=None, run_segment=run_trial_segment):
+    '''
+    Runs (or resumes) a sweep until every trial has been promoted as far as it gets.
+
+    :param spec: sweep settings (see load_sweep)
+    :param out_dir: where the results database and the trial models go
+    :param workers: number of worker processes (default: one per core)
+    :param run_segment: function of a job dict returning a score (run_trial_segment, swapped out in tests)
+    :return: list of (trial, highest rung, score there, params, model_path), best first
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    db = ResultsDB(os.path.join(out_dir, 'sweep.db'))
+    scheduler = AsyncSuccessiveHalving(db, spec)
+    budgets = scheduler.budgets
+    workers = workers or os.cpu_count()
+    logger.info(f"Sweep: {spec['trials']} trials, rungs at {budgets} timesteps, {workers} workers, results in {out_dir}")
+
+    running = {}  # future -> job
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                while len(running) < workers:
+                    next_job = scheduler.next_job({job['trial'] for job in running.values()})
+                    if next_job is None:
+                        break
+                    trial, rung = next_job
+                    job = {
+                        'trial': trial,
+                        'rung': rung,
+                        'robot': spec['robot'],
+                        'env': spec['env'],
+                        'params': db.trials()[trial],
+                        'seed': spec['seed'] + trial,
+                        'from_timesteps': budgets[rung - 1] if rung > 0 else 0,
+                        'to_timesteps': budgets[rung],
+                        'start_model': db.results()[(trial, rung - 1)][1] if rung > 0 else None,
+                        'model_path': os.path.join(out_dir, f"trial_{trial:03d}_rung_{rung}.zip"),
+                        'eval_episodes': spec['eval_episodes'],
+                    }
+                    running[pool.submit(run_segment, job)] = job
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    score = future.result()
+                    db.add_result(job['trial'], job['rung'], job['to_timesteps'], score, job['model_path'])
+                    logger.info(f"Trial {job['trial']} rung {job['rung']} ({job['to_timesteps']} timesteps): score {score:.2f}")
+
+        leaderboard = sweep_leaderboard(db)
+    finally:
+        db.close()
+
+    with open(os.path.join(out_dir, 'best.json'), 'w') as f:
+        trial, rung, score, params, model_path = leaderboard[0]
+        json.dump({'trial': trial, 'rung': rung, 'timesteps': budgets[rung], 'score': score,
+                   'params': params, 'model_path': model_path}, f, indent=4)
+    return leaderboard
+
+
+def sweep_leaderboard(db):
+    ''' Each trial's furthest result, sorted by rung reached and then score, best first. '''
+    params = db.trials()
+    furthest = {}
+    for (trial, rung), (score, model_path) in db.results().items():
+        if trial not in furthest or rung > furthest[trial][0]:
+            furthest[trial] = (rung, score, model_path)
+    rows = [(trial, rung, score, params[trial], model_path) for trial, (rung, score, model_path) in furthest.items()]
+    return sorted(rows, key=lambda row: (row[1], row[2]), reverse=True)
@@ -0,0 +1,161 @@
+'''
+Procedural heightfield terrain for BaseEnv.
+
+Terrain is a single PyBullet heightfield body that gets regenerated in place on every reset (through
+createCollisionShape(..., replaceHeightfieldIndex=...)), so there's no body removal/reloading per episode.
+Heightfields are generated from seeded parameters and cached by a hash of those parameters, and seeds are drawn
+from a fixed number of variants per terrain type, so after warm-up most resets are cache hits.
+
+All heights are between 0 and max_height, and the middle of the map (the spawn pad) is flat at height 0, so the
+robot's usual start position and the plane.urdf underneath stay valid. (PyBullet fixes a heightfield's bounding box
+and vertical centre when it is first created, so replacements have to stay inside that first height range.)
+'''
+
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pybullet as p
+
+
+TERRAIN_TYPES = ['flat', 'rough', 'slope', 'steps']
+
+# Default generation parameters (all lengths in meters)
+TERRAIN_DEFAULTS = {
+    'size': 8.0,             # side length of the square map
+    'resolution': 0.05,      # distance between heightfield samples
+    'spawn_radius': 0.5,     # flat pad around the origin where the robot spawns
+    'max_height': 0.5,       # every heightfield is clipped to [0, max_height]
+    'roughness': 0.03,       # max bump height for 'rough' (and the noise added to 'slope')
+    'max_slope': 0.15,       # max rise over run for 'slope'
+    'step_height': 0.03,     # height of one step level for 'steps'
+    'step_width': 0.4,       # side length of one step block for 'steps'
+    'step_levels': 3,        # number of different step heights
+}
+
+# Generated heightfields, keyed by parameter hash (least recently used ones get dropped)
+_HEIGHTFIELD_CACHE = OrderedDict()
+_HEIGHTFIELD_CACHE_SIZE = 64
+
+
+def terrain_hash(params):
+    ''' Stable hash of a terrain parameter dictionary. '''
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def _smooth(heights, passes=2):
+    ''' Cheap 3x3 box blur, repeated a few times. '''
+    for _ in range(passes):
+        padded = np.pad(heights, 1, mode='edge')
+        heights = sum(padded[1 + dy:padded.shape[0] - 1 + dy, 1 + dx:padded.shape[1] - 1 + dx]
+                      for dy in (-1, 0, 1) for dx in (-1, 0, 1)) / 9.0
+    return heights
+
+
+def generate_heightfield(params):
+    '''
+    Generates a (rows, rows) array of terrain heights from a parameter dictionary (TERRAIN_DEFAULTS plus
+    'type' and 'seed'). Pure function of params, so the result can be cached.
+    '''
+    rng = np.random.default_rng(params['seed'])
+    rows = int(round(params['size'] / params['resolution'])) + 1
+    coords = (np.arange(rows) - (rows - 1) / 2) * params['resolution']
+    x, y = np.meshgrid(coords, coords)  # heights[j, i] is at (x[i], y[j])
+    dist = np.hypot(x, y)
+
+    terrain_type = params['type']
+    if terrain_type == 'flat':
+        heights = np.zeros((rows, rows))
+    elif terrain_type == 'rough':
+        heights = _smooth(rng.uniform(0, params['roughness'], size=(rows, rows)))
+    elif terrain_type == 'slope':
+        # ramp up from the edge of the spawn pad in a random direction, with a little noise on top
+        angle = rng.uniform(0, 2 * np.pi)
+        slope = rng.uniform(0.3, 1.0) * params['max_slope']
+        along = x * np.cos(angle) + y * np.sin(angle)
+        heights = slope * np.maximum(along - params['spawn_radius'], 0.0)
+        heights += _smooth(rng.uniform(0, 0.3 * params['roughness'], size=(rows, rows)))
+    elif terrain_type == 'steps':
+        # blocks of random height, like stepping stones
+        blocks = int(np.ceil(params['size'] / params['step_width'])) + 1
+        levels = rng.integers(0, params['step_levels'] + 1, size=(blocks, blocks)) * params['step_height']
+        index = np.clip(((coords + params['size'] / 2) / params['step_width']).astype(int), 0, blocks - 1)
+        heights = levels[np.ix_(index, index)]
+    else:
+        raise ValueError(f"Unknown terrain type '{terrain_type}', expected one of {TERRAIN_TYPES}")
+
+    heights = np.where(dist < params['spawn_radius'], 0.0, heights)
+    return np.clip(heights, 0.0, params['max_height'])
+
+
+def get_heightfield(params):
+    '''
+    Returns the heightfield for params as a flat list (what PyBullet wants), from the cache if we've generated it
+    before.
+    '''
+    key = terrain_hash(params)
+    if key in _HEIGHTFIELD_CACHE:
+        _HEIGHTFIELD_CACHE.move_to_end(key)
+        return _HEIGHTFIELD_CACHE[key]
+    heights = generate_heightfield(params)
+    data = heights.ravel().tolist()
+    _HEIGHTFIELD_CACHE[key] = data
+    if len(_HEIGHTFIELD_CACHE) > _HEIGHTFIELD_CACHE_SIZE:
+        _HEIGHTFIELD_CACHE.popitem(last=False)
+    return data
+
+
+class Terrain:
+    '''
+    A heightfield body in the current PyBullet simulation that can be regenerated in place.
+    '''
+
+    def __init__(self, types=('rough',), variants=16, lateral_friction=0.8, **params):
+        '''
+        Creates the heightfield body (flat until the first regenerate()).
+
+        :param types: terrain types to pick from on every regenerate() (see TERRAIN_TYPES)
+        :param variants: number of different seeds per terrain type (bounds the number of distinct heightfields)
+        :param lateral_friction: ground friction, same as the plane's
+        :param params: overrides for TERRAIN_DEFAULTS
+        '''
+        unknown = set(params) - set(TERRAIN_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown terrain parameters: {sorted(unknown)}")
+        for terrain_type in types:
+            if terrain_type not in TERRAIN_TYPES:
+                raise ValueError(f"Unknown terrain type '{terrain_type}', expected one of {TERRAIN_TYPES}")
+        self.types = list(types)
+        self.variants = variants
+        self.params = {**TERRAIN_DEFAULTS, **params}
+        self.rows = int(round(self.params['size'] / self.params['resolution'])) + 1
+        self.mesh_scale = [self.params['resolution'], self.params['resolution'], 1.0]
+        self.current_params = None
+
+        # The first heightfield sets the height range for all later replacements, so give it one sample at
+        # max_height (in a far corner) and centre the body so that height 0 sits at z=0
+        data = [0.0] * (self.rows * self.rows)
+        data[0] = self.params['max_height']
+        self.shape_id = p.createCollisionShape(
+            shapeType=p.GEOM_HEIGHTFIELD, meshScale=self.mesh_scale, heightfieldData=data,
+            numHeightfieldRows=self.rows, numHeightfieldColumns=self.rows)
+        self.body_id = p.createMultiBody(baseMass=0, baseCollisionShapeIndex=self.shape_id,
+                                         basePosition=[0, 0, self.params['max_height'] / 2])
+        p.changeDynamics(self.body_id, -1, lateralFriction=lateral_friction)
+
+    def regenerate(self, rng):
+        '''
+        Swaps in a new heightfield (random type and variant drawn from rng) without reloading the body.
+
+        :param rng: numpy Generator (BaseEnv passes its np_random, so terrain follows the env seed)
+        :return: the parameters of the new terrain
+        '''
+        terrain_type = self.types[rng.integers(len(self.types))]
+        params = {**self.params, 'type': terrain_type, 'seed': int(rng.integers(self.variants))}
+        if params == self.current_params:
+            return params
+        p.createCollisionShape(
+            shapeType=p.GEOM_HEIGHTFIELD, meshScale=self.mesh_scale, heightfieldData=get_heightfield(params),
+            numHeightfieldRows=self.rows, numHeightfieldColumns=self.rows, replaceHeightfieldIndex=self.shape_id)
+        self.current_params = params
+        return params
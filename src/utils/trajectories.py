@@ -0,0 +1,145 @@
+'''
+Recording of the raw per-step state the reward is computed from, for offline reward relabeling (see relabel.py).
+
+TrajectoryRecorder is a gymnasium wrapper around BaseEnv. Every step it keeps the base pose and velocities, joint
+positions, the action, the commands, the body contact flag and the reward the env gave. It takes all of these from
+the step's info and observation (joint positions from PyBullet if the observation layout leaves them out), so
+recording usually costs no extra PyBullet queries. Episodes are written episodes_per_file at a time to .npz files of
+float32 arrays, one row per step, together with a JSON header. The header holds what the reward needs besides the
+state: the env's reward weights (REWARD_WEIGHTS), the home pose and the target height.
+'''
+
+import os
+import json
+import glob
+import numpy as np
+import pybullet as p
+import gymnasium as gym
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+# Per-step arrays in a trajectory file (plus 'episode_lengths', one entry per episode)
+TRAJECTORY_FIELDS = ('base_position', 'base_orientation', 'base_velocity', 'base_angular_velocity', 'joint_positions',
+                     'action', 'target_velocity', 'target_turn', 'body_contact', 'reward', 'terminated')
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    '''
+    Records every step of a BaseEnv into trajectory files.
+    '''
+
+    def __init__(self, env, folder, name_prefix='trajectories', episodes_per_file=100):
+        '''
+        :param env: a BaseEnv (possibly wrapped)
+        :param folder: where trajectory files go (created if needed)
+        :param name_prefix: files are named <name_prefix>-<n>.npz
+        :param episodes_per_file: finished episodes per file
+        '''
+        super().__init__(env)
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.name_prefix = name_prefix
+        self.episodes_per_file = episodes_per_file
+        # where the current frame's joint angles are in the observation (the layout is configurable and may be stacked)
+        self.joint_slice = env.unwrapped.observation_offsets.get('joint_positions')
+        self.files = []
+        self.buffers = {field: [] for field in TRAJECTORY_FIELDS}
+        self.episode_lengths = []
+        self.episode_steps = 0
+
+    def header(self):
+        ''' Everything besides the per-step state that the reward depends on. '''
+        base_env = self.env.unwrapped
+        return {
+            'robot_name': base_env.robot_name,
+            'weights': {name: float(value) for name, value in base_env.reward_weights.items()},
+            'home_position': [float(angle) for angle in base_env.home_position],
+            'target_z': float(base_env.start_position[2]),
+        }
+
+    def reset(self, **kwargs):
+        self._finish_episode()
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        base_env = self.env.unwrapped
+        buffers = self.buffers
+        buffers['base_position'].append(info['base_position'])
+        buffers['base_orientation'].append(info['base_orientation'])
+        buffers['base_velocity'].append(info['base_velocity'])
+        buffers['base_angular_velocity'].append(info['base_angular_velocity'])
+        if self.joint_slice is not None:
+            buffers['joint_positions'].append(obs[self.joint_slice])
+        else:
+            joint_states = p.getJointStates(base_env.robot_id, base_env.joint_indices)
+            buffers['joint_positions'].append([state[0] for state in joint_states])
+        buffers['action'].append(np.asarray(action, dtype=np.float32))
+        buffers['target_velocity'].append(np.asarray(base_env.target_velocity, dtype=np.float32))
+        buffers['target_turn'].append(base_env.target_turn)
+        buffers['body_contact'].append(info['body_contact'])
+        buffers['reward'].append(reward)
+        buffers['terminated'].append(terminated)
+        self.episode_steps += 1
+        return obs, reward, terminated, truncated, info
+
+    def _finish_episode(self):
+        if self.episode_steps == 0:
+            return
+        self.episode_lengths.append(self.episode_steps)
+        self.episode_steps = 0
+        if len(self.episode_lengths) >= self.episodes_per_file:
+            self._write_file()
+
+    def _write_file(self):
+        # only whole episodes go into files, a partial one at close() is dropped
+        steps = sum(self.episode_lengths)
+        if steps == 0:
+            return
+        arrays = {}
+        for field, values in self.buffers.items():
+            dtype = bool if field in ('body_contact', 'terminated') else np.float32
+            arrays[field] = np.asarray(values[:steps], dtype=dtype)
+            del values[:steps]
+        arrays['episode_lengths'] = np.asarray(self.episode_lengths, dtype=np.int32)
+        path = os.path.join(self.folder, f"{self.name_prefix}-{len(self.files)}.npz")
+        np.savez(path, header=json.dumps(self.header()), **arrays)
+        self.files.append(path)
+        logger.info(f"Saved {len(self.episode_lengths)} episodes ({steps} steps) to {path}")
+        self.episode_lengths = []
+
+    def close(self):
+        self._finish_episode()
+        self._write_file()
+        super().close()
+
+
+def load_trajectories(paths):
+    '''
+    Loads and concatenates trajectory files.
+
+    :param paths: a folder (every .npz in it), one file or a list of files
+    :return: (data, header) where data maps each field to its (steps, ...) array, plus 'episode_lengths',
+        'episode_starts' (index of each episode's first step) and 'episode' (episode index of every step)
+    '''
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(os.path.join(paths, '*.npz'))) if os.path.isdir(paths) else [paths]
+    if not paths:
+        raise FileNotFoundError("No trajectory files to load")
+    chunks, header = [], None
+    for path in paths:
+        with np.load(path) as file:
+            file_header = json.loads(str(file['header']))
+            if header is not None and file_header['robot_name'] != header['robot_name']:
+                raise ValueError(f"{path} was recorded with {file_header['robot_name']}, not {header['robot_name']}")
+            header = header or file_header
+            chunks.append({field: file[field] for field in TRAJECTORY_FIELDS + ('episode_lengths',)})
+
+    data = {field: np.concatenate([chunk[field] for chunk in chunks]) for field in chunks[0]}
+    lengths = data['episode_lengths']
+    data['episode_starts'] = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    data['episode'] = np.repeat(np.arange(len(lengths)), lengths)
+    return data, header
@@ -0,0 +1,361 @@
+'''
+Generic kinematics for multi-leg robots, built straight from the URDF instead of hand-written per-robot solvers
+(like the analytic servobot IK in kinematics.py).
+
+The URDF is parsed once into a compiled description of every leg (a chain of fixed transforms and joint rotations
+from the body link to the foot tip), which is cached per file. From that we get batched forward kinematics,
+damped-least-squares IK and a standing 'home' pose for any robot in config.ROBOTS.
+
+All foot positions are expressed in the body link's frame. Batched arrays are (N, legs * joints_per_leg) for joint
+angles and (N, legs * 3) for foot positions, with legs and joints in the order of LegKinematics.joint_names.
+'''
+
+import os
+import functools
+import xml.etree.ElementTree as ET
+import numpy as np
+
+
+# --- Small transform helpers ---
+def rpy_to_matrix(rpy):
+    ''' URDF roll/pitch/yaw (fixed axis X, then Y, then Z) to a 3x3 rotation matrix. '''
+    roll, pitch, yaw = rpy
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    return np.array([
+        [cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+        [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+        [-sp, cp * sr, cp * cr],
+    ])
+
+
+def make_transform(xyz=(0, 0, 0), rpy=(0, 0, 0)):
+    ''' 4x4 homogeneous transform from a URDF origin. '''
+    transform = np.eye(4)
+    transform[:3, :3] = rpy_to_matrix(rpy)
+    transform[:3, 3] = xyz
+    return transform
+
+
+def invert_transform(transform):
+    ''' Inverse of a rigid 4x4 transform. '''
+    inverse = np.eye(4)
+    inverse[:3, :3] = transform[:3, :3].T
+    inverse[:3, 3] = -transform[:3, :3].T @ transform[:3, 3]
+    return inverse
+
+
+def axis_angle_to_matrix(axes, angles):
+    '''
+    Batched Rodrigues formula.
+
+    :param axes: unit rotation axes, shape (..., 3)
+    :param angles: rotation angles in radians, shape (...)
+    :return: rotation matrices, shape (..., 3, 3)
+    '''
+    x, y, z = axes[..., 0], axes[..., 1], axes[..., 2]
+    zero = np.zeros_like(x)
+    skew = np.stack([
+        np.stack([zero, -z, y], axis=-1),
+        np.stack([z, zero, -x], axis=-1),
+        np.stack([-y, x, zero], axis=-1),
+    ], axis=-2)
+    sin, cos = np.sin(angles)[..., None, None], np.cos(angles)[..., None, None]
+    return np.eye(3) + sin * skew + (1 - cos) * (skew @ skew)
+
+
+def _parse_origin(element):
+    origin = element.find('origin') if element is not None else None
+    if origin is None:
+        return np.eye(4)
+    xyz = [float(v) for v in origin.get('xyz', '0 0 0').split()]
+    rpy = [float(v) for v in origin.get('rpy', '0 0 0').split()]
+    return make_transform(xyz, rpy)
+
+
+# --- Foot tip geometry ---
+def read_stl_vertices(stl_path):
+    ''' Reads all vertices of a (binary or ASCII) STL file as an (M, 3) array. '''
+    with open(stl_path, 'rb') as f:
+        data = f.read()
+    if data[:5] == b'solid' and b'facet' in data[:512]:
+        vertices = [line.split()[1:4] for line in data.decode(errors='ignore').splitlines()
+                    if line.strip().startswith('vertex')]
+        return np.array(vertices, dtype=np.float64)
+    num_triangles = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+    record = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+    triangles = np.frombuffer(data, dtype=record, count=num_triangles, offset=84)
+    return triangles['vertices'].reshape(-1, 3).astype(np.float64)
+
+
+def _geometry_points(geometry, urdf_dir):
+    ''' Sample points describing a URDF geometry element (in the geometry's own frame). '''
+    mesh, box = geometry.find('mesh'), geometry.find('box')
+    cylinder, sphere = geometry.find('cylinder'), geometry.find('sphere')
+    if mesh is not None:
+        filename = mesh.get('filename').replace('package://', '')
+        scale = [float(v) for v in mesh.get('scale', '1 1 1').split()]
+        return read_stl_vertices(os.path.join(urdf_dir, filename)) * scale
+    if box is not None:
+        half = np.array([float(v) for v in box.get('size').split()]) / 2
+        return np.array([[sx, sy, sz] for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)]) * half
+    if cylinder is not None:
+        radius, length = float(cylinder.get('radius')), float(cylinder.get('length'))
+        angles = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+        ring = np.stack([radius * np.cos(angles), radius * np.sin(angles)], axis=-1)
+        return np.concatenate([np.column_stack([ring, np.full(16, z)]) for z in (-length / 2, length / 2)])
+    if sphere is not None:
+        radius = float(sphere.get('radius'))
+        return np.concatenate([np.eye(3), -np.eye(3)]) * radius
+    return np.zeros((0, 3))
+
+
+def find_foot_tip(link, urdf_dir):
+    '''
+    Estimates the foot tip of a leg's last link as the centre of the part of its collision geometry farthest from the
+    link's origin (which is the last joint), in the link's frame. Falls back to the link origin if it has no geometry.
+    '''
+    points = []
+    for collision in link.findall('collision'):
+        geometry_points = _geometry_points(collision.find('geometry'), urdf_dir)
+        transform = _parse_origin(collision)
+        points.append(geometry_points @ transform[:3, :3].T + transform[:3, 3])
+    points = np.concatenate(points) if points else np.zeros((0, 3))
+    if len(points) == 0:
+        return np.zeros(3)
+    # average everything within 2% of the farthest distance, so e.g. a box leg gets the middle of its end face
+    distances = np.linalg.norm(points, axis=1)
+    return points[distances >= 0.98 * distances.max()].mean(axis=0)
+
+
+# --- Compiled leg chains ---
+class LegKinematics:
+    '''
+    Compiled kinematic description of every leg of a robot, plus batched FK/IK over it.
+
+    Each leg is stored as   foot = pre @ R(axis_1, sign_1 * q_1) @ post_1 @ ... @ R(axis_J, sign_J * q_J) @ post_J
+    where pre/post hold the fixed transforms between joints (post_J also holds the foot tip offset), and sign is
+    -1 for joints that are walked from child to parent (when the URDF isn't rooted at the body link).
+    '''
+
+    def __init__(self, urdf_path, body_link=None):
+        '''
+        Parses the URDF at urdf_path. Use LegKinematics.from_urdf() to share compiled robots between callers.
+
+        :param urdf_path: path to the URDF file
+        :param body_link: name of the link the legs hang off (default: the URDF's root link)
+        '''
+        self.urdf_path = urdf_path
+        urdf_dir = os.path.dirname(os.path.abspath(urdf_path))
+        robot = ET.parse(urdf_path).getroot()
+        links = {link.get('name'): link for link in robot.findall('link')}
+
+        # undirected adjacency, so the tree can be walked from any link
+        neighbours = {name: [] for name in links}
+        child_links = set()
+        for joint in robot.findall('joint'):
+            joint_type = joint.get('type')
+            if joint_type in ('prismatic', 'floating', 'planar'):
+                raise ValueError(f"Joint '{joint.get('name')}' has unsupported type '{joint_type}'")
+            parent, child = joint.find('parent').get('link'), joint.find('child').get('link')
+            axis, limit = joint.find('axis'), joint.find('limit')
+            has_limits = joint_type == 'revolute' and limit is not None
+            info = {
+                'name': joint.get('name'),
+                'moving': joint_type in ('revolute', 'continuous'),
+                'origin': _parse_origin(joint),
+                'axis': np.array([float(v) for v in (axis.get('xyz') if axis is not None else '1 0 0').split()]),
+                'lower': float(limit.get('lower', -np.pi)) if has_limits else -np.pi,
+                'upper': float(limit.get('upper', np.pi)) if has_limits else np.pi,
+            }
+            info['axis'] /= np.linalg.norm(info['axis'])
+            neighbours[parent].append((info, child, 1))
+            neighbours[child].append((info, parent, -1))
+            child_links.add(child)
+
+        root_link = next(name for name in links if name not in child_links)
+        self.body_link = root_link if body_link is None else body_link
+        if self.body_link not in links:
+            raise ValueError(f"Body link '{self.body_link}' not found in {urdf_path}")
+
+        # walk out from the body; every leaf link (other than the body) ends a leg
+        paths = {self.body_link: []}
+        stack = [self.body_link]
+        while stack:
+            link = stack.pop()
+            for info, other, direction in neighbours[link]:
+                if other not in paths:
+                    paths[other] = paths[link] + [(info, direction)]
+                    stack.append(other)
+        legs = [(leaf, paths[leaf]) for leaf in links
+                if leaf != self.body_link and len(neighbours[leaf]) == 1
+                and any(info['moving'] for info, _ in paths[leaf])]
+        if not legs:
+            raise ValueError(f"No legs found in {urdf_path} starting from body link '{self.body_link}'")
+        joints_per_leg = {sum(info['moving'] for info, _ in path) for _, path in legs}
+        if len(joints_per_leg) != 1:
+            raise ValueError(f"Legs of {urdf_path} have different numbers of joints: {sorted(joints_per_leg)}")
+
+        # transform from the URDF root to the body link at zero joint angles (tells us which way is down)
+        self.root_to_body = np.eye(4)
+        for info, direction in paths[root_link]:
+            step = info['origin'] if direction == 1 else invert_transform(info['origin'])
+            self.root_to_body = self.root_to_body @ step
+        self.root_to_body = invert_transform(self.root_to_body)
+
+        self.num_legs = len(legs)
+        self.joints_per_leg = joints_per_leg.pop()
+        self.foot_links = [leaf for leaf, _ in legs]
+        self.joint_names = []
+        self.pre = np.zeros((self.num_legs, 4, 4))
+        self.post = np.zeros((self.num_legs, self.joints_per_leg, 4, 4))
+        self.axes = np.zeros((self.num_legs, self.joints_per_leg, 3))
+        self.signs = np.zeros((self.num_legs, self.joints_per_leg))
+        self.lower = np.zeros((self.num_legs, self.joints_per_leg))
+        self.upper = np.zeros((self.num_legs, self.joints_per_leg))
+
+        for leg, (leaf, path) in enumerate(legs):
+            # fold the fixed parts of the chain around each joint rotation into pre/post transforms
+            current = np.eye(4)
+            j = -1
+            for info, direction in path:
+                if info['moving']:
+                    if direction == 1:
+                        current = current @ info['origin']
+                    if j < 0:
+                        self.pre[leg] = current
+                    else:
+                        self.post[leg, j] = current
+                    j += 1
+                    self.joint_names.append(info['name'])
+                    self.axes[leg, j] = info['axis']
+                    self.signs[leg, j] = direction
+                    self.lower[leg, j], self.upper[leg, j] = info['lower'], info['upper']
+                    current = np.eye(4) if direction == 1 else invert_transform(info['origin'])
+                else:
+                    current = current @ (info['origin'] if direction == 1 else invert_transform(info['origin']))
+            self.post[leg, j] = current @ make_transform(find_foot_tip(links[leaf], urdf_dir))
+
+        self.joint_names = [self.joint_names[i:i + self.joints_per_leg]
+                            for i in range(0, len(self.joint_names), self.joints_per_leg)]
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _cached(cls, urdf_path, body_link, modified_time):
+        return cls(urdf_path, body_link=body_link)
+
+    @classmethod
+    def from_urdf(cls, urdf_path, body_link=None) -> "LegKinematics":
+        '''
+        Compiled kinematics for a URDF, parsed once per process (re-parsed only if the file changes).
+        '''
+        urdf_path = os.path.abspath(urdf_path)
+        return cls._cached(urdf_path, body_link, os.path.getmtime(urdf_path))
+
+    @property
+    def flat_joint_names(self) -> list[str]:
+        return [name for leg in self.joint_names for name in leg]
+
+    @property
+    def down(self) -> np.ndarray:
+        ''' World 'down' in the body frame, when the robot is spawned upright (identity base orientation). '''
+        return self.root_to_body[:3, :3].T @ np.array([0.0, 0.0, -1.0])
+
+    def forward(self, joint_angles, jacobian=False):
+        '''
+        Batched forward kinematics.
+
+        :param joint_angles: array of shape (N, legs * joints_per_leg) (or a single flat configuration)
+        :param jacobian: also return the foot position Jacobian of each leg
+        :return: foot positions of shape (N, legs * 3), and if requested Jacobians of shape (N, legs, 3, joints_per_leg)
+        '''
+        q = np.asarray(joint_angles, dtype=np.float64).reshape(-1, self.num_legs, self.joints_per_leg)
+        rotations = axis_angle_to_matrix(self.axes, self.signs * q)
+
+        # walk down each leg, keeping the current frame as a rotation and a translation
+        rotation = np.broadcast_to(self.pre[:, :3, :3], q.shape[:2] + (3, 3))
+        feet = np.broadcast_to(self.pre[:, :3, 3], q.shape[:2] + (3,))
+        joint_origins, joint_axes = [], []
+        for j in range(self.joints_per_leg):
+            if jacobian:
+                joint_origins.append(feet)
+                joint_axes.append(self.signs[:, j, None] * (rotation @ self.axes[:, j, :, None])[..., 0])
+            rotation = rotation @ rotations[:, :, j]
+            feet = feet + (rotation @ self.post[:, j, :3, 3, None])[..., 0]
+            rotation = rotation @ self.post[:, j, :3, :3]
+
+        if not jacobian:
+            return feet.reshape(len(q), -1)
+        columns = [np.cross(axis, feet - origin) for origin, axis in zip(joint_origins, joint_axes)]
+        return feet.reshape(len(q), -1), np.stack(columns, axis=-1)
+
+    def inverse(self, foot_positions, initial_angles=None, iterations=100, damping=0.01, tolerance=1e-5):
+        '''
+        Batched damped-least-squares IK, respecting the URDF joint limits.
+
+        :param foot_positions: targets of shape (N, legs * 3) in the body frame
+        :param initial_angles: starting guess of shape (N, legs * joints_per_leg) (default: middle of the joint limits)
+        :param iterations: maximum number of iterations
+        :param damping: damping factor (in meters), trades accuracy near singularities for stability
+        :param tolerance: foot position error (in meters) at which a leg counts as solved
+        :return: tuple of joint angles of shape (N, legs * joints_per_leg) and a (N, legs) mask of solved legs
+        '''
+        targets = np.asarray(foot_positions, dtype=np.float64).reshape(-1, self.num_legs, 3)
+        if initial_angles is None:
+            q = np.broadcast_to((self.lower + self.upper) / 2, targets.shape[:2] + (self.joints_per_leg,)).copy()
+        else:
+            q = np.array(initial_angles, dtype=np.float64).reshape(targets.shape[:2] + (self.joints_per_leg,))
+        damping_matrix = damping ** 2 * np.eye(3)
+
+        for _ in range(iterations):
+            feet, jac = self.forward(q, jacobian=True)
+            error = targets - feet.reshape(targets.shape)
+            solved = np.linalg.norm(error, axis=-1) < tolerance
+            if solved.all():
+                break
+            step = jac.swapaxes(-1, -2) @ np.linalg.solve(jac @ jac.swapaxes(-1, -2) + damping_matrix, error[..., None])
+            q = np.clip(q + step[..., 0] * ~solved[..., None], self.lower, self.upper)
+        else:
+            feet = self.forward(q)
+            solved = np.linalg.norm(targets - feet.reshape(targets.shape), axis=-1) < tolerance
+        return q.reshape(len(q), -1), solved
+
+    def standing_pose(self, height=0.5, spread=0.5, iterations=200):
+        '''
+        Finds a standing pose: every foot is placed below and outwards from its hip (its first joint), in the
+        direction it points at zero joint angles.
+
+        :param height: foot depth below the hip as a fraction of the leg's reach
+        :param spread: horizontal foot distance from the hip as a fraction of the leg's reach
+        :param iterations: IK iterations
+        :return: tuple of joint angles (legs * joints_per_leg,) and the (legs, 3) foot targets in the body frame
+        '''
+        down = self.down
+        zero_feet = self.forward(np.zeros(self.num_legs * self.joints_per_leg)).reshape(self.num_legs, 3)
+        hips = self.pre[:, :3, 3]
+
+        # leg reach: sum of the distances between consecutive joints and the foot
+        points = [hips]
+        frame = self.pre
+        for j in range(self.joints_per_leg):
+            frame = frame @ self.post[:, j]
+            points.append(frame[:, :3, 3])
+        reach = np.sum([np.linalg.norm(b - a, axis=-1) for a, b in zip(points[:-1], points[1:])], axis=0)
+
+        outwards = zero_feet - hips
+        outwards -= np.outer(outwards @ down, down)
+        outwards /= np.maximum(np.linalg.norm(outwards, axis=-1, keepdims=True), 1e-9)
+        targets = hips + reach[:, None] * (height * down + spread * outwards)
+
+        angles, _ = self.inverse(targets.reshape(1, -1), iterations=iterations)
+        return angles[0], targets
+
+    def home_position(self, joint_names, **stance):
+        '''
+        Standing pose as a list of joint angles in the given joint order (e.g. BaseEnv's joint order).
+        Joints that aren't part of any leg get 0.
+        '''
+        angles, _ = self.standing_pose(**stance)
+        by_name = dict(zip(self.flat_joint_names, angles.tolist()))
+        return [by_name.get(name, 0.0) for name in joint_names]
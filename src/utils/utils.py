@@ -1,7 +1,12 @@
 
 import os
+import logging
 from .config import ROBOTS
 from . import config
+from .checkpoint_metadata import describe_checkpoint, is_metadata_file
+from .log import get_logger
+
+logger = get_logger(__name__)
 
 
 def load_all_params(robot_name):
@@ -22,6 +27,7 @@ def load_all_params(robot_name):
         'HOME_POSITION_PENALTY_WEIGHT',
         'TILT_PENALTY_WEIGHT',
         'ORIENTATION_REWARD_WEIGHT',
+        'BODY_CONTACT_PENALTY_WEIGHT',
         'ACTION_LIMIT',
         'INITIAL_MOMENTUM',
         'TARGET_SPEED',
@@ -31,10 +37,12 @@ def load_all_params(robot_name):
     params = {}
     for param in possible_params:
         params[param] = ROBOTS[robot_name].get(param, 0.0)  # Default to 0.0 if not found
-    OutputString = "Loaded Parameters: \n==========================\n"
-    for key, value in params.items():
-        OutputString += f"{key} = {value}, \n" 
-    print(OutputString)
+    # every env construction loads these (once per sweep/PBT/diagnostics worker task), so only at ROBOT_LOG_LEVEL=DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        OutputString = "Loaded Parameters: \n==========================\n"
+        for key, value in params.items():
+            OutputString += f"{key} = {value}, \n"
+        logger.debug(OutputString)
     return params
 
 def select_robot(load_model=True):
@@ -52,7 +60,7 @@ def select_robot(load_model=True):
         print("Robot Selected: ", robot_name)
 
         if load_model:
-            model_directory_list = os.listdir(ROBOTS[robot_name]['save_path'])
+            model_directory_list = [name for name in os.listdir(ROBOTS[robot_name]['save_path']) if not is_metadata_file(name)]
             print("Model Directory List: ", model_directory_list)
             
             # Handle case with no models found
@@ -70,7 +78,7 @@ def select_robot(load_model=True):
                 if choice != 'y':
                     print("Available models:")
                     for idx, model_name in enumerate(model_directory_list):
-                        print(f"{idx + 1}: {model_name}")
+                        print(f"{idx + 1}: {model_name} {describe_checkpoint(os.path.join(ROBOTS[robot_name]['save_path'], model_name))}")
                     print("Enter the number of the model you want to use: ")
                     selected_idx = int(input().strip()) - 1
                     if 0 <= selected_idx < len(model_directory_list):
@@ -79,10 +87,10 @@ def select_robot(load_model=True):
                         selected_model = model_directory_list[selected_idx]
                         selected_model_path = os.path.join(ROBOTS[robot_name]['save_path'], selected_model)
                         if os.path.isdir(selected_model_path):
-                            sub_files = os.listdir(selected_model_path)
+                            sub_files = [name for name in os.listdir(selected_model_path) if not is_metadata_file(name)]
                             print(f"'{selected_model}' is a directory. Available files:")
                             for sub_idx, sub_file in enumerate(sub_files):
-                                print(f"{sub_idx + 1}: {sub_file}")
+                                print(f"{sub_idx + 1}: {sub_file} {describe_checkpoint(os.path.join(selected_model_path, sub_file))}")
                             print("Enter the number of the file you want to use: ")
                             sub_selected_idx = int(input().strip()) - 1
                             if 0 <= sub_selected_idx < len(sub_files):
@@ -0,0 +1,147 @@
+'''
+Video recording for BaseEnv rollouts (render_mode='rgb_array').
+
+VideoRecorder is a gymnasium wrapper that grabs env.render() frames (every frame_skip-th step) and hands them to a
+VideoEncoder, which encodes them on a background thread so the rollout never waits on compression. Videos are
+.mp4 (needs opencv, which comes with stable_baselines3[extra]) or .gif (needs Pillow, which matplotlib brings).
+'''
+
+import os
+import queue
+import threading
+import numpy as np
+import gymnasium as gym
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class VideoEncoder:
+    '''
+    Encodes frames into a video file on a background thread.
+    '''
+
+    def __init__(self, path, fps, max_queued_frames=256):
+        '''
+        :param path: output file, .mp4 or .gif
+        :param fps: playback frame rate
+        :param max_queued_frames: add_frame() blocks once this many frames are waiting (bounds memory use)
+        '''
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in ('.mp4', '.gif'):
+            raise ValueError(f"Unsupported video format '{extension}', expected .mp4 or .gif")
+        self.path = path
+        self.fps = fps
+        self.extension = extension
+        self.frames_written = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_queued_frames)
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def add_frame(self, frame):
+        ''' Queues an (height, width, 3) uint8 RGB frame. The frame must not be modified afterwards. '''
+        if self.error is not None:
+            raise RuntimeError(f"Video encoding failed for {self.path}") from self.error
+        self.queue.put(frame)
+
+    def close(self):
+        ''' Waits for all queued frames to be encoded and finishes the file. '''
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Video encoding failed for {self.path}") from self.error
+
+    def _encode(self):
+        try:
+            if self.extension == '.mp4':
+                self._encode_mp4()
+            else:
+                self._encode_gif()
+        except Exception as e:
+            self.error = e
+            # keep draining so add_frame() never blocks forever
+            while self.queue.get() is not None:
+                pass
+
+    def _encode_mp4(self):
+        import cv2
+        writer = None
+        while (frame := self.queue.get()) is not None:
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+            writer.write(np.ascontiguousarray(frame[..., ::-1]))  # OpenCV wants BGR
+            self.frames_written += 1
+        if writer is not None:
+            writer.release()
+
+    def _encode_gif(self):
+        from PIL import Image
+        images = []
+        while (frame := self.queue.get()) is not None:
+            # palette conversion is the slow part of GIF encoding, so do it here as frames arrive
+            images.append(Image.fromarray(np.ascontiguousarray(frame)).quantize())
+            self.frames_written += 1
+        if images:
+            images[0].save(self.path, save_all=True, append_images=images[1:], duration=1000 / self.fps, loop=0)
+
+
+class VideoRecorder(gym.Wrapper):
+    '''
+    Records episodes of an rgb_array env to video files, one file per recorded episode.
+    '''
+
+    def __init__(self, env, video_folder, name_prefix='rollout', frame_skip=1, episode_trigger=None, extension='mp4'):
+        '''
+        :param env: env created with render_mode='rgb_array'
+        :param video_folder: where videos go (created if needed)
+        :param name_prefix: videos are named <name_prefix>-episode-<n>.<extension>
+        :param frame_skip: keep one frame every frame_skip steps (the video still plays in real time)
+        :param episode_trigger: function of the episode number deciding whether to record it (default: all)
+        :param extension: 'mp4' or 'gif'
+        '''
+        super().__init__(env)
+        if env.render_mode != 'rgb_array':
+            raise ValueError(f"VideoRecorder needs render_mode='rgb_array', not '{env.render_mode}'")
+        os.makedirs(video_folder, exist_ok=True)
+        self.video_folder = video_folder
+        self.name_prefix = name_prefix
+        self.frame_skip = max(int(frame_skip), 1)
+        self.episode_trigger = episode_trigger or (lambda episode: True)
+        self.extension = extension
+        self.fps = env.metadata['render_fps'] / self.frame_skip
+        self.episode = -1
+        self.episode_steps = 0
+        self.encoder = None
+        self.videos = []
+
+    def reset(self, **kwargs):
+        self._finish_video()
+        obs, info = self.env.reset(**kwargs)
+        self.episode += 1
+        self.episode_steps = 0
+        if self.episode_trigger(self.episode):
+            path = os.path.join(self.video_folder, f"{self.name_prefix}-episode-{self.episode}.{self.extension}")
+            self.encoder = VideoEncoder(path, self.fps)
+            self.encoder.add_frame(self.env.render())
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.episode_steps += 1
+        if self.encoder is not None and self.episode_steps % self.frame_skip == 0:
+            self.encoder.add_frame(self.env.render())
+        return obs, reward, terminated, truncated, info
+
+    def _finish_video(self):
+        if self.encoder is not None:
+            self.encoder.close()
+            self.videos.append(self.encoder.path)
+            logger.info(f"Saved video {self.encoder.path} ({self.encoder.frames_written} frames)")
+            self.encoder = None
+
+    def close(self):
+        self._finish_video()
+        super().close()
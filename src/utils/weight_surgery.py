@@ -0,0 +1,136 @@
+'''
+Weight surgery: carrying a trained PPO checkpoint over to a new observation layout (run it with transplant_checkpoint.py).
+
+Changing what BaseEnv observes (say turning on contact_obs) changes the observation size, and every existing
+checkpoint stops loading. But the observation is a list of named segments (BaseEnv.observation_segments), and only
+the first layer of the policy and value networks reads it directly, one weight column per input. So a checkpoint
+can be moved to a new layout by moving those columns:
+
+    old layout:  joint_positions | joint_velocities | ... | target_turn | foot_positions
+    new layout:  joint_positions | joint_velocities | ... | target_turn | foot_contacts
+                 copied            copied                   copied        zeros (new)     foot_positions dropped
+
+New inputs start with zero weights, so the transplanted policy acts exactly like the old one did without the
+dropped inputs, and training learns to use the new ones from there. Adam's running moments are moved the same way,
+and everything else (the deeper layers, log_std, timestep count, hyperparameters) is kept as is.
+'''
+
+import os
+import numpy as np
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+# First layers of SB3's MlpPolicy, the only parameters that see the observation
+FIRST_LAYER_SUFFIX = '_net.0.weight'
+
+
+def parse_layout(text):
+    ''' 'joint_positions:12,joint_velocities:12,...' -> [('joint_positions', 12), ('joint_velocities', 12), ...] '''
+    segments = []
+    for item in text.split(','):
+        name, _, size = item.strip().partition(':')
+        if not name or not size.isdigit():
+            raise ValueError(f"Can't read '{item}' as a layout segment, expected name:size")
+        segments.append((name, int(size)))
+    return segments
+
+
+def column_map(old_segments, new_segments):
+    '''
+    Where each input of the new layout comes from in the old one.
+
+    :param old_segments: list of (name, size) of the checkpoint's observation
+    :param new_segments: list of (name, size) of the env it's moved to
+    :return: int array with the old column of every new column, -1 for new inputs
+    :raises ValueError: if a segment is in both layouts with different sizes (e.g. a different robot)
+    '''
+    old_offsets, offset = {}, 0
+    for name, size in old_segments:
+        old_offsets[name] = (offset, size)
+        offset += size
+    columns = []
+    for name, size in new_segments:
+        if name not in old_offsets:
+            columns.extend([-1] * size)
+            continue
+        old_offset, old_size = old_offsets[name]
+        if old_size != size:
+            raise ValueError(f"'{name}' has {old_size} values in the old layout and {size} in the new one, "
+                             f"its weights can't be carried over")
+        columns.extend(range(old_offset, old_offset + size))
+    return np.array(columns, dtype=np.int64)
+
+
+def describe_surgery(old_segments, new_segments):
+    ''' Which segments are kept, added and dropped, for printing '''
+    old_names, new_names = [name for name, _ in old_segments], [name for name, _ in new_segments]
+    return {'kept': [name for name in new_names if name in old_names],
+            'added': [name for name in new_names if name not in old_names],
+            'dropped': [name for name in old_names if name not in new_names]}
+
+
+def _remap_columns(tensor, columns):
+    import torch
+    remapped = torch.zeros((tensor.shape[0], len(columns)), dtype=tensor.dtype, device=tensor.device)
+    kept = torch.as_tensor(np.flatnonzero(columns >= 0))
+    remapped[:, kept] = tensor[:, torch.as_tensor(columns[columns >= 0])]
+    return remapped
+
+
+def transplant_checkpoint(checkpoint_path, old_segments, new_env, out_path):
+    '''
+    Saves a copy of a checkpoint that fits new_env's observation layout.
+
+    :param checkpoint_path: the PPO checkpoint
+    :param old_segments: list of (name, size) of the observation it was trained on
+    :param new_env: the BaseEnv (possibly wrapped) it's moved to
+    :param out_path: where to save the transplanted checkpoint (load it with PPO.load(out_path, env=new_env))
+    :return: describe_surgery() of the change, plus the checkpoint's 'timesteps'
+    '''
+    from stable_baselines3.common.save_util import load_from_zip_file, save_to_zip_file
+
+    base_env = new_env.unwrapped
+    new_segments = base_env.observation_segments
+    data, params, pytorch_variables = load_from_zip_file(checkpoint_path, device='cpu')
+    old_size = data['observation_space'].shape[0]
+    if sum(size for _, size in old_segments) != old_size:
+        raise ValueError(f"The old layout has {sum(size for _, size in old_segments)} values, "
+                         f"{os.path.basename(checkpoint_path)} observes {old_size}")
+    if data['action_space'].shape != base_env.action_space.shape:
+        raise ValueError(f"{os.path.basename(checkpoint_path)} has action shape {data['action_space'].shape}, "
+                         f"the new env's is {base_env.action_space.shape}")
+    columns = column_map(old_segments, new_segments)
+
+    policy = params['policy']
+    first_layers = [name for name in policy if name.startswith('mlp_extractor.') and name.endswith(FIRST_LAYER_SUFFIX)]
+    if not first_layers or any(policy[name].shape[1] != old_size for name in first_layers):
+        raise ValueError(f"{os.path.basename(checkpoint_path)} doesn't look like an MlpPolicy reading its observation "
+                         f"in {first_layers}")
+    for name in first_layers:
+        policy[name] = _remap_columns(policy[name], columns)
+
+    # Adam keeps its moments per parameter, in the order of policy.parameters() (= the policy's state_dict order,
+    # an MlpPolicy has no buffers)
+    optimizer = params.get('policy.optimizer')
+    if optimizer is not None:
+        parameter_ids = [i for group in optimizer['param_groups'] for i in group['params']]
+        if len(parameter_ids) == len(policy):
+            for name, parameter_id in zip(policy, parameter_ids):
+                if name in first_layers and parameter_id in optimizer['state']:
+                    state = optimizer['state'][parameter_id]
+                    for moment in ('exp_avg', 'exp_avg_sq'):
+                        state[moment] = _remap_columns(state[moment], columns)
+        else:
+            logger.warning("⚠️  Optimizer state doesn't line up with the policy's parameters, Adam starts over")
+            optimizer['state'] = {}
+
+    data['observation_space'] = base_env.observation_space
+    # the last observation is in the old layout, the next learn() resets the env anyway
+    for name in ('_last_obs', '_last_original_obs'):
+        if name in data:
+            data[name] = None
+    save_to_zip_file(out_path, data=data, params=params, pytorch_variables=pytorch_variables)
+    return {**describe_surgery(old_segments, new_segments), 'timesteps': int(data['num_timesteps'])}
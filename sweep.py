@@ -0,0 +1,36 @@
+'''
+Parallel hyperparameter / reward weight sweeps with successive halving.
+
+    python sweep.py sweeps/servobot_rewards.json --workers 16
+
+Trials are trained in a process pool (one per core by default) and the losing ones are stopped early based on
+their evaluation returns at each rung (see src/utils/sweep.py for the sweep file format). Results go into
+models/sweeps/<sweep name>/ by default. Rerunning the same command resumes an interrupted sweep, and raising
+"trials" in the file adds more trials to a finished one.
+'''
+
+import os
+import argparse
+
+from src.utils.sweep import load_sweep, run_sweep
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep PPO hyperparameters and reward weights with successive halving')
+    parser.add_argument('sweep_file', type=str,
+                        help='JSON file with the robot, budgets and search space (format in src/utils/sweep.py)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of trials trained in parallel (default: one per CPU core)')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Folder for the results database and models (default: models/sweeps/<sweep file name>/)')
+    args = parser.parse_args()
+
+    spec = load_sweep(args.sweep_file)
+    out_dir = args.out or os.path.join('models', 'sweeps', os.path.splitext(os.path.basename(args.sweep_file))[0])
+    leaderboard = run_sweep(spec, out_dir, workers=args.workers)
+
+    print(f"\n{'='*50}")
+    print("Best trials (furthest rung, then score):")
+    print(f"{'='*50}")
+    for trial, rung, score, params, model_path in leaderboard[:10]:
+        print(f"Trial {trial:3d}  rung {rung}  score {score:10.2f}  {params}")
+    print(f"\nBest model: {leaderboard[0][4]} (details in {os.path.join(out_dir, 'best.json')})")
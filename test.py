@@ -2,5 +2,874 @@
 Currently this file doesn't do anything but eventually we should have some sort of quick, headless 
 test framework written here so we can quickly run a bunch of tests on a model and see how it performs 
 in different scenarios/environments. -clay
+
+For now it holds quick headless sanity checks. Run them all with `python test.py`.
 '''
 
+import os
+import sys
+import json
+import time
+import subprocess
+import tempfile
+import numpy as np
+import pybullet as p
+import pybullet_data
+
+from src.envs.env import BaseEnv, get_min_z
+from src.utils.config import ROBOTS
+from src.utils.kinematics import IK, FK, IKTable
+from src.utils.urdf_kinematics import LegKinematics, invert_transform
+from src.utils.terrain import Terrain, generate_heightfield
+from src.utils.height_scan import HeightScan
+from src.utils.camera import Camera
+from src.utils.video import VideoRecorder
+from src.utils.realtime import RealTimePacer
+from src.utils.live_view import StateReader
+from src.utils.checkpoint_watcher import CheckpointWatcher
+from src.utils.sweep import SWEEP_DEFAULTS, ResultsDB, rung_budgets, run_sweep, load_sweep
+from src.utils.pbt import PBT_DEFAULTS, PopulationDB, run_pbt, load_pbt
+from src.utils.trajectories import TrajectoryRecorder, load_trajectories
+from src.utils.relabel import reward_terms, relabel_report
+from src.utils.reward import reward_kernel, REWARD_WEIGHTS
+from src.utils.reward_diagnostics import collect_reward_terms, summarize
+from src.utils.resume import ResumableEnv, SnapshotCallback, load_snapshot
+from src.utils.checkpoint_metadata import (write_metadata, load_index, find_checkpoints, check_compatible,
+                                           backfill_metadata, IncompatibleCheckpointError, INDEX_FILE)
+from src.utils.weight_surgery import column_map, transplant_checkpoint
+from src.utils.log import get_logger, EventLog
+from src.utils.frame_history import FrameHistory
+
+
+def test_fk_ik_round_trip():
+    ''' Foot targets -> IK.solve -> FK.solve should land back on the same targets wherever IK says they are reachable. '''
+    ik = IK()
+    fk = FK.from_ik(ik)
+    rng = np.random.default_rng(0)
+    targets = np.tile([0.0, 0.0, -0.13], 4) + rng.uniform(-0.08, 0.08, size=(2000, 12))
+
+    cfgs, valid = ik.solve_batch(targets)
+    assert valid.any()
+    leg_error = np.abs(fk.solve_batch(cfgs) - targets).reshape(-1, 4, 3).max(axis=-1)
+    assert leg_error[valid].max() < 1e-9
+
+    # The single-target solvers should agree with the batched ones
+    for target, cfg in zip(targets[:50], cfgs[:50]):
+        with np.errstate(invalid='ignore'):
+            single_cfg = ik.solve(target)
+        reachable = np.isfinite(single_cfg)
+        assert np.allclose(single_cfg[reachable], cfg[reachable])
+        assert np.allclose(fk.solve(cfg), fk.solve_batch(cfg[None])[0])
+
+
+def test_ik_table_matches_solver_and_drives_foot_actions():
+    ''' The IK table is written atomically, lookup agrees with lookup_batch, its error report bounds the error against
+    IK.solve, and the whole foot action box drives the env without unreachable legs. '''
+    ik = IK()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ik.npy')
+        IKTable.load_or_build(path, ik, resolution=32)
+        assert sorted(os.listdir(directory)) == ['ik.npy', 'ik.npy.json']  # no temp files left behind
+        table = IKTable.load_or_build(path, ik, resolution=32)
+        assert isinstance(table.table, np.memmap)
+        report = table.error_report(ik)
+
+        rng = np.random.default_rng(1)
+        targets = np.tile([0.0, 0.0, -0.18], 4) + rng.uniform(-0.05, 0.05, size=(300, 12))
+        batch_cfgs, batch_valid = table.lookup_batch(targets)
+        assert batch_valid.any()
+        for target, batch_cfg, valid in zip(targets, batch_cfgs, batch_valid):
+            cfg = table.lookup(target)
+            assert np.allclose(cfg, batch_cfg) and np.array_equal(table.last_valid, valid)
+            with np.errstate(invalid='ignore'):
+                exact = ik.solve(target)
+            checked = valid & np.isfinite(exact).reshape(4, 3).all(axis=1)
+            assert np.all(np.abs(cfg - exact).reshape(4, 3).max(axis=1)[checked] <= report['max_angle_error'])
+        del table
+
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], action_mode='foot',
+                  reward_history_file=False)
+    env.reset(seed=0)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        action = rng.choice([-1.0, 0.0, 1.0], size=12).astype(np.float32)  # corners and faces of the box
+        obs = env.step(action)[0]
+        assert np.all(env.ik_table.last_valid) and np.all(np.isfinite(obs))
+    env.close()
+
+
+
+def test_urdf_kinematics_matches_pybullet():
+    ''' URDF leg kinematics should put every foot where PyBullet puts it, for every robot we train. '''
+    def pose_to_transform(position, orientation):
+        transform = np.eye(4)
+        transform[:3, :3] = np.array(p.getMatrixFromQuaternion(orientation)).reshape(3, 3)
+        transform[:3, 3] = position
+        return transform
+
+    rng = np.random.default_rng(0)
+    for robot in ROBOTS.values():
+        legs = LegKinematics.from_urdf(robot['urdf_file'], body_link=robot.get('body_link'))
+        client = p.connect(p.DIRECT)
+        robot_id = p.loadURDF(robot['urdf_file'], useFixedBase=True, physicsClientId=client)
+        joint_index = {}
+        link_index = {}
+        for i in range(p.getNumJoints(robot_id, physicsClientId=client)):
+            info = p.getJointInfo(robot_id, i, physicsClientId=client)
+            joint_index[info[1].decode()] = i
+            link_index[info[12].decode()] = i
+
+        def link_frame(link):
+            if link in link_index:
+                state = p.getLinkState(robot_id, link_index[link], computeForwardKinematics=True, physicsClientId=client)
+                return pose_to_transform(state[4], state[5])
+            # PyBullet reports the base at its centre of mass, so undo the inertial offset
+            position, orientation = p.getBasePositionAndOrientation(robot_id, physicsClientId=client)
+            inertial = p.getDynamicsInfo(robot_id, -1, physicsClientId=client)
+            return pose_to_transform(position, orientation) @ invert_transform(pose_to_transform(inertial[3], inertial[4]))
+
+        for _ in range(5):
+            angles = rng.uniform(legs.lower, legs.upper).reshape(-1)
+            for name, angle in zip(legs.flat_joint_names, angles):
+                p.resetJointState(robot_id, joint_index[name], angle, physicsClientId=client)
+            world_to_body = invert_transform(link_frame(legs.body_link))
+            feet = legs.forward(angles).reshape(-1, 3)
+            for leg, foot_link in enumerate(legs.foot_links):
+                tip = link_frame(foot_link) @ np.append(legs.post[leg, -1, :3, 3], 1.0)
+                assert np.allclose((world_to_body @ tip)[:3], feet[leg], atol=1e-6)
+        p.disconnect(client)
+
+
+
+def _rollout(env, seed, num_steps=40):
+    ''' Runs a fixed (seeded) action sequence and returns the stacked observations and rewards. '''
+    actions = np.random.default_rng(seed).uniform(-1, 1, size=(num_steps,) + env.action_space.shape)
+    obs, _ = env.reset(seed=seed)
+    trajectory = [np.append(obs, 0.0)]
+    for action in actions:
+        obs, reward, terminated, truncated, _ = env.step(action)
+        trajectory.append(np.append(obs, reward))
+        if terminated or truncated:
+            obs, _ = env.reset()
+    return np.array(trajectory)
+
+
+def test_seeded_env_is_deterministic():
+    ''' Same seed => same commands, momentum and trajectory, both across envs and across resets of one env. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    min_z = get_min_z(urdf_file)
+
+    env = BaseEnv(render_mode='headless', urdf_filename=urdf_file, start_position=[0, 0, -min_z],
+                  reward_history_file=False)
+    first = _rollout(env, seed=123)
+    again = _rollout(env, seed=123)
+    other = _rollout(env, seed=456)
+    env.close()
+
+    env = BaseEnv(render_mode='headless', urdf_filename=urdf_file, start_position=[0, 0, -min_z],
+                  reward_history_file=False)
+    fresh = _rollout(env, seed=123)
+    env.close()
+
+    assert np.array_equal(first, again)
+    assert np.array_equal(first, fresh)
+    assert not np.array_equal(first, other)
+
+
+def test_terrain_heights_match_rays():
+    ''' After each in-place regeneration, rays should hit the terrain at the generated heights (and the env should run on it). '''
+    p.connect(p.DIRECT)
+    terrain = Terrain(types=('rough', 'slope', 'steps'), variants=2)
+    rng = np.random.default_rng(0)
+    for _ in range(6):
+        params = terrain.regenerate(rng)
+        heights = generate_heightfield(params)
+        # sample right on the grid points so there's no interpolation between samples
+        rows = np.arange(0, terrain.rows, 7)
+        xy = (rows - (terrain.rows - 1) / 2) * params['resolution']
+        x, y = np.meshgrid(xy, xy)
+        hits = p.rayTestBatch([[a, b, 2] for a, b in zip(x.ravel(), y.ravel())],
+                              [[a, b, -1] for a, b in zip(x.ravel(), y.ravel())])
+        hit_z = np.array([hit[3][2] for hit in hits])
+        assert np.allclose(hit_z, heights[np.ix_(rows, rows)].ravel(), atol=1e-3), params['type']
+    p.disconnect()
+
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(render_mode='headless', urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)],
+                  terrain=['rough', 'steps'], reward_history_file=False)
+    first = _rollout(env, seed=7, num_steps=20)
+    again = _rollout(env, seed=7, num_steps=20)
+    env.close()
+    assert np.array_equal(first, again)
+
+
+def test_domain_randomization_is_applied_and_seeded():
+    ''' Each reset should push new masses/friction/gravity into PyBullet, and the same seed should give the same dynamics. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(render_mode='headless', urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)],
+                  domain_randomization=True, reward_history_file=False)
+    randomizer = env.randomizer
+    env.reset(seed=3)
+    sample = randomizer.current
+    masses = [p.getDynamicsInfo(env.robot_id, link)[0] for link in randomizer.link_indices]
+    assert np.allclose(masses, randomizer.nominal_masses * sample['mass_scale'])
+    assert np.isclose(p.getDynamicsInfo(env.plane_id, -1)[1], sample['friction'])
+    assert np.isclose(np.linalg.norm(sample['gravity']), 9.81)
+    assert np.allclose(env.joint_forces, env.action_force_limit * sample['motor_strength'])
+
+    env.reset()
+    assert not np.allclose(randomizer.current['mass_scale'], sample['mass_scale'])
+    env.reset(seed=3)
+    assert np.array_equal(randomizer.current['mass_scale'], sample['mass_scale'])
+    assert 'randomization' in env.timing_report()
+    env.close()
+
+
+def test_foot_contacts_carry_robot_weight():
+    ''' Standing still, every foot should be down and the foot normal forces should add up to the robot's weight. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(render_mode='headless', urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)],
+                  contact_obs=True, reward_history_file=False)
+    obs, _ = env.reset(seed=0)
+    assert obs.shape == env.observation_space.shape
+    for _ in range(40):
+        obs, _, _, _, info = env.step(np.zeros(env.action_space.shape))
+    assert info['foot_contacts'].all() and not info['body_contact']
+    assert abs(info['foot_forces'].sum() / env.contacts.weight - 1) < 0.1
+    assert (info['duty_factor'] > 0.5).all()
+    assert np.allclose(obs[-2 * env.contacts.num_feet:], env.contacts.observation())
+    env.close()
+
+
+def test_height_scan_follows_base_yaw():
+    ''' A block on the ground should show up at the front of the scan whichever way the robot is facing. '''
+    p.connect(p.DIRECT)
+    p.setAdditionalSearchPath(pybullet_data.getDataPath())
+    p.loadURDF("plane.urdf")
+    robot = p.createMultiBody(1.0, p.createCollisionShape(p.GEOM_SPHERE, radius=0.05))
+    block = p.createMultiBody(0, p.createCollisionShape(p.GEOM_BOX, halfExtents=[0.1, 0.1, 0.05]))
+    scan = HeightScan(robot, size=(1.0, 0.6), resolution=0.1)
+    for yaw in (0.0, np.pi / 2, 2.5):
+        heading = np.array([np.cos(yaw), np.sin(yaw)])
+        p.resetBasePositionAndOrientation(robot, [0, 0, 0.3], p.getQuaternionFromEuler([0, 0, yaw]))
+        p.resetBasePositionAndOrientation(block, [*(0.45 * heading), 0.05], [0, 0, 0, 1])
+        heights = scan.update().reshape(scan.grid_shape)
+        assert np.allclose(heights[-2:, 3], 0.2, atol=1e-3)  # block top is 0.2 below the base, straight ahead
+        assert np.allclose(heights[:-3], 0.3, atol=1e-3)  # bare ground everywhere else
+    # a bump right under the body, closer than the rays used to start
+    p.resetBasePositionAndOrientation(block, [0, 0, 0.22], [0, 0, 0, 1])
+    assert np.isclose(scan.update().reshape(scan.grid_shape)[5, 3], 0.03, atol=1e-3)
+    p.disconnect()
+
+
+def test_camera_depth_and_frame_rate():
+    ''' A camera looking straight down from 0.5 m should read 0.5 m of depth, and take frames at its own rate. '''
+    p.connect(p.DIRECT)
+    p.setAdditionalSearchPath(pybullet_data.getDataPath())
+    p.loadURDF("plane.urdf")
+    robot = p.createMultiBody(1.0, p.createCollisionShape(p.GEOM_SPHERE, radius=0.05),
+                              p.createVisualShape(p.GEOM_SPHERE, radius=0.05), basePosition=[0, 0, 0.5])
+    camera = Camera(robot, forward=(0, 0, -1), up=(1, 0, 0), width=32, height=24, fov=30, far=2.0, fps=10)
+    image = camera.capture()
+    assert np.isclose(image[12, 16] * camera.params['far'], 0.5, atol=0.01)
+    assert p.getVisualShapeData(robot)[0][7][3] == 1.0  # robot shown again after the frame
+
+    camera.frames = 0
+    for step in range(240):
+        camera.observation(step / 240)
+    assert camera.frames == 10
+    p.disconnect()
+
+
+def test_rgb_array_recording():
+    ''' rgb_array renders RGB frames offscreen, and the recorder writes one video per episode with the skipped frames left out. '''
+    from PIL import Image
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(render_mode='rgb_array', urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)],
+                  reward_history_file=False)
+    with tempfile.TemporaryDirectory() as folder:
+        env = VideoRecorder(env, folder, name_prefix='test', frame_skip=3, extension='gif')
+        for seed in range(2):
+            env.reset(seed=seed)
+            frame = env.render()
+            assert frame.shape == (240, 320, 3) and frame.dtype == np.uint8 and frame.std() > 0
+            for _ in range(9):
+                env.step(np.zeros(env.action_space.shape))
+        env.close()
+        assert [os.path.basename(video) for video in env.videos] == ['test-episode-0.gif', 'test-episode-1.gif']
+        for video in env.videos:
+            with Image.open(video) as image:
+                assert image.n_frames == 1 + 9 // 3
+
+
+def test_real_time_pacer_absorbs_compute_time():
+    ''' With 2 ms of work per 1/240 s step the pacer should still run at 1x, and a stall shouldn't cause a catch-up burst. '''
+    pacer = RealTimePacer(1 / 240, window=0.2)
+    start = time.perf_counter()
+    for _ in range(120):
+        busy_until = time.perf_counter() + 0.002
+        while time.perf_counter() < busy_until:
+            pass
+        pacer.tick()
+    assert abs((time.perf_counter() - start) - 0.5) < 0.02
+    assert abs(pacer.real_time_factor - 1) < 0.05
+
+    time.sleep(0.3)  # e.g. the window being dragged
+    pacer.tick()
+    start = time.perf_counter()
+    for _ in range(48):
+        pacer.tick()
+    assert time.perf_counter() - start > 0.1  # back to real time (0.2 s of sim) after at most max_lag of catching up
+
+
+
+def test_live_view_publishes_robot_state():
+    ''' Another process attached by name sees the env's latest base pose, joint angles and targets, and the block goes away on close. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    name = f"test_live_view_{os.getpid()}"
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], live_view=name,
+                  reward_history_file=False)
+    env.reset(seed=0)
+    for _ in range(5):
+        env.step(env.action_space.sample())
+    read_state = ("import json; from src.utils.live_view import StateReader; reader = StateReader(%r); "
+                  "state = reader.read(); print(json.dumps({'urdf_file': reader.urdf_file, "
+                  "**{key: np.asarray(value).tolist() for key, value in state.items()}}))" % name)
+    output = subprocess.run([sys.executable, '-c', 'import numpy as np; ' + read_state],
+                            capture_output=True, text=True, check=True).stdout
+    state = json.loads(output)
+    base_pos, base_orn = p.getBasePositionAndOrientation(env.robot_id)
+    assert state['urdf_file'] == os.path.abspath(urdf_file)
+    assert np.allclose(state['base_position'], base_pos) and np.allclose(state['base_orientation'], base_orn)
+    assert np.allclose(state['joint_positions'], [s[0] for s in p.getJointStates(env.robot_id, env.joint_indices)])
+    assert np.allclose(state['target_velocity'], env.target_velocity) and state['target_turn'] == env.target_turn
+    env.close()
+    try:
+        StateReader(name)
+        assert False, "shared memory should be removed by env.close()"
+    except FileNotFoundError:
+        pass
+
+
+
+def test_checkpoint_watcher_follows_and_cycles():
+    ''' New checkpoints become active as they appear (unless one was picked by hand), unreadable ones are skipped and the cache stays bounded. '''
+    with tempfile.TemporaryDirectory() as folder:
+        def save(name, age):
+            path = os.path.join(folder, name)
+            with open(path, 'w') as f:
+                f.write(os.path.basename(name))
+            os.utime(path, (time.time() - age, time.time() - age))
+            return path
+
+        def load(path):
+            with open(path) as f:
+                contents = f.read()
+            if contents == 'broken.zip':
+                raise ValueError("not a checkpoint")
+            return contents
+
+        os.makedirs(os.path.join(folder, 'current'))
+        save('a.zip', 30), save('current/b.zip', 20), save('broken.zip', 10), save('notes.txt', 5)
+        watcher = CheckpointWatcher(folder, load, max_cached=3)
+        assert watcher.poll() == 2 and watcher.active[1] == 'b.zip'
+        assert watcher.poll() == 0  # nothing new
+
+        save('c.zip', 0)  # still being written
+        assert watcher.poll() == 0
+        save('c.zip', 5)
+        watcher.poll()
+        assert watcher.active[1] == 'c.zip' and [entry[2] for entry in watcher.policies] == ['a.zip', 'b.zip', 'c.zip']
+
+        watcher.select(-1)
+        assert watcher.active[1] == 'b.zip'
+        save('d.zip', 2)
+        watcher.poll()
+        # picked by hand, so b stays active (and cached), the oldest one goes
+        assert watcher.active[1] == 'b.zip' and [entry[2] for entry in watcher.policies] == ['b.zip', 'c.zip', 'd.zip']
+        watcher.follow()
+        assert watcher.active[1] == 'd.zip'
+
+
+
+def _fake_segment(job):
+    ''' Stand-in for run_trial_segment: scores peak at learning_rate 3e-4 and improve with training time. '''
+    return -abs(np.log10(job['params']['learning_rate'] / 3e-4)) + 0.1 * np.log(job['to_timesteps'])
+
+
+def _unexpected_segment(job):
+    raise AssertionError(f"a finished sweep shouldn't run anything, got {job}")
+
+
+def test_sweep_halves_and_resumes():
+    ''' Successive halving runs every trial's first rung, fewer at each rung after, promotes the best trial all the way, and a rerun resumes without redoing work. '''
+    spec = {**SWEEP_DEFAULTS, 'trials': 9, 'min_timesteps': 100, 'max_timesteps': 900, 'reduction_factor': 3,
+            'space': {'learning_rate': ['loguniform', 1e-5, 1e-2], 'FALLEN_PENALTY': ['choice', 10, 30]}}
+    assert rung_budgets(100, 900, 3) == [100, 300, 900]
+    with tempfile.TemporaryDirectory() as folder:
+        leaderboard = run_sweep(spec, folder, workers=3, run_segment=_fake_segment)
+        db = ResultsDB(os.path.join(folder, 'sweep.db'))
+        results, trials = db.results(), db.trials()
+        db.close()
+        per_rung = [sum(1 for (_, rung) in results if rung == r) for r in range(3)]
+        assert per_rung[0] == 9 and per_rung[0] > per_rung[1] >= per_rung[2] >= 1
+        best_first_rung = max(trials, key=lambda trial: results[(trial, 0)][0])
+        assert leaderboard[0][0] == best_first_rung and leaderboard[0][1] == 2
+        assert all(params['FALLEN_PENALTY'] in (10, 30) for params in trials.values())
+
+        assert run_sweep(spec, folder, workers=3, run_segment=_unexpected_segment) == leaderboard
+
+        # only weights the reward kernel reads can be swept
+        assert load_sweep('sweeps/servobot_rewards.json')['robot'] == 'servobot'
+        path = os.path.join(folder, 'legacy.json')
+        with open(path, 'w') as f:
+            json.dump({'space': {'SHAKE_PENALTY_WEIGHT': ['uniform', 0.0, 1.0]}}, f)
+        try:
+            load_sweep(path)
+            assert False, "a weight the reward doesn't read should be rejected"
+        except ValueError:
+            pass
+
+
+def _fake_member_segment(job):
+    ''' Stand-in for run_member_segment: the "model" is the score it inherited, a round adds more the closer the learning rate is to 3e-4. '''
+    inherited = 0.0
+    if job['start_model'] is not None:
+        with open(job['start_model']) as f:
+            inherited = float(f.read())
+    score = inherited + 1 - abs(np.log10(job['params']['learning_rate'] / 3e-4))
+    with open(job['model_path'], 'w') as f:
+        f.write(str(score))
+    return score
+
+
+def test_pbt_exploits_and_resumes():
+    ''' The bottom of the population continues from the top's models with perturbed, in-bounds params, models from finished rounds are cleaned up, and a rerun resumes without redoing work. '''
+    spec = {**PBT_DEFAULTS, 'population': 4, 'total_timesteps': 500, 'interval_timesteps': 100, 'exploit_fraction': 0.5,
+            'space': {'learning_rate': ['loguniform', 1e-5, 1e-2], 'FALLEN_PENALTY': ['choice', 10, 30, 50]}}
+    with tempfile.TemporaryDirectory() as folder:
+        leaderboard = run_pbt(spec, folder, workers=2, run_segment=_fake_member_segment)
+        db = PopulationDB(os.path.join(folder, 'pbt.db'))
+        rounds = [db.round(r) for r in range(5)]
+        assert db.last_round() == 4
+        db.close()
+        for previous, members in zip(rounds, rounds[1:]):
+            ranked = sorted(previous, key=lambda member: previous[member]['score'], reverse=True)
+            for member, row in members.items():
+                assert row['start_model'] == previous[row['parent']]['model_path']
+                if member in ranked[2:]:
+                    assert row['parent'] in ranked[:2]
+                else:
+                    assert row['parent'] == member and row['params'] == previous[member]['params']
+                assert 1e-5 <= row['params']['learning_rate'] <= 1e-2 and row['params']['FALLEN_PENALTY'] in (10, 30, 50)
+        # scores are cumulative, so exploiting keeps the best lineage growing
+        assert leaderboard[0][1] == max(row['score'] for row in rounds[4].values()) > max(row['score'] for row in rounds[0].values())
+        assert sorted(os.listdir(folder)) == sorted(['pbt.db', 'best.json'] + [os.path.basename(row['model_path']) for row in rounds[4].values()])
+        with open(os.path.join(folder, 'best.json')) as f:
+            best = json.load(f)
+        assert len(best['lineage']) == 5 and best['lineage'][-1]['member'] == leaderboard[0][0]
+
+        assert run_pbt(spec, folder, workers=2, run_segment=_unexpected_segment) == leaderboard
+
+        # only PPO settings that can change mid-training and weights the reward kernel reads can be explored
+        assert load_pbt('sweeps/servobot_pbt.json')['robot'] == 'servobot'
+        path = os.path.join(folder, 'legacy.json')
+        with open(path, 'w') as f:
+            json.dump({'space': {'HOME_POSITION_PENALTY_WEIGHT': ['uniform', 0.0, 0.6]}}, f)
+        try:
+            load_pbt(path)
+            assert False, "a weight the reward doesn't read should be rejected"
+        except ValueError:
+            pass
+
+
+def test_relabeled_rewards_match_recorded():
+    ''' Recomputing the rewards of recorded servobot rollouts with the recorded weights gives back the env's own rewards, and new weights only change their terms. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False)
+    env.BODY_CONTACT_PENALTY_WEIGHT = 1.0
+    with tempfile.TemporaryDirectory() as folder:
+        env = TrajectoryRecorder(env, folder, episodes_per_file=2)
+        env.action_space.seed(0)
+        for seed in range(3):
+            env.reset(seed=seed)
+            for _ in range(40):
+                _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+                if terminated or truncated:
+                    break
+        env.close()
+        assert len(env.files) == 2
+        data, header = load_trajectories(folder)
+
+    assert len(data['episode_lengths']) == 3 and len(data['reward']) == data['episode_lengths'].sum()
+    terms = reward_terms(data, header['weights'], header['home_position'], header['target_z'])
+    assert np.allclose(terms['total'], data['reward'], atol=1e-3)
+
+    assert set(header['weights']) == set(REWARD_WEIGHTS)
+    try:
+        relabel_report(data, header, {'HOME_POSITION_PENALTY_WEIGHT': 5.0})
+        assert False, "a weight the reward doesn't read should be rejected"
+    except ValueError:
+        pass
+    report = relabel_report(data, header, {'FORWARD_VEL_WEIGHT': 2 * header['weights']['FORWARD_VEL_WEIGHT']})
+    assert report['recompute_error'] < 1e-3
+    lin_vel = report['terms']['lin_vel']
+    assert np.isclose(lin_vel['new']['mean'], 2 * lin_vel['old']['mean'])
+    assert report['terms']['pose']['new'] == report['terms']['pose']['old']
+    assert report['returns']['mean_shift'] > 0
+
+
+def test_recorder_reads_joints_from_any_layout():
+    ''' The recorder keeps the current joint angles whatever the observation layout, also when it has no joint angles
+    or stacks frames (where the oldest frame comes first). '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    options = [{'observation': ['joint_velocities', 'projected_gravity', 'joint_positions', 'target_velocity', 'target_turn']},
+               {'observation': ['joint_velocities', 'projected_gravity', 'target_velocity', 'target_turn']},
+               {'frame_stack': 3, 'stack_actions': True}]
+    for kwargs in options:
+        env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False,
+                      **kwargs)
+        with tempfile.TemporaryDirectory() as folder:
+            env = TrajectoryRecorder(env, folder, episodes_per_file=1)
+            env.action_space.seed(0)
+            env.reset(seed=0)
+            joints = []
+            for _ in range(20):
+                env.step(env.action_space.sample())
+                joints.append([state[0] for state in p.getJointStates(env.unwrapped.robot_id, env.unwrapped.joint_indices)])
+            env.close()
+            data, header = load_trajectories(folder)
+        assert np.allclose(data['joint_positions'], joints, atol=1e-6)
+        assert relabel_report(data, header, {})['recompute_error'] < 1e-3
+
+
+
+def _reference_step_reward(env, rolling_avg_speed, previous_action, action):
+    ''' calculate_step_reward_new as it was written before the reward kernel (scalar, straight from PyBullet). '''
+    current_base_pos, current_base_orient = p.getBasePositionAndOrientation(env.robot_id)
+    base_vel, base_angular_vel = p.getBaseVelocity(env.robot_id)
+    rolling_avg_speed = 0.9*rolling_avg_speed + 0.1*np.array(base_vel)
+    target_angular_vel = env.target_turn * np.array([0,0,1])
+    is_fallen = current_base_pos[2] < 0.025
+    r_lin_vel = env.FORWARD_VEL_WEIGHT * np.exp(-2*np.linalg.norm(np.array(rolling_avg_speed) - np.array(env.target_velocity))**2)
+    r_ang_vel = env.ANGULAR_VEL_WEIGHT * np.exp(-0.01*(np.linalg.norm(np.array(base_angular_vel) - np.array(target_angular_vel))**2))
+    r_height = -20*(current_base_pos[2] - env.start_position[2])**2
+    joint_positions = np.array([state[0] for state in p.getJointStates(env.robot_id, env.joint_indices)])
+    r_pose = -0.075*(np.linalg.norm(joint_positions - np.array(env.home_position))**2)
+    r_action_rate = -0.015*np.linalg.norm(action-previous_action)**2
+    r_lin_vel_z = -0.2*base_vel[2]**2
+    r_rp = -0.4*(1 - p.getMatrixFromQuaternion(current_base_orient)[8])
+    r_survival = (env.SURVIVAL_WEIGHT * 1) if not is_fallen else 0.0
+    r_fallen = -env.FALLEN_PENALTY if is_fallen else 0.0
+    r_body_contact = -env.BODY_CONTACT_PENALTY_WEIGHT if env.contacts.body_contact else 0.0
+    return r_lin_vel+r_ang_vel+ r_height + r_pose + r_action_rate + r_lin_vel_z + r_rp + r_survival - r_fallen + r_body_contact
+
+
+def test_reward_kernel_matches_step_rewards():
+    ''' The env's rewards match the original scalar reward code, and one batched kernel call over all the steps gives the same values. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False)
+    env.ANGULAR_VEL_WEIGHT, env.BODY_CONTACT_PENALTY_WEIGHT = 0.5, 1.0
+    rng = np.random.default_rng(0)
+    rewards, states, averages = [], [], []
+    for seed in range(2):
+        env.reset(seed=seed)
+        for _ in range(60):
+            action = rng.uniform(-1, 1, env.action_space.shape)
+            averages.append(env.rolling_avg_speed.copy())
+            previous_action = np.array(env.previous_action, dtype=float)
+            _, reward, terminated, truncated, info = env.step(action)
+            assert np.isclose(reward, _reference_step_reward(env, averages[-1], previous_action, action), rtol=1e-9, atol=1e-9)
+            rewards.append(reward)
+            states.append({
+                'base_position': info['base_position'], 'base_orientation': info['base_orientation'],
+                'base_velocity': info['base_velocity'], 'base_angular_velocity': info['base_angular_velocity'],
+                'joint_positions': [s[0] for s in p.getJointStates(env.robot_id, env.joint_indices)],
+                'action': action, 'previous_action': previous_action, 'target_velocity': env.target_velocity,
+                'target_turn': env.target_turn, 'body_contact': info['body_contact'],
+            })
+            if terminated or truncated:
+                break
+    batch = {name: np.array([state[name] for state in states]) for name in states[0]}
+    terms, _ = reward_kernel(batch, np.array(averages), env.reward_weights, env.home_position, env.start_position[2])
+    assert np.allclose(terms['total'], rewards, rtol=1e-12, atol=1e-12)
+    env.close()
+
+
+def test_reward_diagnostics_are_consistent_and_cached():
+    history_files = set(os.listdir('history'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = collect_reward_terms('servobot', episodes=4, workers=1, episodes_per_task=2, cache_dir=cache_dir)
+        assert set(os.listdir('history')) == history_files  # workers don't leave reward history files behind
+        assert not results['cached'] and len(results['episode_lengths']) == 4
+        assert results['terms'].shape == (results['episode_lengths'].sum(), 11)
+        # the total column is the terms combined like the kernel does (fallen subtracted)
+        terms = results['terms'].astype(np.float64)
+        assert np.allclose(terms[:, :-1].sum(axis=1) - 2 * terms[:, 8], terms[:, -1], atol=1e-4)
+        summary = summarize(results)
+        assert np.isclose(sum(stats['share'] for name, stats in summary['terms'].items() if name != 'total'), 1.0)
+        assert np.isclose(summary['returns']['mean'] * 4, terms[:, -1].sum(), rtol=1e-6)
+
+        again = collect_reward_terms('servobot', episodes=4, workers=1, episodes_per_task=2, cache_dir=cache_dir)
+        assert again['cached'] and np.array_equal(again['terms'], results['terms'])
+
+
+def test_resumed_training_matches_uninterrupted():
+    ''' Training 128 steps, snapshotting, and resuming in a fresh env for 128 more gives exactly the weights of training 256 steps in one go. '''
+    import torch
+    from stable_baselines3 import PPO
+    urdf_file = ROBOTS['servobot']['urdf_file']
+
+    history_files = set(os.listdir('history'))
+
+    def make_env():
+        # with a reward history file, the resumed run has to carry on writing the same one
+        return ResumableEnv(BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)]))
+
+    def new_model(env):
+        return PPO("MlpPolicy", env, n_steps=64, batch_size=32, n_epochs=2, seed=0, device='cpu', verbose=0)
+
+    env = make_env()
+    model = new_model(env)
+    model.learn(256)
+    expected = {name: value.clone() for name, value in model.policy.state_dict().items()}
+    env.close()
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        env = make_env()
+        model = new_model(env)
+        model.learn(128, callback=SnapshotCallback(run_dir, save_freq=64))
+        history_file = env.unwrapped.reward_history_filename
+        assert len(env.episode['actions']) > 0  # the snapshot is mid-episode, so the replay has something to do
+        env.close()
+        np.random.rand(), torch.rand(1)  # whatever happens in between mustn't matter
+
+        env = make_env()
+        model = load_snapshot(run_dir, env)
+        assert model.num_timesteps == 128 and env.unwrapped.reward_history_filename == history_file
+        model.learn(128, reset_num_timesteps=False)
+        assert model.num_timesteps == 256
+        for name, value in model.policy.state_dict().items():
+            assert torch.equal(value, expected[name]), name
+        env.close()
+    for name in set(os.listdir('history')) - history_files:
+        os.remove(os.path.join('history', name))
+
+
+def test_checkpoint_metadata_index():
+    ''' Sidecars end up in the index, which keeps up with added and deleted checkpoints, and mismatched shapes are rejected without loading. '''
+    from stable_baselines3 import PPO
+    env = BaseEnv(urdf_filename=ROBOTS['servobot']['urdf_file'],
+                  start_position=[0, 0, -get_min_z(ROBOTS['servobot']['urdf_file'])], reward_history_file=False)
+    with tempfile.TemporaryDirectory() as folder:
+        for timesteps in (100, 200):
+            path = os.path.join(folder, f"model_{timesteps}_steps.zip")
+            open(path, 'w').close()
+            write_metadata(path, env, timesteps, eval_score=timesteps / 10)
+        index = load_index(folder)
+        assert sorted(index) == ['model_100_steps.zip', 'model_200_steps.zip']
+        assert index['model_200_steps.zip']['observation_shape'] == list(env.observation_space.shape)
+        assert index['model_100_steps.zip']['env_config_hash'] == index['model_200_steps.zip']['env_config_hash']
+
+        # the index heals itself when checkpoints disappear or sidecars are written behind its back
+        os.remove(os.path.join(folder, 'model_100_steps.zip'))
+        with open(os.path.join(folder, 'model_200_steps.meta.json')) as f:
+            metadata = json.load(f)
+        open(os.path.join(folder, 'other.zip'), 'w').close()
+        with open(os.path.join(folder, 'other.meta.json'), 'w') as f:
+            json.dump({**metadata, 'file': 'other.zip', 'observation_shape': [3]}, f)
+        assert sorted(load_index(folder)) == ['model_200_steps.zip', 'other.zip']
+        with open(os.path.join(folder, INDEX_FILE)) as f:
+            assert sorted(json.load(f)) == ['model_200_steps.zip', 'other.zip']
+
+        assert check_compatible(os.path.join(folder, 'model_200_steps.zip'), env)['timesteps'] == 200
+        try:
+            check_compatible(os.path.join(folder, 'other.zip'), env)
+            assert False, "a mismatched observation shape should be rejected"
+        except IncompatibleCheckpointError:
+            pass
+
+        # older checkpoints get their sidecar from the zip itself
+        os.makedirs(os.path.join(folder, 'saved'))
+        PPO("MlpPolicy", env, n_steps=64, batch_size=32, device='cpu').save(os.path.join(folder, 'saved', 'old.zip'))
+        assert backfill_metadata(folder, robot='servobot') == 1
+        old = {c['file']: c for c in find_checkpoints(folder)}['old.zip']
+        assert old['observation_shape'] == list(env.observation_space.shape) and old['env_config_hash'] is None
+        assert check_compatible(old['path'], env) is not None
+    env.close()
+
+
+def test_transplanted_checkpoint_acts_like_the_original():
+    ''' A checkpoint moved to a layout with foot contacts added acts and values states exactly as before, and keeps training. '''
+    import torch
+    from stable_baselines3 import PPO
+    assert list(column_map([('a', 2), ('b', 1), ('c', 2)], [('c', 2), ('new', 1), ('a', 2)])) == [3, 4, -1, 0, 1]
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False)
+    assert sum(size for _, size in env.observation_segments) == env.observation_space.shape[0]
+    old_segments = env.observation_segments
+    model = PPO("MlpPolicy", env, n_steps=64, batch_size=32, n_epochs=1, seed=0, device='cpu')
+    model.learn(64)
+    env.close()
+
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], contact_obs=True,
+                  reward_history_file=False)
+    with tempfile.TemporaryDirectory() as folder:
+        model.save(os.path.join(folder, 'old.zip'))
+        surgery = transplant_checkpoint(os.path.join(folder, 'old.zip'), old_segments, env, os.path.join(folder, 'new.zip'))
+        assert surgery['added'] == ['foot_contacts'] and not surgery['dropped'] and surgery['timesteps'] == 64
+        transplanted = PPO.load(os.path.join(folder, 'new.zip'), env=env, device='cpu')
+
+    obs, _ = env.reset(seed=0)
+    for _ in range(20):
+        obs, _, _, _, _ = env.step(np.zeros(env.action_space.shape))
+    contacts = dict(env.observation_segments)['foot_contacts']
+    assert np.any(obs[-contacts:] != 0)  # standing, so the new inputs aren't trivially zero
+    with torch.no_grad():
+        old_obs = torch.as_tensor(obs[None, :-contacts])
+        new_obs = torch.as_tensor(obs[None])
+        assert torch.allclose(model.policy.get_distribution(old_obs).distribution.mean,
+                              transplanted.policy.get_distribution(new_obs).distribution.mean)
+        assert torch.allclose(model.policy.predict_values(old_obs), transplanted.policy.predict_values(new_obs))
+    transplanted.learn(64, reset_num_timesteps=False)
+    assert transplanted.num_timesteps == 128
+    env.close()
+
+
+def test_event_log_rate_limits_and_counts():
+    ''' Repeated events are logged once, then counted and summarized, and an env logs a repeated config update once. '''
+    import logging
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+
+        def emit(self, record):
+            self.lines.append(record.getMessage())
+
+    handler = ListHandler()
+    logger = get_logger('test_event_log')
+    logger.addHandler(handler)
+    log = EventLog(logger, interval=60.0)
+    for _ in range(1000):
+        log.event('jump', "jump")
+    log.event('other', "other")
+    assert handler.lines == ["jump", "other"] and log.counts == {'jump': 1000, 'other': 1}
+    log.flush()
+    assert len(handler.lines) == 3 and handler.lines[2].startswith("jump (x999 in the last")
+    log.flush()
+    assert len(handler.lines) == 3
+
+    # a burst that stops gets its count logged once the interval has passed, at any later event or flush_due()
+    log = EventLog(logger, interval=0.05)
+    for _ in range(10):
+        log.event('jump', "jump")
+    time.sleep(0.06)
+    log.event('other', "other")
+    assert handler.lines[3] == "jump" and handler.lines[4].startswith("jump (x9 in the last") and handler.lines[5] == "other"
+    log.event('other', "other")
+    time.sleep(0.06)
+    log.flush_due()
+    assert handler.lines[6:] == ["other"] and not log.pending
+    logger.removeHandler(handler)
+
+    env = BaseEnv(urdf_filename=ROBOTS['servobot']['urdf_file'], reward_history_file=False)
+    for _ in range(100):
+        env.update_config({'SURVIVAL_WEIGHT': 0.5, 'NOT_A_PARAMETER': 1})
+    assert env.SURVIVAL_WEIGHT == 0.5
+    assert env.log.counts == {'update_SURVIVAL_WEIGHT': 1, 'invalid_NOT_A_PARAMETER': 100}
+    env.close()
+
+
+def test_observation_layout_from_components():
+    ''' The default layout is unchanged, and a custom one puts each component at its offsets with the right values. '''
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], contact_obs=True,
+                  reward_history_file=False)
+    assert env.observation_space.shape == (65 + 8,) and env.observation_segments[-1] == ('foot_contacts', 8)
+    env.close()
+
+    # servobot's feet are in the body frame like every other robot's (not all at [0, 0, -h] in per-leg frames)
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], foot_obs=True,
+                  reward_history_file=False)
+    obs, _ = env.reset(seed=0)
+    joints = np.array([state[0] for state in p.getJointStates(env.robot_id, env.joint_indices)])
+    feet = obs[env.observation_offsets['foot_positions']].reshape(4, 3)
+    assert np.allclose(feet, env.leg_kinematics.forward(joints[env.fk_joint_order])[0].reshape(4, 3), atol=1e-6)
+    assert min(np.linalg.norm(a - b) for i, a in enumerate(feet) for b in feet[i + 1:]) > 0.1
+    env.close()
+
+    layout = ['joint_velocities', 'base_height', 'projected_gravity', 'target_turn']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], observation=layout,
+                  reward_history_file=False)
+    assert env.observation_components == layout and env.observation_space.shape == (12 + 1 + 3 + 1,)
+    obs, _ = env.reset(seed=0)
+    for _ in range(10):
+        obs, _, _, _, _ = env.step(env.action_space.sample())
+    assert obs.dtype == np.float32 and obs.shape == env.observation_space.shape
+    offsets = env.observation_offsets
+    velocities = [state[1] for state in p.getJointStates(env.robot_id, env.joint_indices)]
+    base_pos, base_orient = p.getBasePositionAndOrientation(env.robot_id)
+    down = -np.array(p.getMatrixFromQuaternion(base_orient)).reshape(3, 3).T @ [0, 0, 1]
+    assert np.allclose(obs[offsets['joint_velocities']], velocities, atol=1e-5)
+    assert np.isclose(obs[offsets['base_height']][0], base_pos[2])
+    assert np.allclose(obs[offsets['projected_gravity']], down, atol=1e-6)
+    assert np.isclose(obs[offsets['target_turn']][0], env.target_turn)
+    assert env._get_obs() is not env._get_obs()  # callers get copies of the reused buffer
+    env.close()
+    try:
+        BaseEnv(urdf_filename=urdf_file, observation=['joint_positions', 'base_heights'], reward_history_file=False)
+        assert False, "an unknown component should be rejected"
+    except ValueError:
+        pass
+
+
+def test_frame_history_stacks_and_clears_on_auto_reset():
+    ''' The ring buffer returns the last K rows oldest first, and a vector env's automatic reset starts a clean history. '''
+    from stable_baselines3.common.vec_env import DummyVecEnv
+    history = FrameHistory(2, 3, action_size=1)
+    history.write([0, 0], [9])
+    assert np.array_equal(history.view(), [0, 0, 9] * 3)
+    for t in range(1, 6):
+        history.advance()
+        history.write([t, t], [t - 1])
+    assert np.array_equal(history.view(), [3, 3, 2, 4, 4, 3, 5, 5, 4])
+    history.clear()
+    history.write([7, 7], [0])
+    assert np.array_equal(history.view(), [7, 7, 0] * 3)
+
+    urdf_file = ROBOTS['servobot']['urdf_file']
+    env = BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], frame_stack=3, stack_actions=True,
+                  reward_history_file=False)
+    row = env.observation_space.shape[0] // 3
+    env.steps_per_episode = 4 * env.action_skip  # truncate after 4 steps
+    vec_env = DummyVecEnv([lambda: env])
+    vec_env.seed(0)
+    rows = vec_env.reset()[0].reshape(3, row)
+    assert np.all(rows == rows[-1]) and not np.any(rows[:, -12:])
+    offsets = env.observation_offsets
+    for t in range(4):
+        action = np.full(12, 0.1 * (t + 1), dtype=np.float32)
+        obs, _, dones, _ = vec_env.step(action[None])
+        if t < 3:
+            new_rows = obs[0].reshape(3, row)
+            assert np.array_equal(new_rows[:2], rows[1:])  # older rows shift towards the front
+            assert np.allclose(obs[0][offsets['previous_action']], action)
+            joints = [state[0] for state in p.getJointStates(env.robot_id, env.joint_indices)]
+            assert np.allclose(obs[0][offsets['joint_positions']], joints, atol=1e-6)
+            rows = new_rows
+    # the last step ended the episode, so obs is the next episode's first (the old one's is in terminal_observation)
+    assert dones[0]
+    rows = obs[0].reshape(3, row)
+    assert np.all(rows == rows[-1]) and not np.any(rows[:, -12:])
+    vec_env.close()
+
+
+if __name__ == "__main__":
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_') and callable(obj)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"All {len(tests)} tests passed!")
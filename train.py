@@ -20,7 +20,7 @@ import pybullet_data
 import gymnasium as gym
 from gymnasium import spaces
 from stable_baselines3 import PPO
-from stable_baselines3.common.callbacks import CheckpointCallback, CallbackList
+from stable_baselines3.common.callbacks import CallbackList
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -31,6 +31,11 @@ from src.envs import env
 from src.utils import utils
 from src.utils.plotting_callback import LivePlottingCallback, LivePlottingCallbackNoGUI
 from src.utils.config import ROBOTS
+from src.utils.live_view import DEFAULT_LIVE_VIEW_NAME
+from src.utils.observations import OBSERVATION_COMPONENTS
+from src.utils.trajectories import TrajectoryRecorder
+from src.utils.checkpoint_metadata import MetadataCheckpointCallback
+from src.utils.resume import ResumableEnv, SnapshotCallback, save_run_args, load_run_args, latest_snapshot, load_snapshot, restore_plot_history
 
 if __name__ == "__main__":
     # Parse command-line arguments
@@ -48,9 +53,51 @@ if __name__ == "__main__":
                         help='Target speed for the robot (default: 1.0)')
     parser.add_argument('--learning-rate', type=float, default=0.0001,
                         help='Learning rate for PPO (default: 0.0001)')
+    parser.add_argument('--foot-obs', action='store_true',
+                        help='Add foot positions (from forward kinematics) to the observation (servobot only)')
+    parser.add_argument('--action-mode', type=str, default='joint', choices=['joint', 'foot'],
+                        help="Policy outputs joint angle offsets ('joint') or foot position offsets ('foot', servobot only)")
+    parser.add_argument('--terrain', type=str, nargs='+', default=None, choices=['flat', 'rough', 'slope', 'steps'],
+                        help='Train on procedural terrain, picking one of these types every episode (default: flat plane only)')
+    parser.add_argument('--contact-obs', action='store_true',
+                        help="Add foot contact flags and normal forces to the observation")
+    parser.add_argument('--height-scan', action='store_true',
+                        help="Add a ray-cast grid of ground heights around the robot to the observation (grid in config.py)")
+    parser.add_argument('--camera-obs', action='store_true',
+                        help="Add the onboard camera image to the observation (robots with a 'camera' entry in config.py)")
+    parser.add_argument('--observation', type=str, nargs='+', default=None, choices=list(OBSERVATION_COMPONENTS),
+                        help="Observation components, in order (default: the robot's 'observation' in config.py, see observations.py)")
+    parser.add_argument('--frame-stack', type=int, default=1, metavar='K',
+                        help="Observe the last K observation frames, oldest first (default: 1)")
+    parser.add_argument('--stack-actions', action='store_true',
+                        help="Add the action taken before each stacked frame to the observation")
+    parser.add_argument('--domain-randomization', action='store_true',
+                        help="Randomize friction, masses, motor strength, gravity tilt and latency every episode (ranges in config.py)")
+    parser.add_argument('--live-view', type=str, nargs='?', const=DEFAULT_LIVE_VIEW_NAME, default=None, metavar='NAME',
+                        help=f"Publish the robot state so `visualize.py --attach` can watch training (default name: {DEFAULT_LIVE_VIEW_NAME})")
     
+    parser.add_argument('--record-trajectories', type=str, default=None, metavar='DIR',
+                        help="Save the per-step state the reward is computed from into DIR, for relabel_rewards.py")
+    parser.add_argument('--run-dir', type=str, default=None, metavar='DIR',
+                        help="Keep the run resumable in DIR. Rerunning with the same DIR continues exactly where the last snapshot left off")
+    parser.add_argument('--snapshot-freq', type=int, default=20480,
+                        help='Timesteps between snapshots of a --run-dir run (default: 20480)')
     args = parser.parse_args()
 
+    # A run directory with a snapshot in it gets resumed with the arguments it was started with
+    resuming = False
+    if args.run_dir:
+        saved_args = load_run_args(args.run_dir)
+        if saved_args is not None and latest_snapshot(args.run_dir) is not None:
+            resuming = True
+            for name, value in saved_args.items():
+                # watching the run doesn't change it, so these can differ from the first time
+                if name not in ('gui', 'live_view', 'run_dir', 'snapshot_freq'):
+                    setattr(args, name, value)
+            print(f"Resuming the run in {args.run_dir} (its saved arguments override the command line)")
+        else:
+            save_run_args(args.run_dir, vars(args))
+
     # Set render mode based on GUI flag
     render_mode = 'human' if args.gui else 'headless'
     
@@ -72,6 +119,8 @@ if __name__ == "__main__":
     print(f"Render Mode: {render_mode}")
     print(f"Target Speed: {args.target_speed}")
     print(f"Total Timesteps: {args.timesteps}")
+    if args.live_view:
+        print(f"Live View: run `python visualize.py --attach {args.live_view}` to watch")
     print(f"{'='*50}\n")
 
     # Pass box parameters into the environment.
@@ -81,10 +130,30 @@ if __name__ == "__main__":
         urdf_filename=urdf_file, 
         start_position=[0, 0, -min_z],
         target_speed=args.target_speed,
+        foot_obs=args.foot_obs,
+        action_mode=args.action_mode,
+        terrain=args.terrain,
+        domain_randomization=args.domain_randomization,
+        contact_obs=args.contact_obs,
+        height_scan=args.height_scan,
+        camera_obs=args.camera_obs,
+        observation=args.observation,
+        frame_stack=args.frame_stack,
+        stack_actions=args.stack_actions,
+        live_view=args.live_view,
     )
+    # Optionally record every step for offline reward relabeling (env stays the BaseEnv for the stats below)
+    train_env = env
+    if args.record_trajectories:
+        train_env = TrajectoryRecorder(env, args.record_trajectories, name_prefix=f"{robot_name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    # Keeps what's needed to rebuild the current episode when resuming (see resume.py)
+    if args.run_dir:
+        train_env = ResumableEnv(train_env)
     
-    # Handle model loading - if --model is specified, load it; otherwise create new
-    if args.model:
+    # Handle model loading - resume a run directory, load --model if it's specified, otherwise create new
+    if resuming:
+        model = load_snapshot(args.run_dir, train_env)
+    elif args.model:
         # Specific model file provided
         model_path = args.model
         if not os.path.exists(model_path):
@@ -94,13 +163,13 @@ if __name__ == "__main__":
             print(f"Error: Model file not found at {model_path}")
             exit(1)
         print(f"Loading model from {model_path}")
-        model = PPO.load(model_path, env=env, device='cpu')
+        model = PPO.load(model_path, env=train_env, device='cpu')
     else:
         # Create new model with stable training parameters
         print("Creating new model...")
         model = PPO(
             "MlpPolicy", 
-            env, 
+            train_env, 
             verbose=1, 
             n_steps=2048,
             learning_rate=args.learning_rate,
@@ -109,8 +178,9 @@ if __name__ == "__main__":
             ent_coef=0.01,        # Slight exploration bonus
         )
 
-    # Setup callbacks
-    checkpoint_callback = CheckpointCallback(
+    # Setup callbacks (every checkpoint gets a metadata sidecar, see checkpoint_metadata.py)
+    checkpoint_callback = MetadataCheckpointCallback(
+        env,
         save_freq=100000,
         save_path=os.path.join(save_path, "current/"),
         name_prefix=save_prefix
@@ -138,13 +208,28 @@ if __name__ == "__main__":
         print("  Plots saved every 50k steps")
     
     # Combine callbacks
-    callback_list = CallbackList([checkpoint_callback, plot_callback])
+    callbacks = [checkpoint_callback, plot_callback]
+    if args.run_dir:
+        callbacks.append(SnapshotCallback(args.run_dir, save_freq=args.snapshot_freq, plot_callback=plot_callback, verbose=1))
+        if resuming:
+            restore_plot_history(args.run_dir, plot_callback)
+    callback_list = CallbackList(callbacks)
+
+    # A loaded model keeps counting timesteps, so checkpoint names carry on from where it was saved
+    # (a resumed run trains up to --timesteps in total, a --model run trains --timesteps more)
+    timesteps = args.timesteps - model.num_timesteps if resuming else args.timesteps
+    checkpoint_callback.n_calls = model.num_timesteps  # keeps checkpoints on the same save_freq marks
+    if timesteps <= 0:
+        print(f"This run already finished its {args.timesteps} timesteps.")
+        train_env.close()
+        exit(0)
 
-    print(f"\nStarting training for {args.timesteps} timesteps...")
+    print(f"\nStarting training for {timesteps} timesteps...")
     print("Press Ctrl+C to stop training early.\n")
 
     try:
-        model.learn(total_timesteps=args.timesteps, callback=callback_list, progress_bar=True)
+        model.learn(total_timesteps=timesteps, callback=callback_list, progress_bar=True,
+                    reset_num_timesteps=not (resuming or args.model))
     except KeyboardInterrupt:
         print("Training stopped by user.")
         reward_history = pd.read_csv(env.reward_history_filename)
@@ -157,6 +242,7 @@ if __name__ == "__main__":
         plt.tight_layout()
         plt.show()
     finally:
-        env.close()
+        print("Mean time per call (ms):", {name: round(ms, 3) for name, ms in env.timing_report().items()})
+        train_env.close()
     
     print("Training finished.")
@@ -0,0 +1,76 @@
+'''
+Carries a checkpoint over to a new observation layout, so training with new observations (or without some old ones)
+starts from what the checkpoint already knows instead of from zero (see src/utils/weight_surgery.py).
+
+    # a checkpoint trained without contacts, for training with --contact-obs
+    python transplant_checkpoint.py models/arachne_checkpoints/arachne_model_2000000_steps.zip --robot arachne --contact-obs
+    python train.py --robot arachne --contact-obs --model models/arachne_checkpoints/arachne_model_2000000_steps_contact_obs.zip
+
+The old layout comes from the checkpoint's metadata sidecar when it has one. Otherwise, give the observation options it
+was trained with (--old-options foot_obs), or the layout itself for checkpoints from older env versions
+(--old-layout joint_positions:12,joint_velocities:12,...).
+'''
+
+import os
+import argparse
+
+from src.envs.env import BaseEnv, get_min_z
+from src.utils.config import ROBOTS
+from src.utils.checkpoint_metadata import read_metadata, write_metadata
+from src.utils.weight_surgery import parse_layout, transplant_checkpoint
+
+OBSERVATION_OPTIONS = ('foot_obs', 'contact_obs', 'height_scan', 'camera_obs')
+
+
+def make_env(robot, options, **kwargs):
+    urdf_file = ROBOTS[robot]['urdf_file']
+    return BaseEnv(urdf_filename=urdf_file, start_position=[0, 0, -get_min_z(urdf_file)], reward_history_file=False,
+                   **{option: option in options for option in OBSERVATION_OPTIONS}, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Move a checkpoint to a new observation layout')
+    parser.add_argument('checkpoint', type=str, help='Checkpoint to transplant')
+    parser.add_argument('--robot', type=str, default='simple_quadruped', choices=list(ROBOTS.keys()),
+                        help='Robot the checkpoint is for (default: simple_quadruped)')
+    parser.add_argument('--foot-obs', action='store_true', help='The new layout has foot positions')
+    parser.add_argument('--contact-obs', action='store_true', help='The new layout has foot contacts')
+    parser.add_argument('--height-scan', action='store_true', help='The new layout has the height scan')
+    parser.add_argument('--camera-obs', action='store_true', help='The new layout has the camera image')
+    parser.add_argument('--frame-stack', type=int, default=1, metavar='K', help='The new layout stacks K frames')
+    parser.add_argument('--stack-actions', action='store_true', help='The new layout has the stacked previous actions')
+    parser.add_argument('--old-options', type=str, nargs='*', default=None, choices=OBSERVATION_OPTIONS,
+                        help="Observation options the checkpoint was trained with (if it has no sidecar)")
+    parser.add_argument('--old-layout', type=str, default=None, metavar='NAME:SIZE,...',
+                        help="The checkpoint's observation segments, for checkpoints from older env versions")
+    parser.add_argument('--out', type=str, default=None,
+                        help='Where to save the result (default: next to the checkpoint, named after the new options)')
+    args = parser.parse_args()
+
+    new_options = [option for option in OBSERVATION_OPTIONS if getattr(args, option)]
+    metadata = read_metadata(args.checkpoint)
+    if args.old_layout:
+        old_segments = parse_layout(args.old_layout)
+    elif args.old_options is not None:
+        # one env at a time (PyBullet's default client is per process)
+        old_env = make_env(args.robot, args.old_options)
+        old_segments = old_env.observation_segments
+        old_env.close()
+    elif metadata is not None and 'observation_segments' in metadata:
+        old_segments = [tuple(segment) for segment in metadata['observation_segments']]
+    else:
+        parser.error(f"{args.checkpoint} has no layout in its metadata, pass --old-options or --old-layout")
+
+    suffix = new_options + ([f"stack{args.frame_stack}"] if args.frame_stack > 1 else []) + (['actions'] if args.stack_actions else [])
+    out_path = args.out or f"{os.path.splitext(args.checkpoint)[0]}_{'_'.join(suffix) or 'base'}.zip"
+    env = make_env(args.robot, new_options, frame_stack=args.frame_stack, stack_actions=args.stack_actions)
+    try:
+        surgery = transplant_checkpoint(args.checkpoint, old_segments, env, out_path)
+        write_metadata(out_path, env, surgery['timesteps'], transplanted_from=os.path.abspath(args.checkpoint))
+    finally:
+        env.close()
+
+    print(f"Kept:    {', '.join(surgery['kept'])}")
+    print(f"Added:   {', '.join(surgery['added']) or '-'} (zero weights)")
+    print(f"Dropped: {', '.join(surgery['dropped']) or '-'}")
+    print(f"Saved {out_path}, train on it with --model {out_path} and the same observation options")
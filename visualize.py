@@ -2,12 +2,19 @@
 from stable_baselines3 import PPO
 from stable_baselines3.common.callbacks import CheckpointCallback
 import os
+import time
+import argparse
 import numpy as np
 import pybullet as p
+import pybullet_data
 
 from src.envs.env import BaseEnv, get_min_z
 from src.utils import utils
-from gymnasium import wrappers
+from src.utils.video import VideoRecorder
+from src.utils.live_view import StateReader, DEFAULT_LIVE_VIEW_NAME
+from src.utils.checkpoint_watcher import CheckpointWatcher
+from src.utils.checkpoint_metadata import check_compatible, IncompatibleCheckpointError
+from src.utils.config import ROBOTS
 
 '''
 This script is a mismash of the quadreped run_trained.py and the servobot train.py scripts to load and run a trained servobot model
@@ -16,9 +23,17 @@ but we could prolly get some better results if we ran it longer.
 '''
 
 class VisualizationEnv(BaseEnv):
-    metadata = {'render.modes': ['human', 'rgb_array'], 'video.frames_per_second': 50}
+    # render modes and fps come from BaseEnv ('rgb_array' renders offscreen, see --record below)
     def __init__(self, urdf_filename, start_position=[0,0,0], target_speed=0.5, render_mode='human'):
         super().__init__(render_mode=render_mode, urdf_filename=urdf_filename, start_position=start_position, target_speed=target_speed)
+
+        # Debug items drawn for visualization of orientation/velocity. They're created on the first step and then
+        # updated in place (replaceItemUniqueId), -1 means "not created yet"
+        self.debug_lines = [-1, -1, -1, -1]
+        self.real_time_text = -1
+        # Sliders and debug lines only exist in the GUI. Offscreen (rgb_array) runs just use the env's own targets.
+        if render_mode != 'human':
+            return
         
         # Set up a interactive debug variable for pybullet to control: 
         #   - target velocity direction (0 to 1 times 2pi)
@@ -28,54 +43,37 @@ class VisualizationEnv(BaseEnv):
         self.target_velocity_magnitude_id = p.addUserDebugParameter("Target Velocity Magnitude", 0, 1, 0)
         self.target_turn_id = p.addUserDebugParameter("Target Turn", -1, 1, 0)
 
-        # Initialize debug object lines to be drawn on for visualization of orientation/velocity
-        self.debug_lines = []
-
     def reset(self, seed=None, options=None):
         """Override reset to use slider values instead of random targets"""
         # Call parent reset first
         obs, info = super().reset(seed=seed, options=options)
+        if self.render_mode != 'human':
+            return obs, info
         
-        # Immediately override the random targets with slider values
-        # Read the current slider positions
-        try:
-            direction = p.readUserDebugParameter(self.target_velocity_direction_id) * 2 * 3.14159
-            magnitude = p.readUserDebugParameter(self.target_velocity_magnitude_id)
-            target_turn = p.readUserDebugParameter(self.target_turn_id) * 3.14159 / 2
-            
-            # Set target velocity from sliders
-            self.target_velocity = [magnitude * self.target_speed * np.cos(direction), 
-                                   magnitude * self.target_speed * np.sin(direction), 0]
-            # Set target turn from slider (as scalar)
-            self.target_turn = target_turn
-        except Exception as e:
-            print(f"Warning: Could not read debug sliders in reset: {e}")
-            # Keep the random values from parent reset
-        
-        return obs, info
+        # Immediately override the random targets with slider values (and put them in the first observation)
+        self.read_sliders()
+        return self._get_obs(), info
 
-    def step(self, action):
-        # Read the debug parameters and set the target velocity and turn accordingly
-        try:
-            direction = p.readUserDebugParameter(self.target_velocity_direction_id) * 2 * 3.14159  # 0 to 2pi
-        except Exception as e:
-            print(f"Error reading user debug parameter: {e}")
-            direction = 0  # Default to 0 if there's an error
+    def read_sliders(self):
+        """Sets the target velocity and turn from the GUI sliders (keeps the current targets if they can't be read)"""
         try:
+            direction = p.readUserDebugParameter(self.target_velocity_direction_id) * 2 * np.pi  # 0 to 2pi
             magnitude = p.readUserDebugParameter(self.target_velocity_magnitude_id)  # 0 to 1
-        except Exception as e:
-            print(f"Error reading user debug parameter: {e}")
-            magnitude = 0  # Default to 0 if there's an error
-        try:
-            target_turn = p.readUserDebugParameter(self.target_turn_id) * 3.14159 / 2  # -pi/2 to pi/2
-        except Exception as e:
-            print(f"Error reading user debug parameter: {e}")
-            target_turn = 0  # Default to 0 if there's an error
+            target_turn = p.readUserDebugParameter(self.target_turn_id) * np.pi / 2  # -pi/2 to pi/2
+        except p.error as e:
+            print(f"Error reading user debug parameters: {e}")
+            return
 
         # Convert target velocity into 3d vector
         self.target_velocity = [magnitude * self.target_speed * np.cos(direction), magnitude * self.target_speed * np.sin(direction), 0]
         # Convert target turn to scalar
         self.target_turn = target_turn
+
+    def step(self, action):
+        if self.render_mode != 'human':
+            return super().step(action)
+        # Read the sliders once per step, before stepping, so the observation we return already has the new targets
+        self.read_sliders()
         
         # Debug: Print occasionally to verify values (every 100 steps)
         if self.steps_taken % 100 == 0:
@@ -89,7 +87,7 @@ class VisualizationEnv(BaseEnv):
             vel_error = np.linalg.norm(np.array(current_vel[:2]) - np.array(self.target_velocity[:2]))
             
             # Calculate orientation (which way robot is facing) error
-            yaw_error = abs(current_yaw - target_turn)
+            yaw_error = abs(current_yaw - self.target_turn)
             if yaw_error > np.pi:
                 yaw_error = 2*np.pi - yaw_error
             
@@ -100,69 +98,192 @@ class VisualizationEnv(BaseEnv):
             if vel_direction_error > np.pi:
                 vel_direction_error = 2*np.pi - vel_direction_error
             
-            print(f"Step {self.steps_taken}:")
+            print(f"Step {self.steps_taken} ({self.pacer.real_time_factor:.2f}x real time):")
             print(f"  Target: vel=[{self.target_velocity[0]:.3f}, {self.target_velocity[1]:.3f}] ({target_vel_angle:.2f} rad)")
             print(f"  Current: vel=[{current_vel[0]:.3f}, {current_vel[1]:.3f}] ({current_vel_angle:.2f} rad), face={current_yaw:.2f} rad")
             print(f"  Error: vel_mag={vel_error:.3f} m/s, vel_dir={vel_direction_error:.3f} rad, face_dir={yaw_error:.3f} rad")
 
-        # Clear previous debug lines
-        for line_id in self.debug_lines:
-            p.removeUserDebugItem(line_id)
-        self.debug_lines = []
-        
-        # Get current robot base position from PyBullet
+        self.draw_debug_items()
+        return super().step(action)
+
+    def draw_debug_items(self):
+        """Moves the debug lines and real time readout to the robot's current state (updated in place, not re-added)"""
         start_pos, _ = p.getBasePositionAndOrientation(self.robot_id)
-        
-        # Draw a line indicating the target velocity direction and magnitude
-        # Length scales with velocity magnitude (multiply by a factor for visibility)
-        velocity_scale = 2.0  # Make the line 2x longer than actual velocity for better visibility
-        end_pos = [start_pos[0] + self.target_velocity[0] * velocity_scale, 
-                   start_pos[1] + self.target_velocity[1] * velocity_scale, 
-                   start_pos[2]]
-        line_id = p.addUserDebugLine(start_pos, end_pos, [1, 0, 0], 3)  # Red line (thicker)
-        self.debug_lines.append(line_id)
-        
-        # Get current velocity and orientation of the bot
         current_linear_vel, current_angular_vel = p.getBaseVelocity(self.robot_id)
-        current_pos, current_orientation_quat = p.getBasePositionAndOrientation(self.robot_id)
-        
-        # Draw current velocity vector (dark red: [0.5, 0, 0])
-        current_vel_end_pos = [current_pos[0] + current_linear_vel[0] * velocity_scale,
-                               current_pos[1] + current_linear_vel[1] * velocity_scale,
-                               current_pos[2]]
-        current_vel_line_id = p.addUserDebugLine(current_pos, current_vel_end_pos, [0.5, 0, 0], 3)  # Dark red line
-        self.debug_lines.append(current_vel_line_id)
-        
-        # Draw current angular velocity vector (dark green: [0, 0.5, 0])
-        angular_velocity_scale = 0.5  # Scale down angular velocity for visibility
-        current_angular_vel_end_pos = [current_pos[0] + current_angular_vel[0] * angular_velocity_scale,
-                                       current_pos[1] + current_angular_vel[1] * angular_velocity_scale,
-                                       current_pos[2] + current_angular_vel[2] * angular_velocity_scale]
-        current_angular_vel_line_id = p.addUserDebugLine(current_pos, current_angular_vel_end_pos, [0, 0.5, 0], 3)  # Dark green line
-        self.debug_lines.append(current_angular_vel_line_id)
-
-        # Draw a line indicating the target turn direction (green line)
-        turn_line_length = 0.5  # Fixed length for turn direction line
-        turn_end_pos = [start_pos[0] + turn_line_length * np.cos(self.target_turn), 
-                        start_pos[1] + turn_line_length * np.sin(self.target_turn), 
-                        start_pos[2]]
-        turn_line_id = p.addUserDebugLine(start_pos, turn_end_pos, [0, 1, 0], 1)  # Green line
-        self.debug_lines.append(turn_line_id)
+        draw_velocity_lines(self.debug_lines, start_pos, self.target_velocity, self.target_turn, current_linear_vel, current_angular_vel)
+        self.real_time_text = p.addUserDebugText(f"{self.pacer.real_time_factor:.2f}x real time", np.add(start_pos, [0, 0, 0.3]),
+                                                 textColorRGB=[0, 0, 0], textSize=1.2, replaceItemUniqueId=self.real_time_text)
 
-        return super().step(action)
+
+def draw_velocity_lines(debug_lines, start_pos, target_velocity, target_turn, current_linear_vel, current_angular_vel):
+    """Draws target vs current velocity/turn lines from start_pos, reusing the item ids in debug_lines (-1 = create)"""
+    start_pos = np.array(start_pos)
+    velocity_scale = 2.0  # Make the velocity lines 2x longer than actual velocity for better visibility
+    angular_velocity_scale = 0.5  # Scale down angular velocity for visibility
+    turn_line_length = 0.5  # Fixed length for turn direction line
+    lines = [
+        # (end point, color, width)
+        (start_pos + [target_velocity[0] * velocity_scale, target_velocity[1] * velocity_scale, 0], [1, 0, 0], 3),  # Target velocity: red
+        (start_pos + [current_linear_vel[0] * velocity_scale, current_linear_vel[1] * velocity_scale, 0], [0.5, 0, 0], 3),  # Current velocity: dark red
+        (start_pos + np.array(current_angular_vel) * angular_velocity_scale, [0, 0.5, 0], 3),  # Current angular velocity: dark green
+        (start_pos + [turn_line_length * np.cos(target_turn), turn_line_length * np.sin(target_turn), 0], [0, 1, 0], 1),  # Target turn: green
+    ]
+    for i, (end_pos, color, width) in enumerate(lines):
+        debug_lines[i] = p.addUserDebugLine(start_pos, end_pos, color, width, replaceItemUniqueId=debug_lines[i])
+
+
+def attach(name):
+    """
+    Mirrors a training run started with `train.py --live-view` in a GUI of our own. Only reads the state the trainer
+    publishes, so the training process never waits on us.
+    """
+    try:
+        reader = StateReader(name)
+    except FileNotFoundError:
+        print(f"Nothing published under '{name}' - start training with --live-view {name} first")
+        exit(1)
+    print(f"Attached to '{name}' ({reader.urdf_file}), press Ctrl+C to stop watching")
+
+    p.connect(p.GUI)
+    p.setAdditionalSearchPath(pybullet_data.getDataPath())
+    p.loadURDF("plane.urdf")
+    # The copy never gets stepped, we only ever reset its state
+    robot_id = p.loadURDF(reader.urdf_file, flags=p.URDF_USE_INERTIA_FROM_FILE)
+    # Same joint order as BaseEnv.joint_indices (all the revolute joints)
+    joint_indices = [i for i in range(p.getNumJoints(robot_id)) if p.getJointInfo(robot_id, i)[2] == p.JOINT_REVOLUTE]
+    if len(joint_indices) != reader.num_joints:
+        print(f"Published state has {reader.num_joints} joints but {reader.urdf_file} has {len(joint_indices)}")
+        exit(1)
+
+    debug_lines = [-1, -1, -1, -1]
+    last_sequence = -1
+    last_update = time.perf_counter()
+    waiting = False
+    try:
+        while True:
+            state = reader.read()
+            now = time.perf_counter()
+            if state is not None and state['sequence'] != last_sequence:
+                last_sequence, last_update, waiting = state['sequence'], now, False
+                p.resetBasePositionAndOrientation(robot_id, state['base_position'], state['base_orientation'])
+                for joint_index, angle in zip(joint_indices, state['joint_positions']):
+                    p.resetJointState(robot_id, joint_index, angle)
+                draw_velocity_lines(debug_lines, state['base_position'], state['target_velocity'], state['target_turn'],
+                                    state['base_velocity'], state['base_angular_velocity'])
+                # keep the camera on the robot, at whatever distance/angle the user has set
+                yaw, pitch, distance = p.getDebugVisualizerCamera()[8:11]
+                p.resetDebugVisualizerCamera(distance, yaw, pitch, state['base_position'])
+            elif not waiting and now - last_update > 5.0:
+                print("No updates for 5 seconds (training paused or finished?)")
+                waiting = True
+            time.sleep(1 / 60)
+    except (KeyboardInterrupt, p.error):
+        pass
+    finally:
+        reader.close()
+
+
+def watch_mode(env, directory):
+    """
+    Runs whatever checkpoint the watcher has active, swapping in new ones as training saves them (no restart needed).
+    """
+    def load_policy(path):
+        check_compatible(path, env)  # rejects mismatched checkpoints from their sidecar, without loading them
+        model = PPO.load(path, device='cpu')
+        if model.observation_space.shape != env.observation_space.shape:
+            raise ValueError(f"observation shape {model.observation_space.shape} doesn't match the env's {env.observation_space.shape}")
+        return model
+
+    watcher = CheckpointWatcher(directory, load_policy).start()
+    print(f"Watching {directory} for checkpoints ([ / ] = previous/next loaded checkpoint, Enter = follow the latest)")
+    while watcher.active is None:
+        time.sleep(0.1)
+
+    obs, info = env.reset()
+    total_reward = 0
+    episode_count = 0
+    label = -1
+    label_path = None
+    try:
+        while True:
+            keys = p.getKeyboardEvents()
+            if keys.get(ord('['), 0) & p.KEY_WAS_TRIGGERED:
+                watcher.select(-1)
+            if keys.get(ord(']'), 0) & p.KEY_WAS_TRIGGERED:
+                watcher.select(1)
+            if keys.get(p.B3G_RETURN, 0) & p.KEY_WAS_TRIGGERED:
+                watcher.follow()
+
+            # one read of watcher.active per step, so a swap always happens between steps
+            path, model = watcher.active
+            if path != label_path:
+                label_path = path
+                label = p.addUserDebugText(os.path.basename(path), [0, 0, 0.5], textColorRGB=[0, 0, 0.6], textSize=1.2,
+                                           parentObjectUniqueId=env.robot_id, replaceItemUniqueId=label)
+
+            action, _states = model.predict(obs, deterministic=True)
+            obs, reward, terminated, truncated, info = env.step(action)
+            total_reward += reward
+            if terminated or truncated:
+                episode_count += 1
+                print(f"Episode {episode_count} ({os.path.basename(path)}) finished with total reward: {total_reward:.2f}")
+                obs, info = env.reset()
+                total_reward = 0
+    except KeyboardInterrupt:
+        print("\nVisualization stopped by user.")
+    finally:
+        watcher.close()
+        env.close()
 
 
 if __name__ == "__main__":
-    # To use a different robot, change the filename here
+    parser = argparse.ArgumentParser(description='Run a trained model in the GUI, or record videos of it headless')
+    parser.add_argument('--record', type=str, default=None, metavar='DIR',
+                        help='Record videos into DIR instead of opening the GUI (renders offscreen, faster than real time)')
+    parser.add_argument('--episodes', type=int, default=3,
+                        help='Number of episodes to record with --record (default: 3)')
+    parser.add_argument('--frame-skip', type=int, default=1,
+                        help='Keep one video frame every N env steps with --record (default: 1, i.e. 24 fps)')
+    parser.add_argument('--format', type=str, default='mp4', choices=['mp4', 'gif'],
+                        help='Video format for --record (default: mp4)')
+    parser.add_argument('--attach', type=str, nargs='?', const=DEFAULT_LIVE_VIEW_NAME, default=None, metavar='NAME',
+                        help=f"Watch a headless training run started with --live-view instead of running a model (default name: {DEFAULT_LIVE_VIEW_NAME})")
+    parser.add_argument('--watch', type=str, nargs='?', const='', default=None, metavar='DIR',
+                        help="Keep loading new checkpoints from DIR (default: the robot's save_path) while the GUI runs, "
+                             "[ and ] cycle through the loaded ones, Enter goes back to following the latest")
+    parser.add_argument('--robot', type=str, default=None, choices=list(ROBOTS.keys()),
+                        help='Robot to run with --watch (default: ask)')
+    args = parser.parse_args()
 
-    urdf_file, save_path, save_prefix, model_path = utils.select_robot(load_model=True)
+    if args.attach:
+        attach(args.attach)
+        exit(0)
+    if args.watch is not None and args.record:
+        parser.error("--watch needs the GUI, it can't be combined with --record")
+
+    # To use a different robot, change the filename here
+    if args.watch is not None:
+        # the watcher picks the checkpoints, so no need to ask for a model
+        if args.robot:
+            urdf_file, save_path, save_prefix = (ROBOTS[args.robot][key] for key in ('urdf_file', 'save_path', 'save_prefix'))
+        else:
+            urdf_file, save_path, save_prefix = utils.select_robot(load_model=False)
+    else:
+        urdf_file, save_path, save_prefix, model_path = utils.select_robot(load_model=True)
 
     min_z = get_min_z(urdf_file)
     # Create the environment. Stable-baselines will automatically call reset.
-    env = VisualizationEnv(urdf_filename=urdf_file, start_position=[0, 0, -min_z])
+    render_mode = 'rgb_array' if args.record else 'human'
+    env = VisualizationEnv(urdf_filename=urdf_file, start_position=[0, 0, -min_z], render_mode=render_mode)
     
-    # Optionally wrap with video recording (comment out if you don't want videos)
-    # env = wrappers.RecordVideo(env, video_folder='./videos/', name_prefix='servobot_demo', episode_trigger=lambda x: True)
+    # Optionally wrap with video recording (frames get encoded on a background thread)
+    if args.record:
+        env = VideoRecorder(env, video_folder=args.record, name_prefix=save_prefix,
+                            frame_skip=args.frame_skip, extension=args.format)
+
+    if args.watch is not None:
+        watch_mode(env, args.watch or save_path)
+        exit(0)
 
     # check to make sure we didnt forget to import a model lmao
     if not os.path.exists(model_path):
@@ -170,11 +291,13 @@ if __name__ == "__main__":
         print("Please train your model first using train.py.")
         exit(1)
     
-    # Try to load the trained model
+    # Try to load the trained model (checking its metadata sidecar first, if it has one, is instant)
     try:
+        check_compatible(model_path, env)
         model = PPO.load(model_path, env=env, device='cpu')
     except ValueError as e:
-        if "Unexpected observation shape" in str(e):
+        if isinstance(e, IncompatibleCheckpointError) or "Unexpected observation shape" in str(e):
+            print(f"\n{e}")
             print(f"\n⚠️  ERROR: Model observation space mismatch!")
             print(f"The trained model expects a different observation space than the current environment.")
             print(f"This happens when you modify the environment after training.\n")
@@ -184,6 +307,19 @@ if __name__ == "__main__":
         else:
             raise
 
+    if args.record:
+        for episode in range(args.episodes):
+            obs, info = env.reset()
+            done = False
+            total_reward = 0
+            while not done:
+                action, _states = model.predict(obs, deterministic=True)
+                obs, reward, terminated, truncated, info = env.step(action)
+                done = terminated or truncated
+                total_reward += reward
+            print(f"Episode {episode + 1} finished with total reward: {total_reward:.2f}")
+        env.close()
+        exit(0)
 
     print("Running trained model - adjust sliders to change target velocity/orientation")
     print("=" * 80)
@@ -207,22 +343,7 @@ if __name__ == "__main__":
     # Run indefinitely (press Ctrl+C to stop)
     try:
         while True:
-            # Update targets from sliders BEFORE getting action
-            # This ensures the policy sees the current slider values
-            try:
-                direction = p.readUserDebugParameter(env.target_velocity_direction_id) * 2 * 3.14159
-                magnitude = p.readUserDebugParameter(env.target_velocity_magnitude_id)
-                target_turn = p.readUserDebugParameter(env.target_turn_id) * 3.14159 / 2
-                
-                env.target_velocity = [magnitude * env.target_speed * np.cos(direction), 
-                                      magnitude * env.target_speed * np.sin(direction), 0]
-                env.target_turn = target_turn
-            except:
-                pass  # If reading fails, keep current targets
-            
-            # Get fresh observation with updated targets
-            obs = env._get_obs()
-            
+            # (env.step reads the sliders, so obs already has the current slider targets)
             # Use the trained model to predict the next action
             action, _states = model.predict(obs, deterministic=True)
             